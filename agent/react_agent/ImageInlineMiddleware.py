@@ -0,0 +1,43 @@
+"""
+# 模型调用前内联图片
+# 原理: 会话状态（checkpointer）中只保存图片的原始 URL；每次调用模型前把用户消息中的图片 URL
+#      替换为预处理后的 data URL（缩放、重新编码），只作用于本次模型请求，base64 不会写入会话历史
+# 缓存: 预处理器按 URL 缓存处理结果，历史消息中的同一张图片不会重复下载与处理
+"""
+
+from typing import Awaitable, Callable
+
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from services.common.image.ImagePreprocessor import image_preprocessor
+
+
+class ImageInlineMiddleware(AgentMiddleware):
+    """把模型请求中的图片 URL 替换为 data URL"""
+
+    @staticmethod
+    async def _inline(message: BaseMessage) -> BaseMessage:
+        if not isinstance(message, HumanMessage) or not isinstance(message.content, list):
+            return message
+        positions = [
+            i for i, part in enumerate(message.content)
+            if isinstance(part, dict) and part.get("type") == "image_url"
+            and not part["image_url"]["url"].startswith("data:")
+        ]
+        if not positions:
+            return message
+        data_urls = await image_preprocessor.to_data_urls(
+            [message.content[i]["image_url"]["url"] for i in positions])
+        content = list(message.content)
+        for i, data_url in zip(positions, data_urls):
+            content[i] = {**content[i], "image_url": {**content[i]["image_url"], "url": data_url}}
+        return message.model_copy(update={"content": content})
+
+    async def awrap_model_call(
+            self,
+            request: ModelRequest,
+            handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        messages = [await self._inline(message) for message in request.messages]
+        return await handler(request.override(messages=messages))
@@ -8,6 +8,7 @@ from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
 from agent.ai_chat.AIChatAbstract import AIChatAbstract
 from agent.react_agent.EnhanceTool import EnhanceTool
+from agent.react_agent.ImageInlineMiddleware import ImageInlineMiddleware
 
 load_dotenv()
 
@@ -102,6 +103,7 @@ class ReactAgent(AIChatAbstract):
         content = [
             {"type": "text", "text": user_input}
         ]
+        # 会话历史中只保存原始URL，调用模型前由 ImageInlineMiddleware 预处理并以 data URL 内联
         for image_url in image_list:
             content.append({
                 "type": "image_url",
@@ -184,6 +186,7 @@ class ReactAgent(AIChatAbstract):
                 base_url=self.config.llm_config.openai_api_base
             ),
             tools=tools,
+            middleware=[ImageInlineMiddleware()],
             checkpointer=self.checkpointer
         )
 
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
+from services.common.image.ImagePreprocessor import image_preprocessor
 from utils.common.scheduler.DynamicScheduler import scheduler
 from xiaoyan.router.XiaoYanRouter import router as xiao_yan_router
 
@@ -20,6 +21,8 @@ async def lifespan(app: FastAPI):
     # 关闭时
     print("FastAPI应用关闭，停止调度器...")
     scheduler.shutdown()
+    # 关闭图片预处理的 HTTP 会话与进程池
+    await image_preprocessor.close()
 
 app = FastAPI(lifespan=lifespan)
 # 将调度器实例添加到app状态中，供路由使用
@@ -1,16 +1,78 @@
+import asyncio
+import base64
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
 from fastmcp import FastMCP
 
-mcp = FastMCP(name="DocumentMCP", instructions="文档工具[注意：调用其他方法前，请先调用search_files查询文件是否存在]")
+from mcp_server.common.doucment_mcp import FileEditor, FileGrep, FileReader, FileWalker
+from mcp_server.common.doucment_mcp.FileIndex import file_index, is_index_cursor
+from utils.common.scheduler.DynamicScheduler import scheduler
+
+# PDF 文本提取进程池（首次使用时创建）
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=int(os.getenv("DOCUMENT_PDF_WORKERS", "2")))
+    return _pdf_pool
+
+
+async def refresh_file_index():
+    """在工作线程中增量刷新文件索引"""
+    return await asyncio.to_thread(file_index.refresh)
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """
+    MCP服务生命周期：配置了 DOCUMENT_INDEX_ROOTS 时后台构建文件索引并定时增量刷新；
+    关闭时停止调度器，等待进行中的索引刷新退出后再关闭索引
+    """
+    build_task: Optional[asyncio.Task] = None
+    if file_index.enabled:
+        # 先启动调度器再注册任务，注册时任务即有下次执行时间
+        scheduler.start()
+        scheduler.add_interval_job(
+            func=refresh_file_index,
+            seconds=int(os.getenv("DOCUMENT_INDEX_REFRESH_SECONDS", "300")),
+            job_id="document_file_index_refresh"
+        )
+        build_task = asyncio.create_task(refresh_file_index())
+    yield
+    if file_index.enabled:
+        scheduler.shutdown(wait=False)
+        # 刷新在工作线程中执行，取消任务无法中断线程：先通知索引停止并等待线程退出，再回收任务
+        await asyncio.to_thread(file_index.close)
+        await asyncio.gather(build_task, return_exceptions=True)
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+
+
+mcp = FastMCP(name="DocumentMCP", instructions="文档工具[注意：调用其他方法前，请先调用search_files查询文件是否存在]",
+              lifespan=lifespan)
 
 
 @mcp.tool
-async def search_files(directory: str = ".", pattern: str = "*", recursive: bool = True):
+async def search_files(directory: str = ".", pattern: str = "*", recursive: bool = True, max_depth: int = None,
+                       limit: int = 200, ignore_patterns: List[str] = None, cursor: str = None,
+                       extension: str = None, keyword: str = None):
     """
-    搜索当前目录下的文件
+    搜索当前目录下的文件（分页返回，目录在文件索引范围内时直接查询索引）
     Args:
         directory: 搜索目录，默认为当前目录
-        pattern: 文件匹配模式，支持通配符，默认为所有文件
+        pattern: 文件名匹配模式，支持通配符，默认为所有文件
         recursive: 是否递归搜索子目录，默认为True
+        max_depth: 递归的最大深度，1 表示只搜索当前目录，默认不限制
+        limit: 单页最多返回的文件和目录条数，默认200
+        ignore_patterns: 忽略的目录/文件名（支持通配符），默认忽略 .git、node_modules、__pycache__
+        cursor: 分页游标，传入上一次返回的 next_cursor 获取下一页
+        extension: 扩展名过滤，例如 .py、.md
+        keyword: 相对路径包含的子串，例如 report
     """
     from pathlib import Path
 
@@ -35,57 +97,50 @@ async def search_files(directory: str = ".", pattern: str = "*", recursive: bool
                 "error": "NotADirectoryError"
             }
 
-        files = []
-        directories = []
-
-        # 根据是否递归选择搜索方法
-        if recursive:
-            # 递归搜索
-            for item in search_path.rglob(pattern):
-                if item.is_file():
-                    files.append({
-                        "name": item.name,
-                        "path": str(item),
-                        "relative_path": str(item.relative_to(search_path)),
-                        "size": item.stat().st_size,
-                        "extension": item.suffix,
-                        "parent": str(item.parent)
-                    })
-                elif item.is_dir():
-                    directories.append({
-                        "name": item.name,
-                        "path": str(item),
-                        "relative_path": str(item.relative_to(search_path))
-                    })
+        max_depth = max_depth if recursive else 1
+        # 索引已就绪、目录在索引范围内且使用默认忽略规则时查询索引，否则在工作线程中流式遍历，达到 limit 立即停止
+        use_index = file_index.enabled and file_index.ready and ignore_patterns is None \
+            and file_index.covers(str(search_path)) is not None and (not cursor or is_index_cursor(cursor))
+        if use_index:
+            result = await asyncio.to_thread(
+                file_index.search,
+                str(search_path),
+                pattern=pattern,
+                max_depth=max_depth,
+                limit=max(1, limit),
+                extension=extension,
+                keyword=keyword,
+                cursor=cursor
+            )
         else:
-            # 只搜索当前目录
-            for item in search_path.glob(pattern):
-                if item.is_file():
-                    files.append({
-                        "name": item.name,
-                        "path": str(item),
-                        "relative_path": item.name,
-                        "size": item.stat().st_size,
-                        "extension": item.suffix,
-                        "parent": str(item.parent)
-                    })
-                elif item.is_dir():
-                    directories.append({
-                        "name": item.name,
-                        "path": str(item),
-                        "relative_path": item.name
-                    })
+            result = await asyncio.to_thread(
+                FileWalker.search,
+                str(search_path),
+                pattern=pattern,
+                max_depth=max_depth,
+                limit=max(1, limit),
+                ignore_patterns=FileWalker.DEFAULT_IGNORE_PATTERNS if ignore_patterns is None else ignore_patterns,
+                cursor=None if is_index_cursor(cursor) else cursor,
+                extension=extension,
+                keyword=keyword
+            )
+        files, directories = result["files"], result["directories"]
 
         return {
             "success": True,
-            "message": f"搜索完成，找到 {len(files)} 个文件，{len(directories)} 个目录",
+            "message": f"搜索完成，找到 {len(files)} 个文件，{len(directories)} 个目录"
+                       + ("，还有更多结果，请传入 next_cursor 获取下一页" if result["truncated"] else ""),
             "directory": str(search_path.absolute()),
             "pattern": pattern,
             "recursive": recursive,
             "files": files,
             "directories": directories,
             "total_files": len(files),
-            "total_directories": len(directories)
+            "total_directories": len(directories),
+            "truncated": result["truncated"],
+            "next_cursor": result["next_cursor"],
+            "source": "index" if use_index else "scan",
+            "index_age_seconds": file_index.stats()["age_seconds"] if use_index else None
         }
 
     except Exception as e:
@@ -98,13 +153,99 @@ async def search_files(directory: str = ".", pattern: str = "*", recursive: bool
 
 
 @mcp.tool
-async def read_file(file_name: str):
+async def grep_files(pattern: str, directory: str = ".", literal: bool = False, ignore_case: bool = False,
+                     file_pattern: str = "*", max_depth: int = None, context: int = 0, limit: int = 100,
+                     max_file_bytes: int = FileGrep.DEFAULT_MAX_FILE_BYTES, ignore_patterns: List[str] = None):
+    """
+    在目录下的文件内容中搜索，返回匹配的文件、行号和上下文（查找内容时优先使用，无需逐个 read_file）
+    Args:
+        pattern: 正则表达式，literal=True 时按普通文本搜索
+        directory: 搜索目录，默认为当前目录
+        literal: 是否按普通文本搜索，默认False
+        ignore_case: 是否忽略大小写，默认False
+        file_pattern: 文件名匹配模式，支持通配符，例如 *.py
+        max_depth: 递归的最大深度，1 表示只搜索当前目录，默认不限制
+        context: 匹配行前后各返回的行数，默认0
+        limit: 最多返回的匹配数，默认100，达到后停止搜索
+        max_file_bytes: 单文件大小上限，默认 2MB，超过的文件跳过
+        ignore_patterns: 忽略的目录/文件名（支持通配符），默认忽略 .git、node_modules、__pycache__
+    """
+    import re
+
+    if not os.path.isdir(directory):
+        return {
+            "success": False,
+            "message": f"目录 {directory} 不存在或不是一个目录",
+            "directory": directory,
+            "error": "DirectoryNotFoundError"
+        }
+    try:
+        result = await asyncio.to_thread(
+            FileGrep.grep,
+            directory,
+            pattern,
+            literal=literal,
+            ignore_case=ignore_case,
+            file_pattern=file_pattern,
+            max_depth=max_depth,
+            context=max(0, context),
+            limit=max(1, limit),
+            max_file_bytes=max_file_bytes,
+            workers=int(os.getenv("DOCUMENT_GREP_WORKERS", "8")),
+            ignore_patterns=FileWalker.DEFAULT_IGNORE_PATTERNS if ignore_patterns is None else ignore_patterns
+        )
+        return {
+            "success": True,
+            "message": f"搜索完成，在 {result['files_matched']} 个文件中找到 {len(result['matches'])} 处匹配"
+                       + ("，已达到 limit，缩小范围或调大 limit 获取更多结果" if result["truncated"] else ""),
+            "directory": os.path.abspath(directory),
+            "pattern": pattern,
+            **result
+        }
+    except re.error as e:
+        return {"success": False, "message": f"正则表达式无效: {str(e)}", "pattern": pattern, "error": "PatternError"}
+    except Exception as e:
+        return {"success": False, "message": f"搜索内容失败: {str(e)}", "directory": directory, "error": str(e)}
+
+
+@mcp.tool
+async def file_index_status(refresh: bool = False):
+    """
+    查看文件索引状态（索引覆盖的根目录、条目数、最近一次构建耗时、距上次刷新的秒数）
+    Args:
+        refresh: 是否立即增量刷新索引，文件刚发生大量变化时使用
+    """
+    if not file_index.enabled:
+        return {"success": False, "message": "未配置 DOCUMENT_INDEX_ROOTS，文件索引未启用"}
+    try:
+        stats = await refresh_file_index() if refresh else await asyncio.to_thread(file_index.stats)
+        return {"success": True, "message": "文件索引状态", **stats}
+    except Exception as e:
+        return {"success": False, "message": f"获取文件索引状态失败: {str(e)}", "error": str(e)}
+
+
+@mcp.resource("document://read-cache/stats", mime_type="application/json")
+def read_cache_stats() -> dict:
+    """读取缓存统计：条目数、占用字节数、命中率与淘汰次数"""
+    return FileReader.read_cache.stats()
+
+
+@mcp.tool
+async def read_file(file_name: str, offset: int = None, length: int = None, start_line: int = None,
+                    end_line: int = None, max_bytes: int = FileReader.DEFAULT_MAX_BYTES,
+                    binary_encoding: str = None, extract_text: bool = False):
     """
-    读取文件内容工具
+    读取文件内容工具，大文件请按行或按字节分段读取；二进制文件默认只返回元数据（类型、大小、sha256）
     Args:
         file_name: 文件名
+        offset: 起始字节偏移（按字节区间读取时使用）
+        length: 读取的字节数（按字节区间读取时使用）
+        start_line: 起始行号，从1开始（按行读取时使用，优先于 offset/length；PDF 提取文本时表示起始页）
+        end_line: 结束行号（包含），为空时读到文件末尾（PDF 提取文本时表示结束页）
+        max_bytes: 单次最多返回的字节数，默认 256KB，超出时截断并返回下一段的起始位置
+        binary_encoding: 二进制文件内容编码，传 "base64" 时按 offset / max_bytes 分段返回内容
+        extract_text: 是否提取 PDF 文本
     """
-    import aiofiles
     from pathlib import Path
 
     try:
@@ -128,55 +269,70 @@ async def read_file(file_name: str):
                 "error": "NotAFileError"
             }
 
-        # 尝试判断文件类型（根据扩展名）
-        file_extension = file_path.suffix.lower()
-        binary_extensions = ['.pdf', '.png', '.jpg', '.jpeg', '.gif', '.bmp',
-                             '.zip', '.tar', '.gz', '.exe', '.bin']
-
-        # 根据文件类型选择读取模式
-        if file_extension in binary_extensions:
-            # 二进制模式读取
-            async with aiofiles.open(file_path, mode='rb') as f:  # type: ignore
-                content = await f.read()
-
-            return {
-                "success": True,
-                "message": f"文件 {file_name} 读取成功（二进制）",
-                "file_path": str(file_path.absolute()),
-                "file_type": "binary",
-                "content": content,
-                "size": len(content)
-            }
-        else:
-            # 文本模式读取
-            async with aiofiles.open(file_path, mode='r', encoding='utf-8') as f:  # type: ignore
-                content = await f.read()
-
+        # 读取文件头部判断文件类型（魔数、NUL 字节、UTF-8 合法性），不依赖扩展名
+        max_bytes = max(1, max_bytes)
+        kind = await asyncio.to_thread(FileReader.sniff, str(file_path))
+
+        if kind["binary"]:
+            if extract_text and kind["mime"] == "application/pdf":
+                return await _pdf_text_result(file_path, start_line or 1, end_line, max_bytes)
+            return await _binary_result(file_path, kind["mime"], offset, length, max_bytes, binary_encoding,
+                                        f"文件 {file_name} 为二进制文件")
+
+        if start_line is not None or end_line is not None:
+            # 按行读取：换行索引按 (路径, mtime, size) 缓存，重复读取同一文件只读取所需区间
+            chunk = await asyncio.to_thread(FileReader.read_lines, str(file_path), start_line or 1, end_line,
+                                            max_bytes)
+            content = chunk["data"].decode("utf-8")
+            if chunk["next_offset"] is not None:
+                # 单行超过 max_bytes，该行剩余部分按字节区间继续读取
+                note = f"，第 {chunk['start_line']} 行过长已截断，剩余部分从字节 {chunk['next_offset']} 开始按 offset 读取"
+            else:
+                note = f"，已截断，下一段从第 {chunk['end_line'] + 1} 行开始" if chunk["truncated"] else ""
             return {
                 "success": True,
-                "message": f"文件 {file_name} 读取成功",
+                "message": f"文件 {file_name} 第 {chunk['start_line']}-{chunk['end_line']} 行读取成功" + note,
                 "file_path": str(file_path.absolute()),
                 "file_type": "text",
                 "content": content,
-                "size": len(content),
-                "lines": content.count('\n') + 1
+                "size": chunk["file_size"],
+                "start_line": chunk["start_line"],
+                "end_line": chunk["end_line"],
+                "total_lines": chunk["total_lines"],
+                "mtime_ns": file_path.stat().st_mtime_ns,
+                "truncated": chunk["truncated"],
+                "next_line": chunk["end_line"] + 1 if chunk["truncated"] else None,
+                "next_offset": chunk["next_offset"]
             }
 
+        # 按字节读取（不传区间时从头读取，受 max_bytes 限制）
+        chunk = await asyncio.to_thread(FileReader.read_bytes, str(file_path), offset or 0, length, max_bytes)
+        content = chunk["data"].decode("utf-8")
+        result = {
+            "success": True,
+            "message": f"文件 {file_name} 读取成功"
+                       + (f"，已截断，下一段从字节 {chunk['end']} 开始" if chunk["truncated"] else ""),
+            "file_path": str(file_path.absolute()),
+            "file_type": "text",
+            "content": content,
+            "size": chunk["file_size"],
+            "offset": chunk["offset"],
+            "end": chunk["end"],
+            "mtime_ns": file_path.stat().st_mtime_ns,
+            "truncated": chunk["truncated"],
+            "next_offset": chunk["end"] if chunk["truncated"] else None
+        }
+        if chunk["offset"] == 0 and chunk["end"] == chunk["file_size"]:
+            result["lines"] = content.count('\n') + 1
+        return result
+
     except UnicodeDecodeError:
         # 如果文本解码失败，尝试二进制读取
         try:
-            async with aiofiles.open(file_path, mode='rb') as f:  # type: ignore
-                content = await f.read()
-
-            return {
-                "success": True,
-                "message": f"文件 {file_name} 以二进制模式读取成功",
-                "file_path": str(file_path.absolute()),
-                "file_type": "binary",
-                "content": content,
-                "size": len(content),
-                "warning": "文件包含非UTF-8字符，已使用二进制模式读取"
-            }
+            result = await _binary_result(file_path, "application/octet-stream", offset, length, max_bytes,
+                                          binary_encoding, f"文件 {file_name} 按二进制文件处理")
+            result["warning"] = "文件包含非UTF-8字符，已按二进制文件处理"
+            return result
         except Exception as e:
             return {
                 "success": False,
@@ -194,6 +350,69 @@ async def read_file(file_name: str):
         }
 
 
+async def _binary_result(file_path, mime: str, offset: Optional[int], length: Optional[int], max_bytes: int,
+                         binary_encoding: Optional[str], message: str) -> dict:
+    """二进制文件：返回元数据与内容哈希，指定 binary_encoding="base64" 时附带一段 base64 内容"""
+    sha256 = await asyncio.to_thread(FileReader.content_hash_cache.get, str(file_path))
+    result = {
+        "success": True,
+        "message": message,
+        "file_path": str(file_path.absolute()),
+        "file_type": "binary",
+        "mime_type": mime,
+        "size": file_path.stat().st_size,
+        "sha256": sha256,
+        "content": None
+    }
+    if binary_encoding is None:
+        result["message"] += "，如需内容请传入 binary_encoding=\"base64\" 分段读取" + \
+                             ("，PDF 可传入 extract_text=True 提取文本" if mime == "application/pdf" else "")
+        return result
+    if binary_encoding != "base64":
+        return {"success": False, "message": f"不支持的编码: {binary_encoding}", "file_name": str(file_path),
+                "error": "UnsupportedEncoding"}
+
+    chunk = await asyncio.to_thread(FileReader.read_bytes, str(file_path), offset or 0, length, max_bytes, False)
+    result.update({
+        "message": message + (f"，已截断，下一段从字节 {chunk['end']} 开始" if chunk["truncated"] else ""),
+        "content": base64.b64encode(chunk["data"]).decode("ascii"),
+        "encoding": "base64",
+        "offset": chunk["offset"],
+        "end": chunk["end"],
+        "truncated": chunk["truncated"],
+        "next_offset": chunk["end"] if chunk["truncated"] else None
+    })
+    return result
+
+
+async def _pdf_text_result(file_path, start_page: int, end_page: Optional[int], max_bytes: int) -> dict:
+    """PDF 文本提取在进程池中执行，按页分段返回"""
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return {"success": False, "message": "未安装 pypdf，无法提取 PDF 文本", "file_name": str(file_path),
+                "error": "ImportError"}
+
+    loop = asyncio.get_running_loop()
+    pages = await loop.run_in_executor(get_pdf_pool(), FileReader.extract_pdf_text, str(file_path),
+                                       start_page, end_page, max_bytes)
+    return {
+        "success": True,
+        "message": f"PDF {file_path.name} 第 {pages['start_page']}-{pages['end_page']} 页文本提取成功"
+                   + (f"，已截断，下一段从第 {pages['end_page'] + 1} 页开始" if pages["truncated"] else ""),
+        "file_path": str(file_path.absolute()),
+        "file_type": "pdf_text",
+        "mime_type": "application/pdf",
+        "content": pages["text"],
+        "size": file_path.stat().st_size,
+        "start_page": pages["start_page"],
+        "end_page": pages["end_page"],
+        "total_pages": pages["total_pages"],
+        "truncated": pages["truncated"],
+        "next_page": pages["end_page"] + 1 if pages["truncated"] else None
+    }
+
+
 @mcp.tool
 async def write_file(file_name: str, content: str, file_type: str):
     """
@@ -221,13 +440,15 @@ async def write_file(file_name: str, content: str, file_type: str):
             mode = 'wb'
             encoding = None
 
-        # 异步写入文件
+        # 异步写入文件，文本写入后直接更新读取缓存
         if encoding:
             async with aiofiles.open(file_path, mode=mode, encoding=encoding) as f:  # type: ignore
                 await f.write(content)
+            await asyncio.to_thread(FileReader.read_cache.put, str(file_path), content.encode(encoding))
         else:
             async with aiofiles.open(file_path, mode=mode) as f:  # type: ignore
                 await f.write(content)
+            FileReader.read_cache.invalidate(str(file_path))
 
         return {
             "success": True,
@@ -265,10 +486,13 @@ async def alter_file(
         line_replacements: list = None,  # 批量替换多行 [{"line": 1, "text": "..."}, {"line": 3, "text": "..."}]
         new_text: str = None,
         old_text: str = None,
-        mode: str = "replace_line"
+        mode: str = "replace_line",
+        edits: list = None,
+        expected_mtime_ns: int = None,
+        expected_sha256: str = None
 ):
     """
-    修改文件内容工具
+    修改文件内容工具（写入临时文件后原子替换，多处修改请使用 mode="batch" 一次完成）
     Args:
         file_name: 文件名
         content: 完整替换的文件内容（mode="full"时使用）
@@ -287,6 +511,15 @@ async def alter_file(
             - "insert_line": 在指定行号插入新行
             - "delete_line": 删除指定行
             - "delete_lines": 删除指定行范围
+            - "batch": 按 edits 批量编辑，一次读写完成并原子替换
+        edits: 批量编辑操作列表（mode="batch"时使用），行号均指修改前的原文件，行范围不能重叠：
+            [{"op": "replace_line", "line": 3, "text": "..."},
+             {"op": "replace_lines", "start": 5, "end": 8, "text": "..."},
+             {"op": "insert", "line": 10, "text": "..."},
+             {"op": "delete", "start": 12, "end": 13},
+             {"op": "replace_text", "old": "foo", "new": "bar"}]
+        expected_mtime_ns: 期望的文件 mtime_ns（read_file 返回），不一致时放弃修改，防止覆盖并发修改
+        expected_sha256: 期望的文件内容 sha256，不一致时放弃修改
     """
     import aiofiles
     from pathlib import Path
@@ -301,7 +534,23 @@ async def alter_file(
                 "error": "FileNotFoundError"
             }
 
+        if mode == "batch":
+            if not edits or not isinstance(edits, list):
+                return {"success": False, "message": "mode='batch' 需要提供 edits 列表"}
+            stats = await asyncio.to_thread(FileEditor.apply_edits, str(file_path), edits,
+                                            expected_mtime_ns, expected_sha256)
+            return {
+                "success": True,
+                "message": f"文件 {file_name} 批量修改成功，共 {stats['applied']} 处",
+                "file_path": str(file_path.absolute()),
+                "mode": mode,
+                **stats
+            }
+
         # 读取原文件内容
+        snapshot = file_path.stat()
+        await asyncio.to_thread(FileEditor.check_precondition, str(file_path), snapshot,
+                                expected_mtime_ns, expected_sha256)
         async with aiofiles.open(file_path, mode='r', encoding='utf-8') as f:  # type: ignore
             original_content = await f.read()
             lines = original_content.splitlines(keepends=True)
@@ -419,9 +668,8 @@ async def alter_file(
         else:
             return {"success": False, "message": f"不支持的模式: {mode}"}
 
-        # 写入修改后的内容
-        async with aiofiles.open(file_path, mode='w', encoding='utf-8') as f:  # type: ignore
-            await f.write(modified_content)
+        # 写入临时文件后原子替换，读取后文件被其他写入修改时放弃
+        await asyncio.to_thread(FileEditor.atomic_write, str(file_path), modified_content.encode("utf-8"), snapshot)
 
         return {
             "success": True,
@@ -429,7 +677,15 @@ async def alter_file(
             "file_path": str(file_path.absolute()),
             "mode": mode,
             "original_lines": len(original_content.splitlines()),
-            "modified_lines": len(modified_content.splitlines())
+            "modified_lines": len(modified_content.splitlines()),
+            "mtime_ns": file_path.stat().st_mtime_ns
+        }
+
+    except FileEditor.EditConflictError as e:
+        return {
+            "success": False,
+            "message": f"修改文件失败，文件已被修改: {str(e)}，请重新读取后再修改",
+            "error": "EditConflictError"
         }
 
     except Exception as e:
@@ -0,0 +1,202 @@
+"""
+# 文件批量编辑（alter_file 使用）
+# 原理: 一组有序的异构编辑操作（替换行/行区间、插入、删除行区间、行内文本替换）全部按同一份快照的行号校验，
+#      之后对原文件做一次流式遍历，把结果写入同目录临时文件，fsync 后 os.replace 原子替换，
+#      多次编辑只需一次读写，写入中途失败不会留下半截文件
+# 并发保护: 可传入期望的 mtime_ns / sha256 作为前置条件；替换前再次比对快照的 (mtime_ns, size)，
+#          编辑期间文件被其他写入修改时放弃本次编辑
+# 注意: 同步阻塞实现，需在工作线程中调用（asyncio.to_thread）
+"""
+
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+from mcp_server.common.doucment_mcp.FileReader import content_hash_cache, read_cache
+
+# 支持的操作及其必填字段
+EDIT_OPERATIONS = {
+    "replace_line": ("line", "text"),
+    "replace_lines": ("start", "end", "text"),
+    "insert": ("line", "text"),
+    "delete": ("start", "end"),
+    "replace_text": ("old", "new"),
+}
+
+
+class EditConflictError(Exception):
+    """文件在读取快照之后被修改"""
+
+
+def _as_line(text: str) -> bytes:
+    return (text if text.endswith("\n") else text + "\n").encode("utf-8")
+
+
+def validate_edits(edits: List[dict], total_lines: int) -> List[dict]:
+    """
+    按快照行数校验编辑操作，行号均指原文件（从 1 开始），行区间之间不能重叠
+    :return: 规范化后的操作列表（保持原顺序）
+    """
+    if not edits:
+        raise ValueError("edits 不能为空")
+    normalized, ranges = [], []
+    for index, edit in enumerate(edits):
+        op = edit.get("op") if isinstance(edit, dict) else None
+        if op not in EDIT_OPERATIONS:
+            raise ValueError(f"第 {index + 1} 个操作不支持: {op}，可选 {list(EDIT_OPERATIONS)}")
+        missing = [field for field in EDIT_OPERATIONS[op] if edit.get(field) is None]
+        if missing:
+            raise ValueError(f"第 {index + 1} 个操作 {op} 缺少字段 {missing}")
+
+        item = {**edit, "index": index}
+        if op == "replace_line":
+            item.update(op="replace_lines", start=edit["line"], end=edit["line"])
+        if op == "insert":
+            if not 1 <= edit["line"] <= total_lines + 1:
+                raise ValueError(f"第 {index + 1} 个操作插入行号 {edit['line']} 超出范围（共 {total_lines} 行）")
+        elif op == "replace_text":
+            if not edit["old"] or "\n" in edit["old"] or "\n" in edit["new"]:
+                raise ValueError(f"第 {index + 1} 个操作 replace_text 的 old 不能为空，old/new 不能跨行")
+        else:
+            start, end = item["start"], item["end"]
+            if start < 1 or end > total_lines or start > end:
+                raise ValueError(f"第 {index + 1} 个操作行范围 [{start}, {end}] 无效（共 {total_lines} 行）")
+            ranges.append((start, end, index))
+        normalized.append(item)
+
+    ranges.sort()
+    for (_, prev_end, prev_index), (start, _, index) in zip(ranges, ranges[1:]):
+        if start <= prev_end:
+            raise ValueError(f"第 {prev_index + 1} 个与第 {index + 1} 个操作的行范围重叠")
+    return normalized
+
+
+def check_precondition(path: str, stat: os.stat_result, expected_mtime_ns: Optional[int],
+                        expected_sha256: Optional[str]):
+    if expected_mtime_ns is not None and stat.st_mtime_ns != expected_mtime_ns:
+        raise EditConflictError(f"文件 mtime_ns 为 {stat.st_mtime_ns}，与期望的 {expected_mtime_ns} 不一致")
+    if expected_sha256 is not None and content_hash_cache.get(path) != expected_sha256:
+        raise EditConflictError("文件内容 sha256 与期望值不一致")
+
+
+def atomic_write(path: str, data: bytes, snapshot: Optional[os.stat_result] = None):
+    """
+    写入同目录临时文件后原子替换
+    :param snapshot: 读取时的 stat，替换前比对 (mtime_ns, size)，不一致时放弃写入
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".alter_", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        _replace(path, temp_path, snapshot, data)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _replace(path: str, temp_path: str, snapshot: Optional[os.stat_result], data: Optional[bytes] = None):
+    """原子替换并更新读取缓存：已知新内容时直接写入缓存，否则失效"""
+    if snapshot is not None:
+        current = os.stat(path)
+        if (current.st_mtime_ns, current.st_size) != (snapshot.st_mtime_ns, snapshot.st_size):
+            raise EditConflictError("编辑期间文件被修改，已放弃本次编辑")
+        shutil.copymode(path, temp_path)
+    os.replace(temp_path, path)
+    if data is not None:
+        read_cache.put(path, data)
+    else:
+        read_cache.invalidate(path)
+
+
+def apply_edits(path: str, edits: List[dict], expected_mtime_ns: Optional[int] = None,
+                expected_sha256: Optional[str] = None) -> dict:
+    """
+    一次流式遍历应用全部编辑并原子替换原文件
+    :param path: 文件路径
+    :param edits: 有序操作列表，行号均指编辑前的原文件：
+        {"op": "replace_line", "line": 3, "text": "..."}
+        {"op": "replace_lines", "start": 5, "end": 8, "text": "..."}
+        {"op": "insert", "line": 10, "text": "..."}（插入到第 10 行之前，行数 + 1 表示追加到末尾）
+        {"op": "delete", "start": 12, "end": 13}
+        {"op": "replace_text", "old": "foo", "new": "bar"}（逐行替换全部匹配，至少匹配一次）
+    :param expected_mtime_ns: 期望的文件 mtime_ns（前置条件）
+    :param expected_sha256: 期望的文件 sha256（前置条件）
+    :return: {"original_lines", "modified_lines", "applied", "mtime_ns", "size"}
+    """
+    snapshot = os.stat(path)
+    check_precondition(path, snapshot, expected_mtime_ns, expected_sha256)
+    total_lines = len(read_cache.line_index(path, snapshot)) - 1
+    normalized = validate_edits(edits, total_lines)
+
+    # 按原文件行号建立查找表，流式遍历时 O(1) 判断当前行需要的操作
+    inserts, range_starts, text_replaces = {}, {}, []
+    for item in normalized:
+        if item["op"] == "insert":
+            inserts.setdefault(item["line"], []).append(_as_line(item["text"]))
+        elif item["op"] == "replace_text":
+            text_replaces.append(item)
+        else:
+            range_starts[item["start"]] = item
+    replaced_counts = [0] * len(text_replaces)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".alter_", dir=directory)
+    try:
+        modified_lines = 0
+        with open(path, "rb") as source, os.fdopen(fd, "wb") as out:
+            skip_until = 0
+            last = b"\n"
+            for number, raw in enumerate(source, start=1):
+                for text in inserts.get(number, ()):
+                    out.write(text)
+                    modified_lines += text.count(b"\n")
+                item = range_starts.get(number)
+                if item is not None:
+                    skip_until = item["end"]
+                    if item["op"] == "replace_lines":
+                        text = _as_line(item["text"])
+                        out.write(text)
+                        modified_lines += text.count(b"\n")
+                if number <= skip_until:
+                    continue
+                if text_replaces:
+                    line = raw.decode("utf-8")
+                    for i, replace in enumerate(text_replaces):
+                        if replace["old"] in line:
+                            replaced_counts[i] += line.count(replace["old"])
+                            line = line.replace(replace["old"], replace["new"])
+                    raw = line.encode("utf-8")
+                out.write(raw)
+                last = raw
+                modified_lines += 1
+            appended = inserts.get(total_lines + 1, ())
+            if appended and not last.endswith(b"\n"):
+                out.write(b"\n")
+            for text in appended:
+                out.write(text)
+                modified_lines += text.count(b"\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+        for replace, count in zip(text_replaces, replaced_counts):
+            if count == 0:
+                raise ValueError(f"第 {replace['index'] + 1} 个操作未找到要替换的文本: {replace['old']}")
+        _replace(path, temp_path, snapshot)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    stat = os.stat(path)
+    return {
+        "original_lines": total_lines,
+        "modified_lines": modified_lines,
+        "applied": len(normalized),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size
+    }
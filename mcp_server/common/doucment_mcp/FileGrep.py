@@ -0,0 +1,152 @@
+"""
+# 目录内容搜索（grep_files 使用）
+# 原理: FileWalker 按路径顺序流式产出文件，提交到有界线程池并发搜索（在途任务数不超过 workers 的两倍，
+#      不会一次性为整棵目录创建任务），按提交顺序收集结果，保证返回顺序稳定
+# 过滤: 超过单文件大小上限的文件、头部含 NUL 字节的二进制文件直接跳过
+# 提前结束: 匹配数达到 limit 后设置取消标志，正在搜索的文件在下一行停止，排队中的任务直接取消
+# 注意: 同步阻塞实现，需在工作线程中调用（asyncio.to_thread）
+"""
+
+import fnmatch
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+from mcp_server.common.doucment_mcp import FileWalker
+from mcp_server.common.doucment_mcp.FileReader import SNIFF_BYTES
+
+# 默认单文件大小上限
+DEFAULT_MAX_FILE_BYTES = 2 * 1024 * 1024
+# 单行最多返回的字符数
+MAX_LINE_CHARS = 500
+
+
+def compile_pattern(pattern: str, literal: bool = False, ignore_case: bool = False) -> re.Pattern:
+    return re.compile(re.escape(pattern) if literal else pattern, re.IGNORECASE if ignore_case else 0)
+
+
+def _clip(line: str) -> str:
+    return line if len(line) <= MAX_LINE_CHARS else line[:MAX_LINE_CHARS] + "..."
+
+
+def grep_file(path: str, regex: re.Pattern, context: int = 0, max_matches: Optional[int] = None,
+              cancelled: Optional[threading.Event] = None) -> Optional[List[dict]]:
+    """
+    搜索单个文件
+    :param path: 文件路径（调用方已按大小上限过滤）
+    :param regex: 已编译的正则
+    :param context: 匹配行前后各返回的行数
+    :param max_matches: 本文件最多返回的匹配数
+    :param cancelled: 取消标志
+    :return: 匹配列表 [{"line", "text", "before", "after"}]，二进制文件返回 None
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        # 无权限或已被删除的文件视为无匹配
+        return []
+    if b"\x00" in data[:SNIFF_BYTES]:
+        return None
+    lines = data.decode("utf-8", errors="replace").splitlines()
+
+    matches = []
+    for number, line in enumerate(lines, start=1):
+        if cancelled is not None and cancelled.is_set():
+            break
+        if regex.search(line) is None:
+            continue
+        matches.append({
+            "line": number,
+            "text": _clip(line),
+            "before": [_clip(text) for text in lines[max(0, number - 1 - context):number - 1]],
+            "after": [_clip(text) for text in lines[number:number + context]]
+        })
+        if max_matches is not None and len(matches) >= max_matches:
+            break
+    return matches
+
+
+def grep(
+        root: str,
+        pattern: str,
+        literal: bool = False,
+        ignore_case: bool = False,
+        file_pattern: str = "*",
+        max_depth: Optional[int] = None,
+        context: int = 0,
+        limit: int = 100,
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+        workers: int = 8,
+        ignore_patterns: Sequence[str] = FileWalker.DEFAULT_IGNORE_PATTERNS,
+) -> dict:
+    """
+    并发搜索目录下的文件内容
+    :param root: 根目录
+    :param pattern: 正则表达式或普通文本
+    :param literal: 是否按普通文本搜索
+    :param ignore_case: 是否忽略大小写
+    :param file_pattern: 文件名通配模式，例如 *.py
+    :param max_depth: 最大深度
+    :param context: 匹配行前后各返回的行数
+    :param limit: 最多返回的匹配数，达到后停止搜索
+    :param max_file_bytes: 单文件大小上限，超过的文件跳过
+    :param workers: 线程池大小
+    :param ignore_patterns: 忽略的目录/文件名模式
+    :return: {"matches", "files_scanned", "files_matched", "skipped_large", "skipped_binary", "truncated"}
+    """
+    regex = compile_pattern(pattern, literal, ignore_case)
+    cancelled = threading.Event()
+    matches: List[dict] = []
+    stats = {"files_scanned": 0, "files_matched": 0, "skipped_large": 0, "skipped_binary": 0}
+    truncated = False
+
+    def candidates():
+        for parts, entry in FileWalker.walk(root, max_depth, ignore_patterns):
+            if entry.is_dir(follow_symlinks=False) or not entry.is_file():
+                continue
+            if not fnmatch.fnmatchcase(entry.name, file_pattern):
+                continue
+            if entry.stat().st_size > max_file_bytes:
+                stats["skipped_large"] += 1
+                continue
+            yield entry.path, "/".join(parts)
+
+    def collect(path: str, relative_path: str, result: Optional[List[dict]]):
+        nonlocal truncated
+        stats["files_scanned"] += 1
+        if result is None:
+            stats["skipped_binary"] += 1
+            return
+        if result:
+            stats["files_matched"] += 1
+        for match in result:
+            if len(matches) >= limit:
+                truncated = True
+                cancelled.set()
+                return
+            matches.append({"path": path, "relative_path": relative_path, **match})
+
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for path, relative_path in candidates():
+            window.append((path, relative_path, pool.submit(grep_file, path, regex, context, limit + 1, cancelled)))
+            # 在途任务有界，按提交顺序收集
+            while len(window) >= workers * 2 or (window and window[0][2].done()):
+                head_path, head_relative, future = window.popleft()
+                collect(head_path, head_relative, future.result())
+                if cancelled.is_set():
+                    break
+            if cancelled.is_set():
+                break
+        while window and not cancelled.is_set():
+            head_path, head_relative, future = window.popleft()
+            collect(head_path, head_relative, future.result())
+        for _, _, future in window:
+            future.cancel()
+
+    return {"matches": matches, **stats, "truncated": truncated}
@@ -0,0 +1,238 @@
+"""
+# DocumentMCP 持久化文件索引（SQLite）
+# 原理: 为配置的根目录维护 (path, size, mtime, extension ...) 表，首次全量构建，之后定时增量刷新：
+#      遍历时与库中的 (size, mtime_ns) 比对，只写入新增/变化的行并删除已消失的行
+# 查询: 文件名通配（SQLite GLOB）、扩展名、路径子串、目录前缀（主键范围扫描）与深度过滤，按路径键集分页
+# 配置: DOCUMENT_INDEX_ROOTS（多个根目录用系统路径分隔符分隔，为空时不启用索引）、DOCUMENT_INDEX_PATH、
+#      DOCUMENT_INDEX_REFRESH_SECONDS
+# 注意: 同步阻塞实现，需在工作线程中调用（asyncio.to_thread）
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+from mcp_server.common.doucment_mcp import FileWalker
+
+load_dotenv()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    relative_path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_root ON files(root);
+CREATE INDEX IF NOT EXISTS idx_files_name ON files(name);
+CREATE INDEX IF NOT EXISTS idx_files_extension ON files(extension);
+"""
+
+
+def is_index_cursor(cursor: Optional[str]) -> bool:
+    """索引分页游标与目录遍历游标格式不同，用于判断上一页由哪种方式返回"""
+    try:
+        return isinstance(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii"))), dict)
+    except Exception:
+        return False
+
+
+class FileIndex:
+    """SQLite 文件索引"""
+
+    def __init__(
+            self,
+            roots: Optional[Sequence[str]] = None,
+            db_path: str = os.getenv("DOCUMENT_INDEX_PATH", "document_index.sqlite3"),
+            ignore_patterns: Sequence[str] = FileWalker.DEFAULT_IGNORE_PATTERNS,
+    ):
+        """
+        初始化文件索引
+        Args:
+            roots: 建立索引的根目录，为空时读取环境变量 DOCUMENT_INDEX_ROOTS
+            db_path: SQLite 文件路径
+            ignore_patterns: 构建索引时忽略的目录/文件名
+        """
+        if roots is None:
+            roots = [root for root in os.getenv("DOCUMENT_INDEX_ROOTS", "").split(os.pathsep) if root]
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.db_path = db_path
+        self.ignore_patterns = tuple(ignore_patterns)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._closing = threading.Event()
+        self.ready = False
+        self.last_build_seconds: Optional[float] = None
+        self.last_refreshed_at: Optional[float] = None
+        self.last_changes = {"upserted": 0, "deleted": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.roots)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def covers(self, directory: str) -> Optional[str]:
+        """目录在某个索引根目录之内时返回该根目录"""
+        directory = os.path.abspath(directory)
+        for root in self.roots:
+            if directory == root or directory.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    # ---------------- 构建与增量刷新 ----------------
+    def refresh(self) -> dict:
+        """
+        增量刷新全部根目录：遍历时与库中 (size, mtime_ns) 比对，只写入变化
+        关闭索引时中途停止，未写入的变化留待下次刷新
+        :return: 本次刷新统计，已关闭时为 None
+        """
+        with self._refresh_lock:
+            if self._closing.is_set():
+                return None
+            start = time.perf_counter()
+            upserted = deleted = 0
+            conn = self._connect()
+            for root in self.roots:
+                with self._lock:
+                    existing = {
+                        path: (size, mtime_ns)
+                        for path, size, mtime_ns in conn.execute(
+                            "SELECT path, size, mtime_ns FROM files WHERE root = ?", (root,))
+                    }
+                changed, seen = [], set()
+                for parts, entry in FileWalker.walk(root, None, self.ignore_patterns):
+                    if self._closing.is_set():
+                        return None
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if not is_dir and not entry.is_file():
+                        continue
+                    stat = entry.stat(follow_symlinks=not is_dir)
+                    size = 0 if is_dir else stat.st_size
+                    seen.add(entry.path)
+                    if existing.get(entry.path) != (size, stat.st_mtime_ns):
+                        changed.append((entry.path, root, "/".join(parts), entry.name,
+                                        "" if is_dir else os.path.splitext(entry.name)[1].lower(),
+                                        int(is_dir), size, stat.st_mtime_ns))
+                removed = [(path,) for path in existing if path not in seen]
+
+                with self._lock, conn:
+                    conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed)
+                    conn.executemany("DELETE FROM files WHERE path = ?", removed)
+                upserted += len(changed)
+                deleted += len(removed)
+
+            self.last_build_seconds = round(time.perf_counter() - start, 3)
+            self.last_refreshed_at = time.time()
+            self.last_changes = {"upserted": upserted, "deleted": deleted}
+            self.ready = True
+            print(f"📇 文件索引刷新完成: 耗时 {self.last_build_seconds}s, 写入 {upserted} 条, 删除 {deleted} 条")
+            return self.stats()
+
+    def stats(self) -> dict:
+        """索引状态：条目数、最近一次构建耗时、距上次刷新的秒数"""
+        with self._lock:
+            total = self._connect().execute("SELECT count(*) FROM files").fetchone()[0]
+        return {
+            "roots": self.roots,
+            "ready": self.ready,
+            "entries": total,
+            "last_build_seconds": self.last_build_seconds,
+            "age_seconds": round(time.time() - self.last_refreshed_at, 1) if self.last_refreshed_at else None,
+            "last_changes": self.last_changes
+        }
+
+    # ---------------- 查询 ----------------
+    def search(
+            self,
+            directory: str,
+            pattern: str = "*",
+            max_depth: Optional[int] = None,
+            limit: int = 200,
+            extension: Optional[str] = None,
+            keyword: Optional[str] = None,
+            cursor: Optional[str] = None,
+    ) -> dict:
+        """
+        从索引查询，结构与 FileWalker.search 一致
+        :param directory: 搜索目录（需在某个索引根目录之内）
+        :param pattern: 文件名通配模式
+        :param max_depth: 相对 directory 的最大深度
+        :param limit: 单页条数
+        :param extension: 扩展名过滤，例如 .py
+        :param keyword: 相对路径子串过滤
+        :param cursor: 上一页返回的 next_cursor
+        """
+        directory = os.path.abspath(directory)
+        prefix = directory.rstrip(os.sep) + os.sep
+        # 目录前缀范围扫描：prefix <= path < prefix 的最后一个字符 + 1
+        conditions = ["path >= ?", "path < ?", "name GLOB ?"]
+        params: List = [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), pattern]
+        if max_depth is not None:
+            conditions.append("length(path) - length(replace(path, ?, '')) <= ?")
+            params += [os.sep, prefix.count(os.sep) + max_depth - 1]
+        if extension:
+            conditions.append("extension = ?")
+            params.append(extension.lower() if extension.startswith(".") else f".{extension.lower()}")
+        if keyword:
+            conditions.append("instr(substr(path, ?), ?) > 0")
+            params += [len(prefix) + 1, keyword]
+        if cursor:
+            conditions.append("path > ?")
+            params.append(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))["after"])
+
+        sql = f"SELECT path, name, extension, is_dir, size, mtime_ns FROM files WHERE {' AND '.join(conditions)} " \
+              f"ORDER BY path LIMIT ?"
+        with self._lock:
+            rows = self._connect().execute(sql, params + [limit + 1]).fetchall()
+
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+        files, directories = [], []
+        for path, name, ext, is_dir, size, mtime_ns in rows:
+            relative_path = path[len(prefix):]
+            if is_dir:
+                directories.append({"name": name, "path": path, "relative_path": relative_path})
+            else:
+                files.append({
+                    "name": name,
+                    "path": path,
+                    "relative_path": relative_path,
+                    "size": size,
+                    "mtime": mtime_ns / 1e9,
+                    "extension": ext,
+                    "parent": os.path.dirname(path)
+                })
+        next_cursor = base64.urlsafe_b64encode(
+            json.dumps({"after": rows[-1][0]}, ensure_ascii=False).encode("utf-8")
+        ).decode("ascii") if truncated else None
+        return {"files": files, "directories": directories, "next_cursor": next_cursor, "truncated": truncated}
+
+    def close(self):
+        """停止正在进行的刷新并等待其退出后关闭连接，之后的刷新直接返回"""
+        self._closing.set()
+        with self._refresh_lock, self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局实例（未配置 DOCUMENT_INDEX_ROOTS 时 enabled 为 False）
+file_index = FileIndex()
@@ -0,0 +1,447 @@
+"""
+# 文件区间读取（read_file 使用）
+# 字节区间: offset / length 直接 seek 读取，区间边界落在 UTF-8 多字节字符中间时自动对齐到字符边界
+# 行区间: mmap + NumPy 一次扫描得到每行起始偏移（换行索引），同一大文件重复按行读取只需 O(区间) 的读取，不再整文件读入
+# 读取缓存: 小文件内容与换行索引放入按字节数上限淘汰的 LRU，按 (path, mtime_ns, size) 校验，
+#          write_file / alter_file 写入后直接更新或失效对应条目；超过 LRU 上限的换行索引（超大文件）
+#          放入单独的小容量槽位，按 (path, mtime_ns, size) 保留最近使用的几个
+# 分页: 单行超过 max_bytes 时按字节截断并返回继续读取的字节偏移；max_bytes 小于一个字符时至少前进一个完整字符
+# 类型识别: 读取文件头部若干 KB，按魔数、NUL 字节、UTF-8 合法性与控制字符比例判断是否为二进制
+# 二进制: 只返回元数据（MIME、大小、sha256），内容按需分段 base64；PDF 可在进程池中提取文本
+# 注意: 同步阻塞实现，需在工作线程中调用（asyncio.to_thread），PDF 文本提取在进程池中执行
+"""
+
+import hashlib
+import mimetypes
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+# 默认单次最多返回的字节数
+DEFAULT_MAX_BYTES = 256 * 1024
+# 类型识别读取的头部字节数
+SNIFF_BYTES = 8192
+# 常见二进制格式魔数
+MAGIC_SIGNATURES = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"\x7fELF", "application/x-executable"),
+]
+# 文本中允许出现的控制字符：\b \t \n \f \r ESC
+TEXT_CONTROL_BYTES = {0x08, 0x09, 0x0A, 0x0C, 0x0D, 0x1B}
+
+
+class ReadCache:
+    """
+    读取缓存：按占用字节数淘汰的 LRU，键为路径，命中时校验 (mtime_ns, size)
+    每个条目可包含文件内容（不超过 max_entry_bytes 的文件）与换行索引，两者都计入占用字节数
+    超过 max_bytes 的换行索引放不进 LRU，单独保留最近使用的 max_large_indexes 个，键为 (path, mtime_ns, size)
+    """
+
+    def __init__(
+            self,
+            max_bytes: int = int(os.getenv("DOCUMENT_READ_CACHE_BYTES", str(64 * 1024 * 1024))),
+            max_entry_bytes: int = int(os.getenv("DOCUMENT_READ_CACHE_ENTRY_BYTES", str(1024 * 1024))),
+            max_large_indexes: int = 2,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.max_large_indexes = max_large_indexes
+        self._items: "OrderedDict[str, dict]" = OrderedDict()
+        self._large: "OrderedDict[Tuple[str, int, int], np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def build_line_index(buffer, size: int) -> np.ndarray:
+        """
+        构建换行索引
+        :param buffer: 文件内容（bytes 或 mmap）
+        :return: 每行起始字节偏移（int64），最后追加文件大小作为哨兵，行数 = len - 1
+        """
+        if size == 0:
+            return np.zeros(1, dtype=np.int64)
+        newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == 0x0A)
+        starts = np.empty(len(newlines) + 2, dtype=np.int64)
+        starts[0] = 0
+        starts[1:-1] = newlines + 1
+        starts[-1] = size
+        del newlines
+        # 文件以换行结尾时最后一个"行起始"等于文件大小，去掉空行
+        return starts[:-1] if starts[-2] == size else starts
+
+    def _lookup(self, key: str, stat: os.stat_result, field: str):
+        """查找条目字段并计数，版本不一致的条目直接丢弃"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and (entry["mtime_ns"], entry["size"]) != (stat.st_mtime_ns, stat.st_size):
+                self._drop(key)
+                entry = None
+            if entry is not None and entry[field] is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[field]
+            self.misses += 1
+            return None
+
+    def _store(self, key: str, stat: os.stat_result, **fields):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or (entry["mtime_ns"], entry["size"]) != (stat.st_mtime_ns, stat.st_size):
+                if entry is not None:
+                    self._drop(key)
+                entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "content": None, "starts": None,
+                         "nbytes": 0}
+                self._items[key] = entry
+            entry.update(fields)
+            nbytes = (len(entry["content"]) if entry["content"] is not None else 0) + \
+                     (entry["starts"].nbytes if entry["starts"] is not None else 0)
+            self._bytes += nbytes - entry["nbytes"]
+            entry["nbytes"] = nbytes
+            self._items.move_to_end(key)
+            while self._bytes > self.max_bytes and self._items:
+                self._drop(next(iter(self._items)))
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["nbytes"]
+
+    def _drop_large(self, key: str):
+        for large_key in [large_key for large_key in self._large if large_key[0] == key]:
+            del self._large[large_key]
+
+    def content(self, path: str, stat: os.stat_result) -> Optional[bytes]:
+        """文件内容，超过 max_entry_bytes 的文件返回 None（调用方直接按区间读取）"""
+        if stat.st_size > self.max_entry_bytes:
+            return None
+        key = os.path.abspath(path)
+        data = self._lookup(key, stat, "content")
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+            # 读取期间文件被修改时不缓存
+            if len(data) == stat.st_size:
+                self._store(key, stat, content=data)
+        return data
+
+    def line_index(self, path: str, stat: os.stat_result) -> np.ndarray:
+        """换行索引，内容已缓存时直接在内存中构建，否则 mmap 扫描"""
+        key = os.path.abspath(path)
+        large_key = (key, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            starts = self._large.get(large_key)
+            if starts is not None:
+                self._large.move_to_end(large_key)
+                self.hits += 1
+                return starts
+        starts = self._lookup(key, stat, "starts")
+        if starts is not None:
+            return starts
+        with self._lock:
+            entry = self._items.get(key)
+            data = entry["content"] if entry is not None \
+                and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size) else None
+        if data is not None or stat.st_size == 0:
+            starts = self.build_line_index(data, stat.st_size)
+        else:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                starts = self.build_line_index(mm, stat.st_size)
+        if starts.nbytes > self.max_bytes:
+            # 放入 LRU 会被立即淘汰，改为放入超大索引槽位
+            with self._lock:
+                self._drop_large(key)
+                if self.max_large_indexes > 0:
+                    self._large[large_key] = starts
+                    while len(self._large) > self.max_large_indexes:
+                        self._large.popitem(last=False)
+                        self.evictions += 1
+        else:
+            self._store(key, stat, starts=starts)
+        return starts
+
+    def put(self, path: str, data: bytes):
+        """写入后直接更新缓存（write_file / alter_file 调用），换行索引在下次按行读取时重建"""
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        if len(data) != stat.st_size or stat.st_size > self.max_entry_bytes:
+            self.invalidate(path)
+            return
+        with self._lock:
+            self._drop(key)
+            self._drop_large(key)
+        self._store(key, stat, content=data)
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._drop(os.path.abspath(path))
+            self._drop_large(os.path.abspath(path))
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entry_bytes": self.max_entry_bytes,
+                "large_indexes": len(self._large),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions
+            }
+
+
+read_cache = ReadCache()
+
+
+def _continuation_bytes(head: bytes) -> int:
+    """起始偏移落在 UTF-8 续字节上时需要向后跳过的字节数"""
+    skip = 0
+    while skip < len(head) and (head[skip] & 0xC0) == 0x80:
+        skip += 1
+    return skip
+
+
+def _char_length(byte: int) -> int:
+    """UTF-8 首字节对应的字符字节数"""
+    return 1 if byte < 0x80 else 2 if byte >> 5 == 0b110 else 3 if byte >> 4 == 0b1110 else 4
+
+
+def _trim_incomplete_tail(data: bytes) -> bytes:
+    """去掉末尾不完整的 UTF-8 多字节字符"""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if (byte & 0xC0) == 0x80:
+            continue
+        # 找到字符首字节，判断该字符是否完整
+        return data if _char_length(byte) <= back else data[:-back]
+    return data
+
+
+def _read_range(path: str, content: Optional[bytes], offset: int, size: int) -> bytes:
+    """从缓存内容或文件中读取 [offset, offset + size)"""
+    if content is not None:
+        return content[offset:offset + size]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _read_text_range(path: str, content: Optional[bytes], offset: int, size: int, file_size: int) -> bytes:
+    """
+    读取文本区间，末尾对齐到完整字符；size 小于一个字符时返回一个完整字符，保证分页始终前进
+    :param offset: 起始偏移（已对齐到字符边界）
+    """
+    data = _read_range(path, content, offset, size)
+    if offset + len(data) < file_size:
+        data = _trim_incomplete_tail(data)
+        if not data and size > 0:
+            head = _read_range(path, content, offset, 4)
+            data = head[:_char_length(head[0])] if head else b""
+    return data
+
+
+def read_bytes(path: str, offset: int = 0, length: Optional[int] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+               text: bool = True) -> dict:
+    """
+    按字节区间读取（小文件经读取缓存，大文件直接 seek 读取）
+    :param path: 文件路径
+    :param offset: 起始字节偏移
+    :param length: 读取字节数，为空时读到文件末尾（受 max_bytes 限制）
+    :param max_bytes: 单次最多读取的字节数
+    :param text: 是否按 UTF-8 文本对齐字符边界
+    :return: {"data": bytes, "offset", "end", "file_size", "truncated"}
+    """
+    stat = os.stat(path)
+    file_size = stat.st_size
+    offset = min(max(offset, 0), file_size)
+    want = file_size - offset if length is None else max(length, 0)
+    content = read_cache.content(path, stat)
+    if text and offset:
+        offset += _continuation_bytes(_read_range(path, content, offset, 4))
+    size = min(want, max_bytes, file_size - offset)
+    data = _read_text_range(path, content, offset, size, file_size) if text \
+        else _read_range(path, content, offset, size)
+    end = offset + len(data)
+    return {
+        "data": data,
+        "offset": offset,
+        "end": end,
+        "file_size": file_size,
+        "truncated": end < min(file_size, offset + want) if length is not None else end < file_size
+    }
+
+
+def read_lines(path: str, start_line: int = 1, end_line: Optional[int] = None,
+               max_bytes: int = DEFAULT_MAX_BYTES) -> dict:
+    """
+    按行区间读取（行号从 1 开始，包含 end_line）
+    :param path: 文件路径
+    :param start_line: 起始行
+    :param end_line: 结束行，为空时读到文件末尾（受 max_bytes 限制）
+    :param max_bytes: 单次最多读取的字节数，超出时截断到完整行；起始行本身超过 max_bytes 时按字节截断该行
+    :return: {"data": bytes, "start_line", "end_line", "total_lines", "file_size", "truncated", "next_offset"}，
+             next_offset 仅在单行被截断时给出，为该行剩余部分的起始字节偏移（按字节区间继续读取）
+    """
+    stat = os.stat(path)
+    starts = read_cache.line_index(path, stat)
+    total_lines = len(starts) - 1
+    start_line = max(start_line, 1)
+    end_line = total_lines if end_line is None else min(end_line, total_lines)
+    if start_line > end_line:
+        return {"data": b"", "start_line": start_line, "end_line": start_line - 1, "total_lines": total_lines,
+                "file_size": stat.st_size, "truncated": False, "next_offset": None}
+
+    begin = int(starts[start_line - 1])
+    content = read_cache.content(path, stat)
+    if int(starts[start_line]) - begin > max_bytes:
+        # 单行超过 max_bytes：截断到完整字符，返回该行剩余部分的字节偏移
+        data = _read_text_range(path, content, begin, max_bytes, stat.st_size)
+        return {
+            "data": data,
+            "start_line": start_line,
+            "end_line": start_line,
+            "total_lines": total_lines,
+            "file_size": stat.st_size,
+            "truncated": True,
+            "next_offset": begin + len(data)
+        }
+    # 不超过 max_bytes 的最后一个完整行
+    last = int(np.searchsorted(starts, begin + max_bytes, side="right")) - 1
+    last_line = min(end_line, last)
+    return {
+        "data": _read_range(path, content, begin, int(starts[last_line]) - begin),
+        "start_line": start_line,
+        "end_line": last_line,
+        "total_lines": total_lines,
+        "file_size": stat.st_size,
+        "truncated": last_line < end_line,
+        "next_offset": None
+    }
+
+
+def sniff(path: str) -> dict:
+    """
+    读取文件头部判断文件类型
+    :return: {"binary": bool, "mime": str}
+    """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    for magic, mime in MAGIC_SIGNATURES:
+        if head.startswith(magic):
+            return {"binary": True, "mime": mime}
+    guessed = mimetypes.guess_type(path)[0]
+    # 扩展名推断为文本类型但内容是二进制时不沿用推断结果
+    binary = {"binary": True, "mime": guessed if guessed and not guessed.startswith("text/")
+              else "application/octet-stream"}
+    if b"\x00" in head:
+        return binary
+    try:
+        # 头部末尾可能截断了多字节字符
+        _trim_incomplete_tail(head).decode("utf-8")
+    except UnicodeDecodeError:
+        return binary
+    control = sum(1 for byte in head if byte < 0x20 and byte not in TEXT_CONTROL_BYTES)
+    if head and control / len(head) > 0.1:
+        return binary
+    return {"binary": False, "mime": guessed or "text/plain"}
+
+
+class ContentHashCache:
+    """文件 sha256 缓存，键为路径，命中时校验 (mtime_ns, size)"""
+
+    def __init__(self, max_files: int = 1024, chunk_size: int = 1024 * 1024):
+        self.max_files = max_files
+        self.chunk_size = chunk_size
+        self._items: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> str:
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self._lock:
+            cached = self._items.get(key)
+            if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                self._items.move_to_end(key)
+                return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(self.chunk_size):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        with self._lock:
+            self._items[key] = (stat.st_mtime_ns, stat.st_size, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_files:
+                self._items.popitem(last=False)
+        return value
+
+
+content_hash_cache = ContentHashCache()
+
+
+def extract_pdf_text(path: str, start_page: int = 1, end_page: Optional[int] = None,
+                     max_chars: Optional[int] = DEFAULT_MAX_BYTES) -> dict:
+    """
+    提取 PDF 文本（在进程池中执行，CPU 密集不阻塞事件循环与其他工具）
+    :param path: PDF 路径
+    :param start_page: 起始页，从 1 开始
+    :param end_page: 结束页（包含），为空时到最后一页
+    :param max_chars: 最多返回的字符数，超出时截断到完整页，至少返回一页，None 表示不限制
+    :return: {"text", "start_page", "end_page", "total_pages", "truncated"}
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    total_pages = len(reader.pages)
+    start_page = max(start_page, 1)
+    end_page = total_pages if end_page is None else min(end_page, total_pages)
+    texts, length, last_page = [], 0, start_page - 1
+    for number in range(start_page, end_page + 1):
+        text = reader.pages[number - 1].extract_text() or ""
+        if texts and max_chars is not None and length + len(text) > max_chars:
+            break
+        texts.append(f"--- 第 {number} 页 ---\n{text}")
+        length += len(text)
+        last_page = number
+    return {
+        "text": "\n".join(texts),
+        "start_page": start_page,
+        "end_page": last_page,
+        "total_pages": total_pages,
+        "truncated": last_page < end_page
+    }
+
+
+def extract_document(path: str) -> dict:
+    """
+    读取整个文件并提取文本（文档入库流水线在进程池中调用，读取与哈希只需一次 I/O）
+    :return: {"sha256", "mime", "text"}，非 PDF 的二进制文件 text 为 None
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if data.startswith(b"%PDF-"):
+        return {"sha256": sha256, "mime": "application/pdf",
+                "text": extract_pdf_text(path, max_chars=None)["text"]}
+    if b"\x00" in data[:SNIFF_BYTES]:
+        return {"sha256": sha256, "mime": "application/octet-stream", "text": None}
+    try:
+        return {"sha256": sha256, "mime": mimetypes.guess_type(path)[0] or "text/plain", "text": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"sha256": sha256, "mime": "application/octet-stream", "text": None}
@@ -0,0 +1,153 @@
+"""
+# 目录流式遍历（search_files 使用）
+# 原理: os.scandir 深度优先遍历，子项按名称排序，产出顺序即路径分段元组的字典序；
+#      DirEntry 自带文件类型，stat 结果由 DirEntry 缓存，不再对每一项单独调用 is_file / is_dir / stat
+# 分页: 游标记录上一页最后一项的路径分段，下一页遍历时整棵跳过排在游标之前的子树，达到 limit 立即停止
+# 注意: 同步阻塞实现，需在工作线程中调用（asyncio.to_thread）
+"""
+
+import base64
+import fnmatch
+import json
+import os
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 默认忽略的目录/文件名（支持通配符）
+DEFAULT_IGNORE_PATTERNS = (".git", "node_modules", "__pycache__")
+
+
+def encode_cursor(parts: Sequence[str]) -> str:
+    """游标编码：上一页最后一项的相对路径分段"""
+    return base64.urlsafe_b64encode(json.dumps(list(parts), ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if not cursor:
+        return None
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError(f"无效的游标: {cursor}")
+    if not isinstance(parts, list) or not all(isinstance(part, str) for part in parts):
+        raise ValueError(f"无效的游标: {cursor}")
+    return tuple(parts)
+
+
+def _ignored(name: str, ignore_patterns: Iterable[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in ignore_patterns)
+
+
+def walk(
+        root: str,
+        max_depth: Optional[int] = None,
+        ignore_patterns: Sequence[str] = DEFAULT_IGNORE_PATTERNS,
+        after: Optional[Tuple[str, ...]] = None,
+) -> Iterator[Tuple[Tuple[str, ...], os.DirEntry]]:
+    """
+    按路径分段字典序深度优先遍历目录
+    :param root: 根目录
+    :param max_depth: 最大深度，1 表示只遍历根目录的直接子项，None 不限制
+    :param ignore_patterns: 忽略的目录/文件名模式，命中的目录整棵跳过
+    :param after: 只产出排在该路径分段之后的项（分页游标）
+    :return: (相对路径分段, DirEntry) 迭代器
+    """
+    stack: List[Tuple[Tuple[str, ...], Iterator[os.DirEntry]]] = []
+
+    def open_dir(path: str, parts: Tuple[str, ...]):
+        try:
+            with os.scandir(path) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except (PermissionError, FileNotFoundError, NotADirectoryError):
+            entries = []
+        stack.append((parts, iter(entries)))
+
+    open_dir(root, ())
+    while stack:
+        parent_parts, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        if _ignored(entry.name, ignore_patterns):
+            continue
+
+        parts = parent_parts + (entry.name,)
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if after is not None and parts <= after:
+            # 排在游标之前：只有游标所在路径上的祖先目录需要继续深入，其余子树整棵跳过
+            if is_dir and after[:len(parts)] == parts and (max_depth is None or len(parts) < max_depth):
+                open_dir(entry.path, parts)
+            continue
+
+        yield parts, entry
+        if is_dir and (max_depth is None or len(parts) < max_depth):
+            open_dir(entry.path, parts)
+
+
+def search(
+        root: str,
+        pattern: str = "*",
+        max_depth: Optional[int] = None,
+        limit: int = 200,
+        ignore_patterns: Sequence[str] = DEFAULT_IGNORE_PATTERNS,
+        cursor: Optional[str] = None,
+        extension: Optional[str] = None,
+        keyword: Optional[str] = None,
+) -> dict:
+    """
+    分页搜索文件与目录，达到 limit 立即停止遍历
+    :param root: 根目录
+    :param pattern: 文件名匹配模式（通配符，匹配名称）
+    :param max_depth: 最大深度
+    :param limit: 单页最多返回的条目数（文件 + 目录）
+    :param ignore_patterns: 忽略的目录/文件名模式
+    :param cursor: 上一页返回的 next_cursor
+    :param extension: 扩展名过滤，例如 .py（指定时只返回文件）
+    :param keyword: 相对路径子串过滤
+    :return: {"files", "directories", "next_cursor", "truncated"}
+    """
+    if extension:
+        extension = (extension if extension.startswith(".") else f".{extension}").lower()
+    files, directories = [], []
+    last_parts: Optional[Tuple[str, ...]] = None
+    truncated = False
+    for parts, entry in walk(root, max_depth, ignore_patterns, decode_cursor(cursor)):
+        if not fnmatch.fnmatchcase(entry.name, pattern):
+            continue
+        relative_path = os.path.join(*parts)
+        if keyword and keyword not in relative_path:
+            continue
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if extension and (is_dir or os.path.splitext(entry.name)[1].lower() != extension):
+            continue
+        if len(files) + len(directories) >= limit:
+            truncated = True
+            break
+
+        if is_dir:
+            directories.append({
+                "name": entry.name,
+                "path": entry.path,
+                "relative_path": relative_path
+            })
+        elif entry.is_file():
+            stat = entry.stat()
+            files.append({
+                "name": entry.name,
+                "path": entry.path,
+                "relative_path": relative_path,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "extension": os.path.splitext(entry.name)[1],
+                "parent": os.path.dirname(entry.path)
+            })
+        else:
+            continue
+        last_parts = parts
+
+    return {
+        "files": files,
+        "directories": directories,
+        "next_cursor": encode_cursor(last_parts) if truncated and last_parts else None,
+        "truncated": truncated
+    }
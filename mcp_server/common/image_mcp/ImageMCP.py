@@ -1,13 +1,160 @@
+"""
+# 文生图 MCP 服务
+# 原理: 全局信号量限制同时进行的 images.generate 请求数；429 与 5xx 按带随机抖动的指数退避重试（优先遵循 Retry-After）；
+#      每张图片生成后立即流式转存到阿里云 OSS（边下载边上传，多张图片并发），返回不会过期的 OSS 地址
+# 缓存: 以 (模型, 尺寸, 提示词) 的 sha256 为键缓存已转存的图片地址，相同提示词直接复用，数量不足时只补齐差额；
+#      生成方返回的临时地址会过期，不写入缓存
+# 降级: 未配置 OSS 或转存失败时返回生成方的原始地址
+# 配置: IMAGE_GENERATION_CONCURRENCY、IMAGE_GENERATION_MAX_RETRIES、IMAGE_GENERATION_CACHE_TTL、IMAGE_GENERATION_OSS_BUCKET
+"""
+
 import asyncio
+import hashlib
 import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+import aiohttp
 from dotenv import load_dotenv
 from fastmcp import FastMCP
-from openai import AsyncOpenAI
+from openai import APIStatusError, AsyncOpenAI, RateLimitError
 from schemas.common.Result import Result
+from services.common.oss.AliyunOssService import AliyunOssService
 
-mcp = FastMCP(name="ImageMCP", instructions="生成工具")
 load_dotenv()
-client: AsyncOpenAI = AsyncOpenAI(base_url=os.getenv("OPENAI_BASE_URL2"), api_key=os.getenv("OPENAI_API_KEY2"))
+# 重试由 _generate_one 统一处理，关闭客户端自带的重试
+client: AsyncOpenAI = AsyncOpenAI(base_url=os.getenv("OPENAI_BASE_URL2"), api_key=os.getenv("OPENAI_API_KEY2"),
+                                  max_retries=0)
+
+IMAGE_MODEL = "dall-e-3"
+IMAGE_SIZE = "1024x1024"
+MAX_RETRIES = int(os.getenv("IMAGE_GENERATION_MAX_RETRIES", "4"))
+# 退避基数与上限（秒）
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+CACHE_TTL = int(os.getenv("IMAGE_GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_SIZE = 256
+OSS_BUCKET = os.getenv("IMAGE_GENERATION_OSS_BUCKET", "hdd-agent-image")
+OSS_PREFIX = "generated_images"
+
+# 全局并发限制
+generation_semaphore = asyncio.Semaphore(max(1, int(os.getenv("IMAGE_GENERATION_CONCURRENCY", "4"))))
+# 提示词哈希 → (过期时间, OSS 地址列表)
+result_cache: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+_oss_service: Optional[AliyunOssService] = None
+_oss_unavailable = False
+
+
+def get_oss_service() -> Optional[AliyunOssService]:
+    """懒加载 OSS 服务，未配置时返回 None"""
+    global _oss_service, _oss_unavailable
+    if _oss_service is None and not _oss_unavailable:
+        try:
+            _oss_service = AliyunOssService()
+        except ValueError as e:
+            _oss_unavailable = True
+            print(f"OSS 未配置，生成的图片不转存: {e}")
+    return _oss_service
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """MCP服务生命周期：关闭时释放懒加载的 OSS 服务的线程池"""
+    global _oss_service
+    yield
+    if _oss_service is not None:
+        _oss_service.shutdown()
+        _oss_service = None
+
+
+mcp = FastMCP(name="ImageMCP", instructions="生成工具", lifespan=lifespan)
+
+
+def _cache_key(prompt: str) -> str:
+    return hashlib.sha256(f"{IMAGE_MODEL}|{IMAGE_SIZE}|{prompt}".encode("utf-8")).hexdigest()
+
+
+def _cached_urls(key: str) -> List[str]:
+    entry = result_cache.get(key)
+    if entry is None:
+        return []
+    if entry[0] < time.time():
+        result_cache.pop(key, None)
+        return []
+    result_cache.move_to_end(key)
+    return entry[1]
+
+
+def _cache_urls(key: str, urls: List[str]):
+    result_cache[key] = (time.time() + CACHE_TTL, urls)
+    result_cache.move_to_end(key)
+    while len(result_cache) > CACHE_SIZE:
+        result_cache.popitem(last=False)
+
+
+def _retry_delay(attempt: int, error: APIStatusError) -> float:
+    """优先使用 Retry-After，否则为全抖动指数退避"""
+    retry_after = error.response.headers.get("retry-after") if error.response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), BACKOFF_MAX)
+    except ValueError:
+        pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+async def _generate_one(prompt: str) -> str:
+    """生成单张图片，返回生成方的临时地址"""
+    attempt = 0
+    while True:
+        try:
+            async with generation_semaphore:
+                response = await client.images.generate(model=IMAGE_MODEL, prompt=prompt, n=1, size=IMAGE_SIZE)
+            return response.data[0].url
+        except APIStatusError as e:
+            retryable = isinstance(e, RateLimitError) or e.status_code >= 500
+            if not retryable or attempt >= MAX_RETRIES:
+                raise
+            delay = _retry_delay(attempt, e)
+            attempt += 1
+            print(f"图片生成失败（{e.status_code}），{delay:.1f}s 后第 {attempt} 次重试")
+            # 退避期间不占用并发名额
+            await asyncio.sleep(delay)
+
+
+async def _persist(session: aiohttp.ClientSession, url: str, key: str) -> Optional[str]:
+    """把生成的图片边下载边上传到 OSS，返回 OSS 地址，失败时返回 None"""
+    oss_service = get_oss_service()
+    if oss_service is None:
+        return None
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                print(f"生成图片下载失败，状态码: {response.status}")
+                return None
+            content_type = response.headers.get("content-type", "image/png").split(";")[0].strip().lower()
+            suffix = AliyunOssService.get_suffix_from_content_type(content_type)
+            result = await oss_service.upload_stream(
+                response.content.iter_chunked(64 * 1024),
+                f"{OSS_PREFIX}/{key[:16]}/{uuid.uuid4()}{suffix}",
+                bucket_name=OSS_BUCKET,
+                content_type=content_type
+            )
+        return result.data if result.code == 200 else None
+    except Exception as e:
+        print(f"生成图片转存失败: {e}")
+        return None
+
+
+async def _generate_and_persist(session: aiohttp.ClientSession, prompt: str, key: str) -> Tuple[str, bool]:
+    """生成后立即转存，返回 (地址, 是否为 OSS 地址)"""
+    url = await _generate_one(prompt)
+    durable_url = await _persist(session, url, key)
+    return (durable_url, True) if durable_url else (url, False)
 
 
 # Tools  工具
@@ -20,21 +167,30 @@ async def image_generation(prompt: str, n: int = 1):
         n: 生成图片数量，范围 1-10
     """
     try:
-        # 使用 Schema 做验证
-
-        tasks = [
-            client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                n=1,
-                size="1024x1024"
+        n = min(max(n, 1), 10)
+        key = _cache_key(prompt)
+        cached = _cached_urls(key)
+        if len(cached) >= n:
+            return Result(code=200, message="生成图片成功（缓存）", data=cached[:n])
+
+        # 只补齐缓存中缺少的数量，每张图片生成后立即并发转存
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=180)) as session:
+            results = await asyncio.gather(
+                *(_generate_and_persist(session, prompt, key) for _ in range(n - len(cached))),
+                return_exceptions=True
             )
-            for _ in range(n)
-        ]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        generated = [result for result in results if not isinstance(result, BaseException)]
+        durable_urls = [url for url, durable in generated if durable]
+        if durable_urls:
+            _cache_urls(key, cached + durable_urls)
 
-        responses = await asyncio.gather(*tasks)
-        image_urls = [response.data[0].url for response in responses]
+        image_urls = cached + [url for url, _ in generated]
         print(f"图片地址：{image_urls}")
+        if not image_urls:
+            return Result(code=500, message=f"生成图片失败:{errors[0]}", data=[])
+        if errors:
+            return Result(code=200, message=f"部分图片生成失败({len(errors)}/{n}):{errors[0]}", data=image_urls)
         return Result(code=200, message="生成图片成功", data=image_urls)
     except Exception as e:
         return Result(code=500, message=f"生成图片失败:{e}", data=[])
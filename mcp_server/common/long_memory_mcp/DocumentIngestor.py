@@ -0,0 +1,453 @@
+"""
+# 文档入库流水线（磁盘文档分块写入长期记忆，按需检索而不是把整个文件放进上下文）
+# 原理: 发现 → 提取 → 分块 → 批量向量化 → 批量写入，提取与写入之间用有界队列相连，流式处理：
+#      1. 发现: FileWalker 遍历目录，(size, mtime_ns) 与入库清单一致的文件直接跳过
+#      2. 提取: 进程池读取文件、计算 sha256 并提取文本（PDF 使用 pypdf），内容哈希未变的文件只更新清单
+#      3. 分块: 按字符窗口切分，优先在段落 / 句子边界断开，相邻块保留重叠
+#      4. 向量化与写入: 攒够一批块后一次 embeddings 请求、一次 insert，随后删除对应文件旧版本的块并更新清单
+# 清单: SQLite 记录每个文件的 sha256 与块主键，重复入库只处理新增 / 变化的文件，已删除的文件清理其块
+# OSS: ingest_oss 按前缀列举对象，(size, last_modified) 与清单一致的对象直接跳过，变化的对象经 iter_object
+#      流式写入临时文件后走同一条提取 / 分块 / 写入流水线（整个对象不放入内存，超过大小上限时提前关闭读取），
+#      清单中以 oss://存储桶/对象名 为键
+# 隔离: 文档块写入独立的集合 DOCUMENT_INGEST_COLLECTION（独立的记忆系统实例，不开启近似去重与延迟写入），
+#      与用户记忆集合互不可见，用户记忆工具与离线合并不会读写文档块
+# 配置: DOCUMENT_INGEST_ROOTS（多个根目录用系统路径分隔符分隔，为空时不启用定时入库）、DOCUMENT_INGEST_PATTERNS、
+#      DOCUMENT_INGEST_COLLECTION、DOCUMENT_INGEST_USER_ID、DOCUMENT_INGEST_PATH、DOCUMENT_INGEST_HOURS、DOCUMENT_INGEST_WORKERS、
+#      DOCUMENT_INGEST_OSS_BUCKET
+"""
+
+import asyncio
+import fnmatch
+import json
+import os
+import posixpath
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from mcp_server.common.doucment_mcp import FileReader, FileWalker
+from mcp_server.common.long_memory_mcp.OpenAIMemorySystem import OpenAIMemorySystem, memory_id_generator
+from mcp_server.common.long_memory_mcp.vector_store.VectorStoreAbstract import DEFAULT_IMPORTANCE
+from schemas.common.Result import Result
+from services.common.oss.AliyunOssService import AliyunOssService
+
+load_dotenv()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    chunk_ids TEXT NOT NULL,
+    ingested_at REAL NOT NULL
+);
+"""
+
+# 分块时优先断开的位置，按优先级排列
+CHUNK_SEPARATORS = ("\n\n", "\n", "。", "！", "？", ". ", "! ", "? ", "；", "; ", "，", ", ", " ")
+
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
+    """
+    按字符窗口切分文本，窗口后半段内存在分隔符时在分隔符处断开，相邻块保留 overlap 个字符的重叠
+    :param text: 文本
+    :param chunk_size: 每块最多字符数
+    :param overlap: 相邻块重叠字符数
+    :return: 文本块列表
+    """
+    overlap = min(max(overlap, 0), chunk_size // 2)
+    chunks, start, length = [], 0, len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            for separator in CHUNK_SEPARATORS:
+                position = text.rfind(separator, start + chunk_size // 2, end)
+                if position != -1:
+                    end = position + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class DocumentIngestor:
+    """文档入库流水线"""
+
+    def __init__(
+            self,
+            memory: OpenAIMemorySystem,
+            roots: Optional[Sequence[str]] = None,
+            patterns: Optional[Sequence[str]] = None,
+            user_id: str = os.getenv("DOCUMENT_INGEST_USER_ID", "documents"),
+            db_path: str = os.getenv("DOCUMENT_INGEST_PATH", "document_ingest.sqlite3"),
+            chunk_size: int = 800,
+            chunk_overlap: int = 100,
+            max_file_bytes: int = 20 * 1024 * 1024,
+            workers: int = int(os.getenv("DOCUMENT_INGEST_WORKERS", "2")),
+            embed_batch_size: int = 256,
+            ignore_patterns: Sequence[str] = FileWalker.DEFAULT_IGNORE_PATTERNS,
+            oss_bucket: str = os.getenv("DOCUMENT_INGEST_OSS_BUCKET", "tx-factory"),
+    ):
+        """
+        初始化文档入库流水线
+        Args:
+            memory: 文档块专用的记忆系统（使用其向量化、向量存储与稀疏索引），需与用户记忆使用不同的集合
+            roots: 定时入库的根目录，为空时读取环境变量 DOCUMENT_INGEST_ROOTS
+            patterns: 入库的文件名模式，为空时读取环境变量 DOCUMENT_INGEST_PATTERNS（逗号分隔）
+            user_id: 文档块在文档集合中的命名空间
+            db_path: 入库清单 SQLite 文件路径
+            chunk_size: 每块最多字符数（Milvus content 字段上限 8192 字节，中文每字 3 字节）
+            chunk_overlap: 相邻块重叠字符数
+            max_file_bytes: 单文件大小上限，超过的文件跳过
+            workers: 提取文本的进程数
+            embed_batch_size: 攒够多少块后向量化并写入一次
+            ignore_patterns: 遍历时忽略的目录/文件名
+            oss_bucket: ingest_oss 默认读取的 OSS 存储桶
+        """
+        if roots is None:
+            roots = [root for root in os.getenv("DOCUMENT_INGEST_ROOTS", "").split(os.pathsep) if root]
+        if patterns is None:
+            patterns = [pattern.strip() for pattern in
+                        os.getenv("DOCUMENT_INGEST_PATTERNS", "*.md,*.txt,*.rst,*.pdf").split(",") if pattern.strip()]
+        self.memory = memory
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.patterns = tuple(patterns)
+        self.user_id = user_id
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_file_bytes = max_file_bytes
+        self.workers = max(1, workers)
+        self.embed_batch_size = embed_batch_size
+        self.ignore_patterns = tuple(ignore_patterns)
+        self.oss_bucket = oss_bucket
+        self._oss_service: Optional[AliyunOssService] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # 定时任务与手动调用不并发执行
+        self._ingest_lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.roots)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _get_oss_service(self) -> AliyunOssService:
+        """懒加载 OSS 服务，未配置时抛出 ValueError"""
+        if self._oss_service is None:
+            self._oss_service = AliyunOssService()
+        return self._oss_service
+
+    def _matches(self, name: str) -> bool:
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns)
+
+    # ---------------- 发现 ----------------
+    def _discover(self, directory: str) -> List[Tuple[str, str, int, int]]:
+        """遍历目录，返回 [(path, relative_path, size, mtime_ns)]"""
+        found = []
+        for parts, entry in FileWalker.walk(directory, None, self.ignore_patterns):
+            if entry.is_dir(follow_symlinks=False) or not entry.is_file():
+                continue
+            if not self._matches(entry.name):
+                continue
+            stat = entry.stat()
+            if stat.st_size <= self.max_file_bytes:
+                found.append((entry.path, "/".join(parts), stat.st_size, stat.st_mtime_ns))
+        return found
+
+    def _load_manifest(self, prefix: str) -> Dict[str, dict]:
+        """读取路径以 prefix 开头的已入库文件的清单"""
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT path, sha256, size, mtime_ns, chunk_ids FROM documents "
+                "WHERE user_id = ? AND path >= ? AND path < ?",
+                (self.user_id, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+            ).fetchall()
+        return {
+            path: {"sha256": sha256, "size": size, "mtime_ns": mtime_ns, "chunk_ids": json.loads(chunk_ids)}
+            for path, sha256, size, mtime_ns, chunk_ids in rows
+        }
+
+    def _save_manifest(self, records: List[Tuple[str, str, int, int, List[int]]]):
+        with self._db_lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(path, self.user_id, sha256, size, mtime_ns, json.dumps(chunk_ids), time.time())
+                 for path, sha256, size, mtime_ns, chunk_ids in records]
+            )
+
+    def _delete_manifest(self, paths: List[str]):
+        with self._db_lock, self._connect() as conn:
+            conn.executemany("DELETE FROM documents WHERE path = ?", [(path,) for path in paths])
+
+    async def _delete_chunks(self, chunk_ids: List[int]):
+        if not chunk_ids:
+            return
+        await self.memory.vector_store.delete(chunk_ids)
+        if self.memory.sparse_index is not None:
+            self.memory.sparse_index.remove(chunk_ids)
+
+    # ---------------- 流水线 ----------------
+    async def ingest(self, directory: Optional[str] = None, force: bool = False):
+        """
+        入库目录下新增或变化的文档，清理已删除文档的块
+        :param directory: 入库目录，为空时处理全部根目录
+        :param force: 是否忽略清单强制重新入库
+        :return: 入库统计
+        """
+        directories = [os.path.abspath(directory)] if directory else self.roots
+        if not directories:
+            return Result(code=400, message="未指定目录且未配置 DOCUMENT_INGEST_ROOTS", data=None)
+
+        async with self._ingest_lock:
+            start = time.perf_counter()
+            report = {"scanned": 0, "ingested": 0, "unchanged": 0, "removed": 0, "chunks": 0, "failed": []}
+            for path in directories:
+                if not os.path.isdir(path):
+                    return Result(code=400, message=f"目录 {path} 不存在", data=None)
+                await self._ingest_directory(path, force, report)
+            report["seconds"] = round(time.perf_counter() - start, 3)
+
+        self.memory._invalidate(self.user_id)
+        print(f"📚 文档入库完成: 扫描 {report['scanned']} 个, 入库 {report['ingested']} 个, "
+              f"写入 {report['chunks']} 块, 清理 {report['removed']} 个, 耗时 {report['seconds']}s")
+        return Result(code=200, message=f"入库{report['ingested']}个文档，共{report['chunks']}块", data=report)
+
+    async def _ingest_directory(self, directory: str, force: bool, report: dict):
+        candidates = await asyncio.to_thread(self._discover, directory)
+        manifest = await asyncio.to_thread(self._load_manifest, directory.rstrip(os.sep) + os.sep)
+        await self._ingest_candidates(candidates, manifest, force, report)
+
+    async def ingest_oss(self, prefix: str = "", bucket_name: Optional[str] = None, force: bool = False):
+        """
+        入库 OSS 前缀下新增或变化的文档，清理已从 OSS 删除的文档的块
+        :param prefix: 对象名前缀，例如 docs/
+        :param bucket_name: 存储桶，默认 oss_bucket
+        :param force: 是否忽略清单强制重新入库
+        :return: 入库统计
+        """
+        bucket_name = bucket_name or self.oss_bucket
+        try:
+            oss_service = self._get_oss_service()
+        except ValueError as e:
+            return Result(code=503, message=f"OSS 未配置: {str(e)}", data=None)
+
+        async with self._ingest_lock:
+            start = time.perf_counter()
+            report = {"scanned": 0, "ingested": 0, "unchanged": 0, "removed": 0, "chunks": 0, "failed": []}
+            try:
+                objects = await oss_service.list_objects(prefix, bucket_name=bucket_name)
+            except Exception as e:
+                return Result(code=500, message=f"列举 OSS 对象失败: {str(e)}", data=None)
+            source = f"oss://{bucket_name}/"
+            candidates = [
+                (source + item["key"], item["key"], item["size"], item["last_modified"] * 1_000_000_000)
+                for item in objects
+                if self._matches(posixpath.basename(item["key"])) and item["size"] <= self.max_file_bytes
+            ]
+            manifest = await asyncio.to_thread(self._load_manifest, source + prefix)
+
+            with tempfile.TemporaryDirectory(prefix="document_ingest_") as temp_dir:
+                async def fetch(path: str) -> str:
+                    return await self._download_object(oss_service, bucket_name, path[len(source):], temp_dir)
+
+                await self._ingest_candidates(candidates, manifest, force, report, fetch)
+            report["seconds"] = round(time.perf_counter() - start, 3)
+
+        self.memory._invalidate(self.user_id)
+        print(f"📚 OSS 文档入库完成: 扫描 {report['scanned']} 个, 入库 {report['ingested']} 个, "
+              f"写入 {report['chunks']} 块, 清理 {report['removed']} 个, 耗时 {report['seconds']}s")
+        return Result(code=200, message=f"入库{report['ingested']}个文档，共{report['chunks']}块", data=report)
+
+    async def _download_object(self, oss_service: AliyunOssService, bucket_name: str, object_name: str,
+                               temp_dir: str) -> str:
+        """经 iter_object 流式写入临时文件（保留后缀以便按类型提取），超过大小上限时提前关闭读取"""
+        local_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}{posixpath.splitext(object_name)[1]}")
+        size = 0
+        with open(local_path, "wb") as f:
+            async with aclosing(oss_service.iter_object(object_name, bucket_name=bucket_name)) as chunks:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise ValueError(f"文件超过 {self.max_file_bytes} 字节")
+                    await asyncio.to_thread(f.write, chunk)
+        return local_path
+
+    async def _ingest_candidates(self, candidates: List[Tuple[str, str, int, int]], manifest: Dict[str, dict],
+                                 force: bool, report: dict,
+                                 fetch: Optional[Callable[[str], Awaitable[str]]] = None):
+        """
+        对比清单后入库候选文档
+        :param candidates: [(清单路径, 相对路径, size, mtime_ns)]
+        :param manifest: 同一来源下已入库文件的清单
+        :param fetch: 清单路径不是本地文件时，把文档取到本地临时文件并返回其路径（提取后删除）
+        """
+        report["scanned"] += len(candidates)
+
+        # 1. 已从来源删除的文档：清理块与清单
+        seen = {path for path, _, _, _ in candidates}
+        removed = [path for path in manifest if path not in seen]
+        if removed:
+            await self._delete_chunks([chunk_id for path in removed for chunk_id in manifest[path]["chunk_ids"]])
+            await asyncio.to_thread(self._delete_manifest, removed)
+            report["removed"] += len(removed)
+
+        # 2. (size, mtime_ns) 未变的文档直接跳过
+        changed = [
+            candidate for candidate in candidates
+            if force or candidate[0] not in manifest
+            or (manifest[candidate[0]]["size"], manifest[candidate[0]]["mtime_ns"]) != candidate[2:]
+        ]
+        report["unchanged"] += len(candidates) - len(changed)
+        if not changed:
+            return
+
+        # 3. 提取（进程池，在途任务有界）→ 队列 → 分块、向量化、写入
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        producer = asyncio.create_task(self._extract_stage(changed, manifest, force, queue, report, fetch))
+        try:
+            await self._embed_stage(manifest, queue, report)
+        finally:
+            producer.cancel()
+
+    async def _extract_stage(self, changed: List[Tuple[str, str, int, int]], manifest: Dict[str, dict],
+                             force: bool, queue: asyncio.Queue, report: dict,
+                             fetch: Optional[Callable[[str], Awaitable[str]]] = None):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.workers * 2)
+        touched: List[Tuple[str, str, int, int, List[int]]] = []
+
+        async def extract(path: str, relative_path: str, size: int, mtime_ns: int):
+            async with semaphore:
+                local_path = None
+                try:
+                    local_path = await fetch(path) if fetch is not None else path
+                    document = await loop.run_in_executor(self._get_pool(), FileReader.extract_document, local_path)
+                except Exception as e:
+                    report["failed"].append({"path": path, "error": str(e)})
+                    return
+                finally:
+                    if fetch is not None and local_path is not None:
+                        await asyncio.to_thread(os.remove, local_path)
+            previous = manifest.get(path)
+            if not force and previous is not None and previous["sha256"] == document["sha256"]:
+                # 只有 mtime 变化，内容未变
+                touched.append((path, document["sha256"], size, mtime_ns, previous["chunk_ids"]))
+                report["unchanged"] += 1
+                return
+            chunks = chunk_text(document["text"] or "", self.chunk_size, self.chunk_overlap)
+            contents = [f"[{relative_path} #{i + 1}/{len(chunks)}]\n{chunk}" for i, chunk in enumerate(chunks)]
+            await queue.put((path, document["sha256"], size, mtime_ns, contents))
+
+        try:
+            await asyncio.gather(*(extract(*candidate) for candidate in changed))
+            if touched:
+                await asyncio.to_thread(self._save_manifest, touched)
+        finally:
+            await queue.put(None)
+
+    async def _embed_stage(self, manifest: Dict[str, dict], queue: asyncio.Queue, report: dict):
+        batch: List[Tuple[str, str, int, int, List[str]]] = []
+        pending_chunks = 0
+        while True:
+            item = await queue.get()
+            if item is not None:
+                batch.append(item)
+                pending_chunks += len(item[4])
+            if batch and (item is None or pending_chunks >= self.embed_batch_size):
+                try:
+                    await self._write_batch(batch, manifest, report)
+                except Exception as e:
+                    report["failed"].extend({"path": path, "error": str(e)} for path, *_ in batch)
+                batch, pending_chunks = [], 0
+            if item is None:
+                return
+
+    async def _write_batch(self, batch: List[Tuple[str, str, int, int, List[str]]], manifest: Dict[str, dict],
+                           report: dict):
+        """一批文档：一次向量化、一次 insert，写入成功后删除旧版本的块并更新清单"""
+        contents = [content for *_, file_contents in batch for content in file_contents]
+        vectors = await self.memory.get_embeddings(contents) if contents else []
+        now_ms = int(time.time() * 1000)
+        rows = [
+            {
+                "primary_key": memory_id_generator.generate(),
+                "user_id": self.user_id,
+                "content": content,
+                "vector": vector,
+                "importance": DEFAULT_IMPORTANCE,
+                "updated_at": now_ms
+            }
+            for content, vector in zip(contents, vectors)
+        ]
+        if rows:
+            await self.memory.vector_store.insert(rows)
+            if self.memory.sparse_index is not None:
+                self.memory.sparse_index.add(rows)
+
+        records, offset = [], 0
+        for path, sha256, size, mtime_ns, file_contents in batch:
+            records.append((path, sha256, size, mtime_ns,
+                            [row["primary_key"] for row in rows[offset:offset + len(file_contents)]]))
+            offset += len(file_contents)
+        await self._delete_chunks([chunk_id for path, *_ in batch if path in manifest
+                                   for chunk_id in manifest[path]["chunk_ids"]])
+        await asyncio.to_thread(self._save_manifest, records)
+        report["ingested"] += len(batch)
+        report["chunks"] += len(rows)
+
+    def stats(self) -> dict:
+        """入库清单统计"""
+        with self._db_lock:
+            documents, chunks = self._connect().execute(
+                "SELECT count(*), coalesce(sum(json_array_length(chunk_ids)), 0) FROM documents WHERE user_id = ?",
+                (self.user_id,)
+            ).fetchone()
+        return {"roots": self.roots, "patterns": list(self.patterns), "user_id": self.user_id,
+                "documents": documents, "chunks": chunks}
+
+    def close(self):
+        if self._oss_service is not None:
+            self._oss_service.shutdown()
+            self._oss_service = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局实例（未配置 DOCUMENT_INGEST_ROOTS 时只能通过工具指定目录入库）
+document_memory_system = OpenAIMemorySystem(
+    collection_name=os.getenv("DOCUMENT_INGEST_COLLECTION", "long_memory_documents"),
+    write_behind=False,
+    dedup_threshold=None
+)
+document_ingestor = DocumentIngestor(document_memory_system)
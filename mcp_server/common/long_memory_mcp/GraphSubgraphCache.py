@@ -0,0 +1,188 @@
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class Subgraph:
+    """
+    以某个实体为中心的 k 跳子图，紧凑邻接（CSR）存储：
+    - 节点按下标存放，names / types / properties 为节点属性
+    - offsets[i]:offsets[i + 1] 是节点 i 的邻接区间，neighbors / relations / outgoing 为对应的邻居下标、关系类型下标、方向
+    - depth[i] 为节点 i 到中心的跳数，节点 i 的 h 跳邻域完整当且仅当 depth[i] + h <= hops
+    - 中心实体在图谱中不存在时节点与边均为空，记录的中心与跳数仍然有效（负缓存）
+    """
+
+    __slots__ = ("center", "hops", "names", "types", "properties", "index", "relation_names",
+                 "offsets", "neighbors", "relations", "outgoing", "depth")
+
+    def __init__(self, center: str, hops: int, nodes: List[dict], edges: List[dict]):
+        """
+        :param center: 中心实体名
+        :param hops: 子图跳数
+        :param nodes: [{"name", "type", "properties"}, ...]
+        :param edges: [{"source", "relation", "target"}, ...]，有向
+        """
+        self.center = center
+        self.hops = hops
+        self.names = [node["name"] for node in nodes]
+        self.types = [node.get("type") for node in nodes]
+        self.properties = [node.get("properties") or {} for node in nodes]
+        self.index: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+        relation_index: Dict[str, int] = {}
+        sources, targets, relations, outgoing = [], [], [], []
+        for edge in edges:
+            source, target = self.index.get(edge["source"]), self.index.get(edge["target"])
+            if source is None or target is None:
+                continue
+            relation = relation_index.setdefault(edge["relation"], len(relation_index))
+            # 无向遍历：正反两个方向各存一份，outgoing 记录原始方向
+            sources += [source, target]
+            targets += [target, source]
+            relations += [relation, relation]
+            outgoing += [True, False]
+        self.relation_names = list(relation_index)
+
+        sources = np.asarray(sources, dtype=np.int32)
+        order = np.argsort(sources, kind="stable")
+        self.neighbors = np.asarray(targets, dtype=np.int32)[order]
+        self.relations = np.asarray(relations, dtype=np.int16)[order]
+        self.outgoing = np.asarray(outgoing, dtype=bool)[order]
+        self.offsets = np.zeros(len(self.names) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(sources, minlength=len(self.names)), out=self.offsets[1:])
+        self.depth = self._bfs_depth()
+
+    def _bfs_depth(self) -> np.ndarray:
+        depth = np.full(len(self.names), -1, dtype=np.int16)
+        start = self.index.get(self.center)
+        if start is None:
+            return depth
+        depth[start] = 0
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for neighbor in self.neighbors[self.offsets[node]:self.offsets[node + 1]]:
+                if depth[neighbor] < 0:
+                    depth[neighbor] = depth[node] + 1
+                    queue.append(neighbor)
+        return depth
+
+    def covers(self, entity: str, hops: int) -> bool:
+        """
+        该实体的 hops 跳邻域是否完整包含在子图中
+        中心实体按查询时的跳数判定，图谱中不存在该实体时的空子图同样命中（负缓存），不会每次都访问 Neo4j
+        """
+        if entity == self.center:
+            return hops <= self.hops
+        node = self.index.get(entity)
+        return node is not None and 0 <= self.depth[node] and self.depth[node] + hops <= self.hops
+
+    def neighborhood(self, entity: str, hops: int = 1, relation: Optional[str] = None,
+                     limit: int = 50) -> List[dict]:
+        """
+        在子图内广度优先遍历实体的 hops 跳邻域
+        :param entity: 实体名
+        :param hops: 跳数
+        :param relation: 关系类型过滤，遍历的每一跳都必须是该关系（例如朋友的朋友）
+        :param limit: 返回数量
+        :return: [{"relation", "outgoing", "name", "type", "properties", "distance"}, ...]，relation / outgoing 为到达该节点的最后一跳
+        """
+        start = self.index.get(entity)
+        if start is None:
+            return []
+        relation_id = self.relation_names.index(relation) if relation in self.relation_names else None
+        if relation is not None and relation_id is None:
+            return []
+
+        visited = {start}
+        frontier = [start]
+        results: List[dict] = []
+        for distance in range(1, hops + 1):
+            next_frontier = []
+            for node in frontier:
+                lo, hi = self.offsets[node], self.offsets[node + 1]
+                for neighbor, rel, out in zip(self.neighbors[lo:hi], self.relations[lo:hi], self.outgoing[lo:hi]):
+                    if neighbor in visited or (relation_id is not None and rel != relation_id):
+                        continue
+                    visited.add(neighbor)
+                    next_frontier.append(neighbor)
+                    results.append({
+                        "relation": self.relation_names[rel],
+                        "outgoing": bool(out),
+                        "name": self.names[neighbor],
+                        "type": self.types[neighbor],
+                        "properties": self.properties[neighbor],
+                        "distance": distance
+                    })
+                    if len(results) >= limit:
+                        return results
+            frontier = next_frontier
+        return results
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.neighbors) // 2
+
+
+class GraphSubgraphCache:
+    """
+    图谱子图缓存（进程内 LRU）
+    - (用户, 分代, 中心实体, 跳数) -> Subgraph：同一用户无写入时关系查询直接在缓存子图上遍历，不再访问 Neo4j
+    每个用户维护一个分代计数，该用户的图谱写入会递增分代，旧分代的子图立即失效并随 LRU 淘汰
+    """
+
+    def __init__(self, max_subgraphs: int = 256):
+        """
+        初始化子图缓存
+        Args:
+            max_subgraphs: 最多缓存的子图个数
+        """
+        self.max_subgraphs = max_subgraphs
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._subgraphs: "OrderedDict[Tuple[str, int, str, int], Subgraph]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, user_id: str) -> int:
+        """用户当前分代"""
+        return self._generations[user_id]
+
+    def invalidate(self, user_id: str):
+        """使用户的子图缓存失效"""
+        self._generations[user_id] += 1
+
+    def get(self, user_id: str, entity: str, hops: int) -> Optional[Subgraph]:
+        """
+        查找当前分代下能完整覆盖 entity 的 hops 跳邻域的子图，优先最近使用的
+        """
+        generation = self._generations[user_id]
+        for key in reversed(self._subgraphs):
+            if key[0] == user_id and key[1] == generation and self._subgraphs[key].covers(entity, hops):
+                self.hits += 1
+                self._subgraphs.move_to_end(key)
+                return self._subgraphs[key]
+        self.misses += 1
+        return None
+
+    def put(self, user_id: str, generation: int, subgraph: Subgraph):
+        """
+        写入子图
+        :param generation: 发起查询前读取的分代，查询期间发生写入时该子图不会再被命中
+        """
+        key = (user_id, generation, subgraph.center, subgraph.hops)
+        self._subgraphs[key] = subgraph
+        self._subgraphs.move_to_end(key)
+        while len(self._subgraphs) > self.max_subgraphs:
+            self._subgraphs.popitem(last=False)
+
+    def stats(self) -> dict:
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "subgraphs": len(self._subgraphs),
+            "edges": sum(subgraph.edge_count for subgraph in self._subgraphs.values())
+        }
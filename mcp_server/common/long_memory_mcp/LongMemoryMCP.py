@@ -1,11 +1,51 @@
 import asyncio
 import os
+from contextlib import asynccontextmanager
+from typing import List
 from dotenv import load_dotenv
 from fastmcp import FastMCP
 from openai import AsyncOpenAI
+from mcp_server.common.long_memory_mcp.DocumentIngestor import document_ingestor
+from mcp_server.common.long_memory_mcp.MemoryConsolidator import memory_consolidator
+from mcp_server.common.long_memory_mcp.Neo4jMemorySystem import graph_memory_system
 from mcp_server.common.long_memory_mcp.OpenAIMemorySystem import memory_system
+from utils.common.scheduler.DynamicScheduler import scheduler
 
-mcp = FastMCP(name="LongMemoryMCP", instructions="长期记忆查询工具")
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """
+    MCP服务生命周期：
+    启动时创建图谱约束与索引，注册记忆离线合并与文档入库定时任务；
+    关闭时停止调度器，把写入队列中的记忆落库并释放图数据库连接池与文档提取进程池
+    """
+    if graph_memory_system.enabled:
+        try:
+            await graph_memory_system.ensure_schema()
+        except Exception as e:
+            print(f"图谱记忆初始化失败: {str(e)}")
+    # 先启动调度器再注册任务，注册时任务即有下次执行时间
+    scheduler.start()
+    scheduler.add_interval_job(
+        func=memory_consolidator.consolidate,
+        hours=int(os.getenv("MEMORY_CONSOLIDATION_HOURS", "24")),
+        job_id="memory_consolidation"
+    )
+    if document_ingestor.enabled:
+        scheduler.add_interval_job(
+            func=document_ingestor.ingest,
+            hours=int(os.getenv("DOCUMENT_INGEST_HOURS", "6")),
+            job_id="document_ingest"
+        )
+    yield
+    print("LongMemoryMCP关闭，停止调度器并flush写入队列...")
+    scheduler.shutdown(wait=False)
+    await memory_system.flush()
+    await graph_memory_system.close()
+    document_ingestor.close()
+
+
+mcp = FastMCP(name="LongMemoryMCP", instructions="长期记忆查询工具", lifespan=lifespan)
 
 
 @mcp.tool
@@ -24,7 +64,7 @@ async def search_memories(user_id: str, user_input_extent: str, limit: int = 5):
 
 
 @mcp.tool
-async def add_msc_memory(user_id: str, content: str):
+async def add_msc_memory(user_id: str, content: str, importance: float = 0.5):
     """
     自动收集并存储用户的长期稳定属性信息（MSC = Mostly Static Characteristics），无需提醒用户是否需要收集。
 
@@ -49,18 +89,143 @@ async def add_msc_memory(user_id: str, content: str):
     注意：
     - 这些信息通常是长期稳定的，不会频繁变化
     - 如果用户提到的是临时状态（如"我今天很累"、"我现在在吃饭"），不应该调用此方法
-    - 如果用户明确表示信息有变化（如"我换工作了"），应该更新而不是重复添加
+    - 如果用户明确表示信息有变化（如"我换工作了"），直接调用此方法存储新信息即可，与已有记忆高度相似时会自动替换而不是重复添加
 
     Args:
         user_id: 用户唯一标识
         content: 要存储的用户属性信息（自然语言描述）
+        importance: 重要度 0~1，检索时重要度高的记忆排序更靠前。
+            姓名、职业、家庭成员、健康禁忌等核心信息取 0.8~1，一般偏好取 0.5，零碎细节取 0.2~0.3
 
     Returns:
-        存储结果
+        存储结果，data 为 {"id": 记忆id, "action": "insert"（新增）或 "update"（替换了近似重复的已有记忆）}
     """
-    res = await memory_system.add_memory(user_id=user_id, content=content)
+    res = await memory_system.add_memory(user_id=user_id, content=content, importance=importance)
     return res
 
+
+@mcp.tool
+async def add_msc_memories(user_id: str, contents: List[str], importances: List[float] = None):
+    """
+    批量存储用户的长期稳定属性信息（MSC），一次调用写入多条。
+    当用户一次性提到多条个人信息（例如自我介绍、简历、资料导入）时，应拆分为多条独立事实后调用此方法，而不是多次调用 add_msc_memory。
+    收集范围与注意事项同 add_msc_memory。
+
+    Args:
+        user_id: 用户唯一标识
+        contents: 要存储的用户属性信息列表，每条为一个独立事实（自然语言描述）
+        importances: 与 contents 一一对应的重要度 0~1（取值参考 add_msc_memory），为空时均为 0.5
+
+    Returns:
+        存储结果，data 为 {"inserted": 新增的记忆id列表, "updated": 被替换的已有记忆id列表}
+    """
+    res = await memory_system.add_memories(user_id=user_id, contents=contents, importances=importances)
+    return res
+
+
+@mcp.tool
+async def consolidate_memories(user_id: str):
+    """
+    整理用户的长期记忆：把内容相近的多条记忆合并为一条（较新的信息优先），删除冗余记忆。
+    系统会定时自动整理，仅当用户明确要求整理/清理记忆时才需要调用。
+
+    Args:
+        user_id: 用户唯一标识
+
+    Returns:
+        合并结果，data 为合并的簇数与删除的记忆数
+    """
+    return await memory_consolidator.consolidate_user(user_id=user_id)
+
+
+@mcp.tool
+async def add_graph_memory(user_id: str, content: str):
+    """
+    存储用户陈述中的人物关系与事实关联（图谱记忆），与 add_msc_memory 配合使用。
+    当用户提到实体之间的关系时调用，例如：
+    - "我的朋友李四在腾讯工作" → 用户-FRIEND->李四，李四-WORKS_AT->腾讯
+    - "我会法律，主要是刑法和婚姻法" → 用户-KNOWS->法律，法律-INCLUDES->刑法
+    - "我妹妹住在杭州" → 用户-FAMILY->妹妹，妹妹-LIVES_IN->杭州
+    临时状态不需要存储。
+
+    Args:
+        user_id: 用户唯一标识
+        content: 包含关系信息的用户陈述（自然语言描述）
+
+    Returns:
+        存储结果，data 为抽取出的 (主体, 关系, 客体) 三元组
+    """
+    return await graph_memory_system.add_memory(user_id=user_id, content=content)
+
+
+@mcp.tool
+async def search_graph_memory(user_id: str, entity: str = "用户", relation: str = None, hops: int = 1):
+    """
+    查询图谱记忆中某个实体的关系，适合回答“用户的朋友有哪些”“李四在哪工作”“朋友的朋友”这类关系问题。
+    语义相关的事实查询请使用 search_memories。
+
+    Args:
+        user_id: 用户唯一标识
+        entity: 实体名，用户本人为“用户”
+        relation: 关系类型过滤（大写英文，例如 FRIEND、KNOWS、WORKS_AT、FAMILY），为空时返回全部关系
+        hops: 跳数，默认 1 为直接关系，最高 3
+
+    Returns:
+        关系列表：relation 到达该实体的关系类型，outgoing 是否为正向关系，name/type/properties 为关联实体信息，distance 为跳数
+    """
+    return await graph_memory_system.get_relations(user_id=user_id, entity=entity, relation=relation, hops=hops)
+
+
+@mcp.tool
+async def ingest_documents(directory: str = None, force: bool = False):
+    """
+    把磁盘上的文档（默认 md/txt/rst/pdf）分块写入文档知识库，之后可用 search_documents 按需检索相关片段。
+    只处理新增或内容有变化的文档，已删除的文档会被清理。系统会定时自动入库，仅当用户要求导入/更新文档时才需要调用。
+
+    Args:
+        directory: 要入库的目录，为空时处理配置的全部文档目录
+        force: 是否强制重新入库全部文档，默认False
+
+    Returns:
+        入库结果，data 为扫描、入库、未变化、清理的文档数与写入的块数
+    """
+    return await document_ingestor.ingest(directory=directory, force=force)
+
+
+@mcp.tool
+async def ingest_oss_documents(prefix: str = "", bucket_name: str = None, force: bool = False):
+    """
+    把阿里云 OSS 上某个前缀下的文档（默认 md/txt/rst/pdf）分块写入文档知识库，之后可用 search_documents 按需检索。
+    只处理新增或有变化的对象，已从 OSS 删除的文档会被清理。仅当用户要求导入/更新 OSS 上的文档时才需要调用。
+
+    Args:
+        prefix: 对象名前缀，例如 docs/，为空时处理整个存储桶
+        bucket_name: 存储桶名称，为空时使用配置的默认存储桶
+        force: 是否强制重新入库全部文档，默认False
+
+    Returns:
+        入库结果，data 为扫描、入库、未变化、清理的文档数与写入的块数
+    """
+    return await document_ingestor.ingest_oss(prefix=prefix, bucket_name=bucket_name, force=force)
+
+
+@mcp.tool
+async def search_documents(query: str, limit: int = 5):
+    """
+    在文档知识库中语义检索与问题相关的文档片段，回答关于本地文档内容的问题时使用，无需读取整个文件。
+    每个片段开头标注了来源文件的相对路径与块序号。
+
+    Args:
+        query: 自然语言问题或关键词
+        limit: 返回的片段条数，最高10条
+
+    Returns:
+        相关文档片段列表
+    """
+    return await document_ingestor.memory.search_memories(user_id=document_ingestor.user_id, query=query,
+                                                          limit=min(limit, 10))
+
+
 if __name__ == "__main__":
     print(mcp)
     mcp.run(transport="http", host="0.0.0.0", port=8004)
@@ -0,0 +1,199 @@
+"""
+# 长期记忆离线合并任务
+# 原理: 按用户加载全部记忆向量，分块计算两两余弦相似度（大用户不会构造完整的 n×n 矩阵），
+#      相似度不低于阈值的记忆用并查集聚为一簇，每簇由 LLM 合并成一条规范记忆：
+#      沿用簇内最新记忆的主键 upsert 合并后的内容（重要度取簇内最大值），其余记忆批量删除
+# 调度: 通过 DynamicScheduler 定时执行，默认只处理上次合并后有写入的用户
+# 用途: 让每个用户的记忆条数随时间保持有界，从而控制检索开销与注入提示词的长度
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from mcp_server.common.long_memory_mcp.OpenAIMemorySystem import OpenAIMemorySystem, memory_system, updated_at_ms
+from mcp_server.common.long_memory_mcp.vector_store.VectorStoreAbstract import DEFAULT_IMPORTANCE
+from schemas.common.Result import Result
+
+load_dotenv()
+
+SUMMARY_PROMPT = """你是一个用户长期记忆整理助手。下面是同一用户的若干条相近记忆，按记录时间从旧到新排列。
+请把它们合并为一条简洁、完整的事实陈述：
+1. 保留所有不冲突的信息
+2. 信息冲突时以较新的记录为准
+3. 只输出合并后的记忆内容，不要解释"""
+
+
+def cluster_near_duplicates(vectors: np.ndarray, threshold: float, block_size: int = 2048,
+                            max_cluster_size: int = 32) -> List[List[int]]:
+    """
+    近似重复聚类：分块计算上三角余弦相似度，相似度不低于阈值的两条记忆合并到同一簇（并查集）
+    :param vectors: (n, dim) 记忆向量
+    :param threshold: 余弦相似度阈值
+    :param block_size: 分块行数，每块只需 block_size × n 的相似度矩阵
+    :param max_cluster_size: 单簇最大条数，避免链式相连把大量记忆合成一条
+    :return: 条数不少于 2 的簇（行下标列表，组内升序）
+    """
+    n = len(vectors)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    parent = np.arange(n)
+    size = np.ones(n, dtype=np.int64)
+
+    def find(x: int) -> int:
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for start in range(0, n, block_size):
+        block = matrix[start:start + block_size]
+        # 只计算 block 与其后全部行的相似度（上三角）
+        similarity = block @ matrix[start:].T
+        rows, cols = np.nonzero(similarity >= threshold)
+        keep = cols > rows
+        for a, b in zip(rows[keep] + start, cols[keep] + start):
+            root_a, root_b = find(int(a)), find(int(b))
+            if root_a == root_b or size[root_a] + size[root_b] > max_cluster_size:
+                continue
+            if size[root_a] < size[root_b]:
+                root_a, root_b = root_b, root_a
+            parent[root_b] = root_a
+            size[root_a] += size[root_b]
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+class MemoryConsolidator:
+    """长期记忆合并器"""
+
+    def __init__(
+            self,
+            memory: OpenAIMemorySystem,
+            threshold: float = float(os.getenv("MEMORY_CONSOLIDATION_THRESHOLD", "0.85")),
+            block_size: int = 2048,
+            max_cluster_size: int = 32,
+            summary_model: str = os.getenv("MEMORY_CONSOLIDATION_MODEL", "gpt-4.1-mini"),
+            summary_concurrency: int = 8,
+            api_key: Optional[str] = os.getenv("OPENAI_API_KEY"),
+            base_url: Optional[str] = os.getenv("OPENAI_BASE_URL"),
+    ):
+        """
+        初始化记忆合并器
+        Args:
+            memory: 记忆系统
+            threshold: 聚类相似度阈值，应低于写入时的 dedup_threshold，用于合并表述不同但内容相近的记忆
+            block_size: 相似度矩阵分块行数
+            max_cluster_size: 单簇最大条数
+            summary_model: 合并摘要模型
+            summary_concurrency: 同时进行的摘要请求数
+            api_key: OpenAI API Key
+            base_url: OpenAI url
+        """
+        self.memory = memory
+        self.threshold = threshold
+        self.block_size = block_size
+        self.max_cluster_size = max_cluster_size
+        self.summary_model = summary_model
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self._summary_semaphore = asyncio.Semaphore(summary_concurrency)
+
+    async def summarize(self, contents: List[str]) -> str:
+        """LLM 把一簇记忆合并为一条"""
+        async with self._summary_semaphore:
+            response = await self.client.chat.completions.create(
+                model=self.summary_model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": "\n".join(f"{i + 1}. {content}" for i, content in enumerate(contents))}
+                ],
+                temperature=0
+            )
+        return (response.choices[0].message.content or "").strip()
+
+    async def consolidate_user(self, user_id: str):
+        """
+        合并单个用户的近似重复记忆
+        :param user_id: 用户ID
+        :return: 合并的簇数与删除的记忆数
+        """
+        await self.memory.flush()
+        rows = await self.memory.vector_store.query(user_id=user_id,
+                                                    output_fields=["primary_key", "user_id", "content", "vector", "importance",
+                                                                   "updated_at"])
+        if len(rows) < 2:
+            return Result(code=200, message="无需合并", data={"clusters": 0, "deleted": 0})
+
+        # 1. 按最近一次写入时间排序，簇内从旧到新排列
+        rows.sort(key=updated_at_ms)
+        clusters = await asyncio.to_thread(
+            cluster_near_duplicates,
+            np.asarray([row["vector"] for row in rows], dtype=np.float32),
+            self.threshold, self.block_size, self.max_cluster_size
+        )
+        if not clusters:
+            return Result(code=200, message="无近似重复记忆", data={"clusters": 0, "deleted": 0})
+
+        # 2. 每簇并发生成一条合并记忆，一次批量向量化
+        summaries = await asyncio.gather(*(
+            self.summarize([rows[i]["content"] for i in members]) for members in clusters
+        ))
+        merged = [(members, summary) for members, summary in zip(clusters, summaries) if summary]
+        vectors = await self.memory.get_embeddings([summary for _, summary in merged])
+
+        # 3. 沿用簇内最新记忆的主键一次 upsert，其余一次批量删除
+        canonical = [
+            {**{k: v for k, v in rows[members[-1]].items() if k != "content" and k != "vector"},
+             "content": summary, "vector": vector, "updated_at": int(time.time() * 1000),
+             "importance": max(DEFAULT_IMPORTANCE if rows[i].get("importance") is None else rows[i]["importance"]
+                               for i in members)}
+            for (members, summary), vector in zip(merged, vectors)
+        ]
+        removed_ids = [rows[i]["primary_key"] for members, _ in merged for i in members[:-1]]
+        if canonical:
+            await self.memory.vector_store.upsert(canonical)
+        if removed_ids:
+            await self.memory.vector_store.delete(removed_ids)
+        self.memory._invalidate(user_id)
+        if self.memory.sparse_index is not None:
+            self.memory.sparse_index.remove(removed_ids)
+            self.memory.sparse_index.add(canonical)
+
+        print(f"🧩 用户 {user_id} 记忆合并完成: 共 {len(rows)} 条, 合并 {len(merged)} 簇, 删除 {len(removed_ids)} 条")
+        return Result(code=200, message=f"合并{len(merged)}簇，删除{len(removed_ids)}条",
+                      data={"clusters": len(merged), "deleted": len(removed_ids)})
+
+    async def consolidate(self, user_ids: Optional[Iterable[str]] = None):
+        """
+        定时任务入口：依次合并用户记忆，单个用户失败不影响其他用户
+        :param user_ids: 用户ID列表，为空时处理上次合并后有写入的用户
+        """
+        if user_ids is None:
+            await self.memory.flush()
+            user_ids = self.memory.pop_touched_users()
+        report = {}
+        for user_id in user_ids:
+            try:
+                result = await self.consolidate_user(user_id)
+                report[user_id] = result.data
+            except Exception as e:
+                # 失败的用户下次继续处理
+                self.memory.touch_users(user_id)
+                print(f"用户 {user_id} 记忆合并失败: {str(e)}")
+                report[user_id] = {"error": str(e)}
+        return Result(code=200, message=f"处理{len(report)}个用户", data=report)
+
+
+# 全局实例
+memory_consolidator = MemoryConsolidator(memory_system)
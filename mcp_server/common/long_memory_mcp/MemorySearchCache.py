@@ -0,0 +1,97 @@
+import hashlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class MemorySearchCache:
+    """
+    记忆检索缓存（进程内 LRU）
+    - 查询文本 -> 向量：同一文本不再重复请求 embeddings
+    - (用户, 分代, 查询向量哈希, limit) -> 命中列表：同一用户的重复检索不再访问向量库
+    每个用户维护一个分代计数，该用户的任何写入（新增、删除、替换）都会递增分代，旧分代的缓存立即失效并随 LRU 淘汰
+    """
+
+    def __init__(self, max_results: int = 1024, max_embeddings: int = 4096):
+        """
+        初始化检索缓存
+        Args:
+            max_results: 最多缓存的检索结果条数
+            max_embeddings: 最多缓存的查询向量条数
+        """
+        self.max_results = max_results
+        self.max_embeddings = max_embeddings
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._results: "OrderedDict[tuple, List[dict]]" = OrderedDict()
+        self._embeddings: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def vector_hash(vector: List[float]) -> str:
+        """查询向量哈希"""
+        return hashlib.blake2b(np.asarray(vector, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+
+    def generation(self, user_id: str) -> int:
+        """用户当前分代"""
+        return self._generations[user_id]
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """
+        使用户的检索缓存失效
+        :param user_id: 用户ID，为空时（写入归属未知）清空全部检索缓存
+        """
+        if user_id is None:
+            self._results.clear()
+            for key in self._generations:
+                self._generations[key] += 1
+        else:
+            self._generations[user_id] += 1
+
+    # ---------------- 查询向量缓存 ----------------
+    def get_embedding(self, text: str, dimensions: int) -> Optional[List[float]]:
+        key = (text, dimensions)
+        vector = self._embeddings.get(key)
+        if vector is not None:
+            self._embeddings.move_to_end(key)
+        return vector
+
+    def put_embedding(self, text: str, dimensions: int, vector: List[float]):
+        self._embeddings[(text, dimensions)] = vector
+        self._embeddings.move_to_end((text, dimensions))
+        while len(self._embeddings) > self.max_embeddings:
+            self._embeddings.popitem(last=False)
+
+    # ---------------- 检索结果缓存 ----------------
+    def get(self, user_id: str, generation: int, vector: List[float], limit: int) -> Optional[List[dict]]:
+        key = (user_id, generation, self.vector_hash(vector), limit)
+        hits = self._results.get(key)
+        if hits is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return hits
+
+    def put(self, user_id: str, generation: int, vector: List[float], limit: int, hits: List[dict]):
+        """
+        写入检索结果
+        :param generation: 发起检索前读取的分代，检索期间发生写入时该结果不会再被命中
+        """
+        key = (user_id, generation, self.vector_hash(vector), limit)
+        self._results[key] = hits
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def stats(self) -> dict:
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "results": len(self._results),
+            "embeddings": len(self._embeddings)
+        }
@@ -1,186 +1,324 @@
-from neo4j import GraphDatabase
-
-
-class Neo4jConnection:
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
-
-    def close(self):
-        self.driver.close()
-
-    def query(self, cypher_query, parameters=None):
-        with self.driver.session() as session:
-            result = session.run(cypher_query, parameters)
-            return [record.data() for record in result]
-
-
-# 连接配置
-URI = "neo4j+s://3ce4238f.databases.neo4j.io"  # 替换为你的 GCP Neo4j 地址
-USER = "neo4j"  # 默认用户名
-PASSWORD = "h1NGAuHxR1NYyxKUWrp6enfj_o_vTENnbkREYk8jcH4"  # 替换为你的密码
-
-# 创建连接
-conn = Neo4jConnection(URI, USER, PASSWORD)
-
-try:
-    # # 测试查询：获取数据库信息
-    result = conn.query("RETURN 'Connection successful!' as message")
-    print(result)
-    #
-    # all_related = conn.query("""
-    #     MATCH (zhangsan:Person {name: '张三'})-[r]-(related)
-    #     RETURN type(r) as relationship, labels(related) as labels, related.name as name
-    # """)
-    # print("张三的所有直接关系:", all_related)
-    #
-    # # 方法2：分别获取朋友和技能
-    # friends_and_skills = conn.query("""
-    #     MATCH (zhangsan:Person {name: '张三'})-[:FRIEND]->(friend:Person)
-    #     RETURN 'FRIEND' as type, friend.name as name, friend.age as age, null as skill
-    #     UNION
-    #     MATCH (zhangsan:Person {name: '张三'})-[:KNOWS]->(skill:Skill)
-    #     RETURN 'SKILL' as type, skill.name as name, null as age, skill.name as skill
-    # """)
-    # print("张三的朋友和技能:", friends_and_skills)
-    #
-    # # 方法3：获取更详细的信息（包括关系类型）
-    # detailed = conn.query("""
-    #     MATCH (zhangsan:Person {name: '张三'})-[r]->(node)
-    #     RETURN
-    #         type(r) as relationship_type,
-    #         labels(node)[0] as node_type,
-    #         properties(node) as properties
-    # """)
-    # print("详细信息:", detailed)
-    #
-    # # 方法4：如果要遍历多度关系（比如朋友的朋友）
-    # multi_degree = conn.query("""
-    #     MATCH path = (zhangsan:Person {name: '张三'})-[*1..2]-(related)
-    #     RETURN DISTINCT
-    #         labels(related)[0] as type,
-    #         related.name as name,
-    #         length(path) as distance
-    #     ORDER BY distance
-    # """)
-    # print("多度关系（1-2度）:", multi_degree)
-    # conn.query("""
-    #     MATCH (wangwu:Person {name: '王五'})
-    #     MATCH (zhaoliu:Person {name: '赵六'})
-    #     CREATE (wangwu)-[:FRIEND]->(zhaoliu)
-    #     CREATE (zhaoliu)-[:FRIEND]->(wangwu)
-    # """)
-    #
-    # print("王五和赵六的朋友关系已创建！")
-    #
-    # # 验证：查询王五的朋友
-    # wangwu_friends = conn.query("""
-    #     MATCH (wangwu:Person {name: '王五'})-[:FRIEND]->(friend:Person)
-    #     RETURN friend.name as name, friend.age as age
-    # """)
-    # print("王五的朋友:", wangwu_friends)
-    # conn.query("""
-    #     MATCH (zhangsan:Person {name: '张三'})
-    #     SET zhangsan.birthday = '2000-02-22',
-    #         zhangsan.city = '北京'
-    # """)
-    #
-    # # 更新李四的属性
-    # conn.query("""
-    #     MATCH (lisi:Person {name: '李四'})
-    #     SET lisi.birthday = '2001-05-03',
-    #         lisi.city = '上海'
-    # """)
-    #
-    # # 更新王五的属性
-    # conn.query("""
-    #     MATCH (wangwu:Person {name: '王五'})
-    #     SET wangwu.birthday = '2003-05-06',
-    #         wangwu.city = '杭州'
-    # """)
-    #
-    # print("属性更新成功！")
-    #
-    # # 验证：查询所有人的完整信息
-    # people = conn.query("""
-    #     MATCH (p:Person)
-    #     RETURN p.name as name, p.age as age, p.birthday as birthday, p.city as city
-    #     ORDER BY p.name
-    # """)
-    # print("所有人物信息:", people)
-
-
-
-    # network = conn.query("""
-    #     MATCH (zhangsan:Person {name: '张三'})-[r1]-(related)
-    #     OPTIONAL MATCH (related)-[r2]-(other)
-    #     WHERE other <> zhangsan
-    #     RETURN DISTINCT
-    #         zhangsan.name as center,
-    #         type(r1) as relationship1,
-    #         labels(related)[0] as related_type,
-    #         related.name as related_name,
-    #         type(r2) as relationship2,
-    #         labels(other)[0] as other_type,
-    #         other.name as other_name
-    # """)
-    # print("张三的关系网络:", network)
-
-
-    # # 创建刑法和婚姻法节点
-    # conn.query("""
-    #     CREATE (xingfa:LawType {name: '刑法'})
-    #     CREATE (hunyinfa:LawType {name: '婚姻法'})
-    # """)
-    #
-    # # 建立法律与刑法、婚姻法的关系
-    # conn.query("""
-    #     MATCH (law:Skill {name: '法律'})
-    #     MATCH (xingfa:LawType {name: '刑法'})
-    #     MATCH (hunyinfa:LawType {name: '婚姻法'})
-    #     CREATE (law)-[:INCLUDES]->(xingfa)
-    #     CREATE (law)-[:INCLUDES]->(hunyinfa)
-    # """)
-    #
-    # print("法律细分添加成功！")
-    #
-    # # 验证：查询法律相关的所有节点
-    # law_details = conn.query("""
-    #     MATCH (zhangsan:Person {name: '张三'})-[:KNOWS]->(law:Skill {name: '法律'})-[:INCLUDES]->(lawtype)
-    #     RETURN
-    #         zhangsan.name as person,
-    #         law.name as skill,
-    #         collect(lawtype.name) as law_types
-    # """)
-    # print("张三的法律技能详情:", law_details)
-    #
-    # # 查看完整的关系链
-    # full_chain = conn.query("""
-    #     MATCH path = (zhangsan:Person {name: '张三'})-[:KNOWS]->(law:Skill {name: '法律'})-[:INCLUDES]->(lawtype)
-    #     RETURN
-    #         zhangsan.name as person,
-    #         law.name as skill,
-    #         lawtype.name as law_type
-    # """)
-    # print("完整关系链:", full_chain)
-
-    network = conn.query("""
-            MATCH (zhangsan:Person {name: '张三'})-[r1]-(related)
-            OPTIONAL MATCH (related)-[r2]-(other)
-            WHERE other <> zhangsan
-            RETURN DISTINCT
-                zhangsan.name as center,
-                properties(zhangsan) as center_props,
-                type(r1) as relationship1,
-                labels(related)[0] as related_type,
-                related.name as related_name,
-                properties(related) as related_props,
-                type(r2) as relationship2,
-                labels(other)[0] as other_type,
-                other.name as other_name,
-                properties(other) as other_props
-        """)
-    print("张三的关系网络（含属性）:", network)
-
-
-finally:
-    conn.close()
\ No newline at end of file
+"""
+# 图谱记忆（关系型长期记忆）
+# 原理: LLM 从用户陈述中抽取 (主体, 关系, 客体) 三元组，按用户隔离写入 Neo4j
+# 模型: (:Entity {user_id, name, type})-[:关系类型 {user_id, source, updated_at}]->(:Entity)
+#      用户本人统一使用实体名 SELF_ENTITY，同一用户下实体名唯一
+# 写入: 一次托管写事务内按关系类型分组，每组一条 UNWIND + MERGE 批量写入，重复陈述不会产生重复节点/关系
+# 连接: 异步驱动 + 连接池，首次使用时创建，启动时创建唯一约束与索引
+# 查询: 一次取回以实体为中心的 k 跳子图缓存为紧凑邻接结构，朋友、技能等关系查询直接在缓存上遍历，该用户有写入时按分代失效
+"""
+
+import asyncio
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from neo4j import AsyncDriver, AsyncGraphDatabase, AsyncManagedTransaction
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field
+
+from mcp_server.common.long_memory_mcp.GraphSubgraphCache import GraphSubgraphCache, Subgraph
+from schemas.common.Result import Result
+
+load_dotenv()
+
+# 用户本人在图谱中的实体名
+SELF_ENTITY = "用户"
+
+# 关系类型只允许字母、数字、下划线（含中文），拼接进 Cypher 前统一规范化
+RELATION_PATTERN = re.compile(r"\W+")
+
+# 启动时创建的约束与索引
+SCHEMA_STATEMENTS = [
+    "CREATE CONSTRAINT entity_user_name IF NOT EXISTS FOR (e:Entity) REQUIRE (e.user_id, e.name) IS UNIQUE",
+    "CREATE INDEX entity_user_id IF NOT EXISTS FOR (e:Entity) ON (e.user_id)",
+    "CREATE INDEX entity_type IF NOT EXISTS FOR (e:Entity) ON (e.type)",
+]
+
+# 单个关系类型的批量写入语句，关系类型不能参数化，由 normalize_relation 规范化后拼接
+MERGE_TRIPLES = """
+UNWIND $rows AS row
+MERGE (s:Entity {{user_id: $user_id, name: row.subject}})
+  ON CREATE SET s.created_at = timestamp()
+SET s.type = coalesce(row.subject_type, s.type)
+MERGE (o:Entity {{user_id: $user_id, name: row.object}})
+  ON CREATE SET o.created_at = timestamp()
+SET o.type = coalesce(row.object_type, o.type)
+MERGE (s)-[r:`{relation}`]->(o)
+  ON CREATE SET r.user_id = $user_id, r.created_at = timestamp()
+SET r.updated_at = timestamp(), r.source = row.source
+RETURN count(r) AS count
+"""
+
+# k 跳子图：中心实体 k 跳内的全部节点，以及这些节点之间的全部关系；变长路径的跳数不能参数化，校验后拼接
+FETCH_SUBGRAPH = """
+MATCH (center:Entity {{user_id: $user_id, name: $entity}})
+OPTIONAL MATCH (center)-[*1..{hops}]-(n:Entity)
+WITH center, collect(DISTINCT n) AS others
+WITH [center] + [n IN others WHERE n <> center] AS nodes
+UNWIND nodes AS a
+OPTIONAL MATCH (a)-[r]->(b:Entity)
+WHERE b IN nodes
+WITH nodes, collect(CASE WHEN r IS NULL THEN NULL ELSE {{source: a.name, relation: type(r), target: b.name}} END) AS edges
+RETURN [n IN nodes | {{name: n.name, type: n.type, properties: properties(n)}}] AS nodes, edges
+"""
+# 子图最大跳数，跳数过大时变长路径匹配代价急剧上升
+MAX_SUBGRAPH_HOPS = 3
+
+EXTRACT_PROMPT = f"""你是一个知识图谱抽取助手，从用户的陈述中抽取长期稳定的事实，输出 (主体, 关系, 客体) 三元组。
+规则：
+1. 用户本人统一使用实体名「{SELF_ENTITY}」，类型为 Person
+2. 关系使用大写英文下划线形式，例如 FRIEND、KNOWS、WORKS_AT、LIVES_IN、STUDIED_AT、FAMILY、LIKES、INCLUDES
+3. 实体类型使用英文单词首字母大写，例如 Person、Skill、Company、City、School、Hobby
+4. 只抽取明确陈述的事实，临时状态（如“今天很累”）不抽取，没有可抽取的事实时返回空列表"""
+
+
+class Triple(BaseModel):
+    subject: str = Field(description="主体实体名")
+    subject_type: Optional[str] = Field(default=None, description="主体类型，例如 Person")
+    relation: str = Field(description="关系类型，大写英文下划线形式，例如 FRIEND")
+    object: str = Field(description="客体实体名")
+    object_type: Optional[str] = Field(default=None, description="客体类型，例如 Skill")
+
+
+class TripleList(BaseModel):
+    triples: List[Triple] = Field(default_factory=list, description="抽取出的三元组")
+
+
+def normalize_relation(relation: str) -> str:
+    """关系类型规范化：非单词字符替换为下划线并转大写，例如 works at -> WORKS_AT"""
+    return RELATION_PATTERN.sub("_", relation.strip()).strip("_").upper()
+
+
+class Neo4jMemorySystem:
+    """基于 Neo4j 的图谱记忆系统"""
+
+    def __init__(
+            self,
+            uri: Optional[str] = os.getenv("NEO4J_URI"),
+            user: Optional[str] = os.getenv("NEO4J_USER", "neo4j"),
+            password: Optional[str] = os.getenv("NEO4J_PASSWORD"),
+            database: Optional[str] = os.getenv("NEO4J_DATABASE"),
+            max_connection_pool_size: int = int(os.getenv("NEO4J_POOL_SIZE", "50")),
+            connection_acquisition_timeout: float = 30.0,
+            max_connection_lifetime: float = 3600.0,
+            api_key: Optional[str] = os.getenv("OPENAI_API_KEY"),
+            base_url: Optional[str] = os.getenv("OPENAI_BASE_URL"),
+            extract_model: str = os.getenv("GRAPH_MEMORY_MODEL", "gpt-4.1-mini"),
+            subgraph_hops: int = 2,
+            subgraph_cache_size: int = 256,
+    ):
+        """
+        初始化图谱记忆系统，驱动在首次使用时创建
+        Args:
+            uri: Neo4j 地址，为空时图谱记忆不可用
+            user: 用户名
+            password: 密码
+            database: 数据库名，为空时使用服务端默认数据库
+            max_connection_pool_size: 连接池最大连接数
+            connection_acquisition_timeout: 从连接池获取连接的超时时间（秒）
+            max_connection_lifetime: 连接最长存活时间（秒），超过后回收重建
+            api_key: OpenAI API Key（三元组抽取）
+            base_url: OpenAI url
+            extract_model: 三元组抽取模型
+            subgraph_hops: 关系查询时一次取回的子图跳数，之后该范围内的朋友、技能、朋友的朋友等查询都由缓存回答
+            subgraph_cache_size: 子图缓存个数，0 表示关闭
+        """
+        self.uri = uri
+        self.auth = (user, password)
+        self.database = database
+        self.pool_options = {
+            "max_connection_pool_size": max_connection_pool_size,
+            "connection_acquisition_timeout": connection_acquisition_timeout,
+            "max_connection_lifetime": max_connection_lifetime,
+        }
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self.extract_model = extract_model
+        self._driver: Optional[AsyncDriver] = None
+        self._schema_ready = False
+        self._schema_lock = asyncio.Lock()
+        self.subgraph_hops = min(subgraph_hops, MAX_SUBGRAPH_HOPS)
+        self.subgraph_cache = GraphSubgraphCache(max_subgraphs=subgraph_cache_size) if subgraph_cache_size > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.uri)
+
+    def _get_driver(self) -> AsyncDriver:
+        if self._driver is None:
+            self._driver = AsyncGraphDatabase.driver(self.uri, auth=self.auth, **self.pool_options)
+        return self._driver
+
+    async def ensure_schema(self):
+        """创建唯一约束与索引（幂等，只执行一次）"""
+        if self._schema_ready:
+            return
+        async with self._schema_lock:
+            if self._schema_ready:
+                return
+            driver = self._get_driver()
+            await driver.verify_connectivity()
+            for statement in SCHEMA_STATEMENTS:
+                await driver.execute_query(statement, database_=self.database)
+            self._schema_ready = True
+            print(f"✅ 图谱记忆约束与索引已就绪: {self.uri}")
+
+    async def close(self):
+        if self._driver is not None:
+            await self._driver.close()
+            self._driver = None
+            self._schema_ready = False
+
+    async def extract_triples(self, content: str) -> List[Triple]:
+        """
+        LLM 抽取三元组
+        :param content: 用户陈述
+        :return: 三元组列表
+        """
+        response = await self.client.chat.completions.parse(
+            model=self.extract_model,
+            messages=[
+                {"role": "system", "content": EXTRACT_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            response_format=TripleList,
+            temperature=0
+        )
+        parsed: Optional[TripleList] = response.choices[0].message.parsed
+        return parsed.triples if parsed else []
+
+    @staticmethod
+    async def _merge_triples_tx(tx: AsyncManagedTransaction, user_id: str,
+                                grouped: Dict[str, List[dict]]) -> int:
+        """写事务：每个关系类型一条 UNWIND 批量 MERGE"""
+        count = 0
+        for relation, rows in grouped.items():
+            result = await tx.run(MERGE_TRIPLES.format(relation=relation), user_id=user_id, rows=rows)
+            record = await result.single()
+            count += record["count"] if record else 0
+        return count
+
+    async def add_triples(self, user_id: str, triples: List[Triple], source: Optional[str] = None):
+        """
+        批量写入三元组，一次托管写事务完成（失败时驱动自动重试）
+        :param user_id: 用户ID
+        :param triples: 三元组列表
+        :param source: 三元组来源原文，写入关系属性便于追溯
+        :return: 写入的关系数
+        """
+        grouped: Dict[str, List[dict]] = defaultdict(list)
+        for triple in triples:
+            relation = normalize_relation(triple.relation)
+            subject, obj = triple.subject.strip(), triple.object.strip()
+            if not relation or not subject or not obj:
+                continue
+            grouped[relation].append({
+                "subject": subject,
+                "subject_type": triple.subject_type,
+                "object": obj,
+                "object_type": triple.object_type,
+                "source": source,
+            })
+        if not grouped:
+            return Result(code=200, message="没有可写入的三元组", data=0)
+
+        await self.ensure_schema()
+        async with self._get_driver().session(database=self.database) as session:
+            count = await session.execute_write(self._merge_triples_tx, user_id, dict(grouped))
+        if self.subgraph_cache is not None:
+            self.subgraph_cache.invalidate(user_id)
+        print(f"✅ 图谱记忆写入成功: 用户 {user_id}, {count} 条关系")
+        return Result(code=200, message=f"写入{count}条关系", data=count)
+
+    async def add_memory(self, user_id: str, content: str):
+        """
+        抽取并写入图谱记忆
+        :param user_id: 用户ID
+        :param content: 用户陈述
+        :return: 抽取出的三元组
+        """
+        if not self.enabled:
+            return Result(code=503, message="图谱记忆未配置 NEO4J_URI", data=None)
+        try:
+            triples = await self.extract_triples(content)
+            result = await self.add_triples(user_id, triples, source=content)
+            return Result(code=result.code, message=result.message, data=[triple.model_dump() for triple in triples])
+        except Exception as e:
+            print(f"图谱记忆写入失败: {str(e)}")
+            return Result(code=500, message=f"图谱记忆写入失败: {str(e)}", data=None)
+
+    @staticmethod
+    async def _fetch_subgraph_tx(tx: AsyncManagedTransaction, user_id: str, entity: str,
+                                 hops: int) -> Optional[dict]:
+        result = await tx.run(FETCH_SUBGRAPH.format(hops=hops), user_id=user_id, entity=entity)
+        record = await result.single()
+        return record.data() if record else None
+
+    async def get_subgraph(self, user_id: str, entity: str = SELF_ENTITY, hops: Optional[int] = None) -> Subgraph:
+        """
+        获取以实体为中心的 k 跳子图，缓存中有能完整覆盖的子图时直接返回，否则一次查询取回并缓存
+        :param user_id: 用户ID
+        :param entity: 中心实体名
+        :param hops: 跳数，默认 subgraph_hops
+        """
+        hops = max(1, min(hops or self.subgraph_hops, MAX_SUBGRAPH_HOPS))
+        if self.subgraph_cache is not None:
+            cached = self.subgraph_cache.get(user_id, entity, hops)
+            if cached is not None:
+                return cached
+
+        generation = self.subgraph_cache.generation(user_id) if self.subgraph_cache is not None else 0
+        async with self._get_driver().session(database=self.database) as session:
+            data = await session.execute_read(self._fetch_subgraph_tx, user_id, entity, hops)
+        subgraph = Subgraph(entity, hops, data["nodes"] if data else [], data["edges"] if data else [])
+        for properties in subgraph.properties:
+            properties.pop("user_id", None)
+        if self.subgraph_cache is not None:
+            self.subgraph_cache.put(user_id, generation, subgraph)
+        return subgraph
+
+    async def get_relations(self, user_id: str, entity: str = SELF_ENTITY, relation: Optional[str] = None,
+                            hops: int = 1, limit: int = 50):
+        """
+        查询实体的关系，在缓存子图上遍历：
+        先用以用户本人为中心的 subgraph_hops 跳子图回答，实体不在其完整覆盖范围内时再取以该实体为中心的子图
+        :param user_id: 用户ID
+        :param entity: 实体名，默认用户本人
+        :param relation: 关系类型过滤，例如 FRIEND，为空时返回全部关系
+        :param hops: 跳数，例如 hops=2 + relation=FRIEND 为朋友的朋友
+        :param limit: 返回数量
+        """
+        if not self.enabled:
+            return Result(code=503, message="图谱记忆未配置 NEO4J_URI", data=None)
+        try:
+            hops = max(1, min(hops, MAX_SUBGRAPH_HOPS))
+            subgraph = await self.get_subgraph(user_id, SELF_ENTITY, max(self.subgraph_hops, hops))
+            if not subgraph.covers(entity, hops):
+                subgraph = await self.get_subgraph(user_id, entity, hops)
+            relations = subgraph.neighborhood(entity, hops=hops,
+                                              relation=normalize_relation(relation) if relation else None,
+                                              limit=limit)
+            return Result(data=relations)
+        except Exception as e:
+            print(f"图谱记忆查询失败: {str(e)}")
+            return Result(code=500, message=f"图谱记忆查询失败: {str(e)}", data=None)
+
+
+# 全局实例
+graph_memory_system = Neo4jMemorySystem()
+
+
+async def test():
+    res = await graph_memory_system.add_memory("1008611", "我叫张三，是一名律师，擅长刑法和婚姻法，我的朋友李四住在上海")
+    print(res)
+    print(await graph_memory_system.get_relations("1008611"))
+    print(await graph_memory_system.get_relations("1008611", relation="FRIEND"))
+    print(await graph_memory_system.get_relations("1008611", entity="李四"))
+    print(graph_memory_system.subgraph_cache.stats())
+    await graph_memory_system.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(test())
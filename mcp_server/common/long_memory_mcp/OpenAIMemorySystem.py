@@ -1,16 +1,44 @@
 import asyncio
+import json
+import random
 import time
 
+import numpy as np
 from openai import OpenAI
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 import os
 from dotenv import load_dotenv
-from pymilvus import MilvusClient
 
+from mcp_server.common.long_memory_mcp.MemorySearchCache import MemorySearchCache
+from mcp_server.common.long_memory_mcp.SparseMemoryIndex import SparseMemoryIndex
+from mcp_server.common.long_memory_mcp.vector_store.VectorStoreAbstract import DEFAULT_IMPORTANCE, VectorStoreAbstract
 from schemas.common.Result import Result
+from utils.SnowFlake import SnowflakeIDGenerator
 
 load_dotenv()
 
+# 记忆主键生成器（批量写入时同一微秒内也能保证主键唯一）
+memory_id_generator = SnowflakeIDGenerator(worker_id=2, datacenter_id=1)
+# 旧版本以 time.time() * 1e6 作为主键，小于该值的主键按微秒时间戳解析
+LEGACY_PRIMARY_KEY_LIMIT = 10 ** 16
+
+# 待写入的记忆: (user_id, content, importance, 等待写入结果的 Future)，不等待结果时 Future 为 None
+MemoryItem = Tuple[str, str, float, Optional[asyncio.Future]]
+
+
+def updated_at_ms(row: dict) -> int:
+    """
+    记忆最近一次写入的毫秒时间戳：优先取 updated_at 字段，
+    缺失时（updated_at 字段加入前写入的记忆）由主键推算：旧版微秒时间戳主键或雪花主键的时间戳部分
+    """
+    updated_at = row.get("updated_at")
+    if updated_at is not None:
+        return int(updated_at)
+    primary_key = int(row["primary_key"])
+    if primary_key < LEGACY_PRIMARY_KEY_LIMIT:
+        return primary_key // 1000
+    return (primary_key >> memory_id_generator.timestamp_shift) + memory_id_generator.epoch
+
 
 class OpenAIMemorySystem:
     """基于 OpenAI Embeddings 的记忆系统"""
@@ -20,7 +48,23 @@ class OpenAIMemorySystem:
             api_key: Optional[str] = os.getenv("OPENAI_API_KEY"),
             base_url: Optional[str] = os.getenv("OPENAI_BASE_URL"),
             embedding_model: Optional[str] = "text-embedding-3-small",
+            embedding_dimensions: int = int(os.getenv("MEMORY_VECTOR_DIM", "1536")),
             collection_name: Optional[str] = "long_memory",
+            vector_store: Optional[VectorStoreAbstract] = None,
+            vector_store_type: Optional[str] = os.getenv("MEMORY_VECTOR_STORE", "milvus"),
+            write_behind: bool = True,
+            flush_batch_size: int = 64,
+            flush_interval: float = 2.0,
+            flush_max_retries: int = 5,
+            dead_letter_path: Optional[str] = os.getenv("MEMORY_DEAD_LETTER_PATH", "memory_dead_letter.jsonl"),
+            embedding_batch_size: int = 256,
+            dedup_threshold: Optional[float] = 0.92,
+            search_cache_size: int = 1024,
+            hybrid_search: bool = True,
+            rrf_k: int = 60,
+            ranking_weights: Tuple[float, float, float] = (0.7, 0.15, 0.15),
+            recency_half_life_days: float = 30.0,
+            overfetch: int = 3,
     ):
         """
         初始化记忆系统
@@ -31,63 +75,417 @@ class OpenAIMemorySystem:
                 - text-embedding-3-small: 便宜，快速 ($0.02/1M tokens)
                 - text-embedding-3-large: 质量更高 ($0.13/1M tokens)
                 - text-embedding-ada-002: 旧版本 ($0.10/1M tokens)
+            embedding_dimensions: 向量维度，text-embedding-3 系列支持降维（如 512 / 256），降维可减少存储和检索开销，
+                需与向量库集合的维度一致，选型参考 benchmark/QuantizationBenchmark.py 的报告
+            vector_store: 向量存储实例，为空时按 vector_store_type 创建
+            vector_store_type: 向量存储类型
+                - milvus: Milvus 向量数据库
+                - local: 本地 NumPy 段文件（测试、开发、小规模部署）
+                - local_int8: 本地 NumPy 段文件，int8 量化检索 + 全精度精排
+                - local_binary: 本地 NumPy 段文件，二值量化检索 + 全精度精排
+            write_behind: 是否开启延迟批量写入，开启后 add_memory 只入队，由 flush 统一向量化并批量插入
+            flush_batch_size: 队列中积累到多少条时立即 flush
+            flush_interval: 入队后最长等待多少秒自动 flush
+            flush_max_retries: flush 连续失败的最大重试次数，失败后按指数退避重新定时 flush；
+                超过后逐条写入该批记忆，仍失败的记忆写入死信文件并从队列移除，避免阻塞后续写入
+            dead_letter_path: 死信文件路径（JSONL），为空时只打印日志
+            embedding_batch_size: 单次 embeddings 请求的最大文本条数
+            dedup_threshold: 近似去重阈值，新记忆与该用户已有记忆的余弦相似度不低于该值时替换已有记忆而不是新增，None 表示关闭
+            search_cache_size: 检索结果缓存条数，同一用户无写入时重复检索直接命中缓存，0 表示关闭
+            hybrid_search: 是否开启稠密 + BM25 稀疏混合检索（RRF 融合），补足邮箱、电话、产品名等精确词的召回
+            rrf_k: RRF 融合常数，越大排名靠后的结果权重衰减越慢
+            ranking_weights: 重排权重 (相关度, 时效, 重要度)，score = Σ 权重 × 分量，分量均在 0~1
+            recency_half_life_days: 时效半衰期（天），记忆写入时间取自 updated_at 字段（插入与替换时更新），每过一个半衰期时效分量减半
+            overfetch: 检索时多取 limit × overfetch 条候选，重排后返回前 limit 条
         """
         # 1. 初始化 OpenAI 客户端
         print(f"🔄 使用 OpenAI 模型: {embedding_model}, {base_url} ,{api_key}")
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.embedding_model = embedding_model
+        self.embedding_dimensions = embedding_dimensions
         self.collection_name = collection_name
-        # 2.初始化向量数据库
-        self.milvus_vector_db_client = MilvusClient(
-            uri=os.getenv("VECTOR_DB_URL"),
-            token=os.getenv("VECTOR_DB_TOKEN")
-        )
+        # 2.初始化向量存储
+        self.vector_store = vector_store or self._create_vector_store(vector_store_type, collection_name,
+                                                                      embedding_dimensions)
+        # 3.延迟批量写入队列
+        self.write_behind = write_behind
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+        self.embedding_batch_size = embedding_batch_size
+        self._pending: List[MemoryItem] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.flush_max_retries = max(0, flush_max_retries)
+        self.dead_letter_path = dead_letter_path
+        self._flush_failures = 0
+        # 4.近似去重
+        self.dedup_threshold = dedup_threshold
+        # 5.检索缓存（按用户分代失效）
+        self.search_cache = MemorySearchCache(max_results=search_cache_size) if search_cache_size > 0 else None
+        # 6.稀疏检索索引（混合检索）
+        self.hybrid_search = hybrid_search
+        self.rrf_k = rrf_k
+        self.sparse_index = SparseMemoryIndex() if hybrid_search else None
+        # 7.上次离线合并后有写入的用户（MemoryConsolidator 定时任务只处理这些用户）
+        self._touched_users: Set[str] = set()
+        # 8.相关度 / 时效 / 重要度加权重排
+        self.ranking_weights = np.asarray(ranking_weights, dtype=np.float64)
+        self.recency_half_life_days = recency_half_life_days
+        self.overfetch = max(1, overfetch)
 
+    @staticmethod
+    def _create_vector_store(vector_store_type: str, collection_name: str, dimension: int) -> VectorStoreAbstract:
+        """按类型创建向量存储"""
+        if vector_store_type == "milvus":
+            from mcp_server.common.long_memory_mcp.vector_store.MilvusVectorStore import MilvusVectorStore
+            return MilvusVectorStore(collection_name=collection_name, dimension=dimension)
+        if vector_store_type in ("local", "local_int8", "local_binary"):
+            from mcp_server.common.long_memory_mcp.vector_store.LocalNumpyVectorStore import LocalNumpyVectorStore
+            root_dir = os.getenv("LOCAL_VECTOR_STORE_DIR", "local_vector_store")
+            # 默认集合沿用根目录（兼容已有段文件），其他集合使用同名子目录
+            if collection_name != "long_memory":
+                root_dir = os.path.join(root_dir, collection_name)
+            return LocalNumpyVectorStore(root_dir=root_dir, quantize=vector_store_type.partition("_")[2] or None)
+        raise ValueError(f"不支持的向量存储类型: {vector_store_type}")
 
-    async def get_embedding(self, text: str, dimensions: Optional[int] = 1536) -> List[float]:
+    async def get_embedding(self, text: str, dimensions: Optional[int] = None) -> List[float]:
         """
         获取文本的向量嵌入
         Args:
             text: 输入文本
-            dimensions: 向量纬度
+            dimensions: 向量纬度，默认 embedding_dimensions
         Returns:
             向量列表
         """
-        response = self.client.embeddings.create(
+        dimensions = dimensions or self.embedding_dimensions
+        if self.search_cache is not None:
+            cached = self.search_cache.get_embedding(text, dimensions)
+            if cached is not None:
+                return cached
+
+        response = await asyncio.to_thread(
+            self.client.embeddings.create,
             model=self.embedding_model,
             input=text,
             dimensions=dimensions,
             encoding_format="float"
         )
 
-        return response.data[0].embedding
+        vector = response.data[0].embedding
+        if self.search_cache is not None:
+            self.search_cache.put_embedding(text, dimensions, vector)
+        return vector
+
+    async def get_embeddings(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        """
+        批量获取文本的向量嵌入，按 embedding_batch_size 分批请求
+        Args:
+            texts: 输入文本列表
+            dimensions: 向量纬度，默认 embedding_dimensions
+        Returns:
+            与 texts 顺序一致的向量列表
+        """
+        dimensions = dimensions or self.embedding_dimensions
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.embedding_batch_size):
+            response = await asyncio.to_thread(
+                self.client.embeddings.create,
+                model=self.embedding_model,
+                input=texts[start:start + self.embedding_batch_size],
+                dimensions=dimensions,
+                encoding_format="float"
+            )
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        return vectors
+
+    async def _bulk_insert(self, items: List[MemoryItem]) -> Tuple[List[dict], List[dict]]:
+        """
+        批量向量化，经相似度门控后一次 insert 新记忆、一次 upsert 被替换的记忆，写入后通知等待结果的调用方
+        :param items: [(user_id, content, importance, future), ...]
+        :return: (新增的行, 替换的行)
+        """
+        # 1. 一次批量向量化
+        vectors = await self.get_embeddings([content for _, content, _, _ in items])
+        # 2. 构建存储结构
+        now_ms = int(time.time() * 1000)
+        rows = [
+            {
+                "primary_key": memory_id_generator.generate(),
+                "user_id": user_id,
+                "content": content,
+                "vector": vector,
+                "importance": importance,
+                "updated_at": now_ms
+            }
+            for (user_id, content, importance, _), vector in zip(items, vectors)
+        ]
+        # 3. 相似度门控：与已有记忆近似重复的改为替换
+        inserted, updated, superseded = await self._split_upserts(rows) if self.dedup_threshold is not None \
+            else (rows, [], {})
+        # 4. 一次 insert / upsert 写入
+        if inserted:
+            await self.vector_store.insert(inserted)
+        if updated:
+            await self.vector_store.upsert(updated)
+        self._invalidate(*{row["user_id"] for row in inserted + updated})
+        self.touch_users(*{row["user_id"] for row in inserted + updated})
+        if self.sparse_index is not None:
+            self.sparse_index.add(inserted + updated)
+        print(f"✅ 向量批量存储成功: 新增 {len(inserted)} 条, 替换 {len(updated)} 条")
+        # 5. 通知等待结果的调用方（批内被后续记忆取代的，结果为取代它的那条）
+        inserted_rows = {id(row) for row in inserted}
+        for i, (_, _, _, future) in enumerate(items):
+            if future is not None and not future.done():
+                row = rows[superseded.get(i, i)]
+                future.set_result({"id": row["primary_key"],
+                                   "action": "insert" if id(row) in inserted_rows and i not in superseded else "update"})
+        return inserted, updated
+
+    async def _split_upserts(self, rows: List[dict]) -> Tuple[List[dict], List[dict], Dict[int, int]]:
+        """
+        近似重复判定
+        1. 批内：同一用户的多条近似重复只保留最后一条（后出现的视为更新后的事实）
+        2. 库内：每条并发做一次限定该用户的 top-1 检索，相似度不低于阈值时沿用已有主键替换，重要度取两者较大值；
+           批内多条命中同一条已有记忆时合并为最后一条，重要度取其中最大值
+        :param rows: 待写入的行
+        :return: (新增的行, 替换的行, 批内被取代的行下标 → 取代它的行下标)
+        """
+        kept: List[int] = []
+        superseded: Dict[int, int] = {}
+        for user_id in dict.fromkeys(row["user_id"] for row in rows):
+            indices = [i for i, row in enumerate(rows) if row["user_id"] == user_id]
+            matrix = np.asarray([rows[i]["vector"] for i in indices], dtype=np.float32)
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            duplicate = np.triu(matrix @ matrix.T, k=1) >= self.dedup_threshold
+            # 从后往前处理，被取代的行指向最终保留的那一行
+            for local in reversed(range(len(indices))):
+                later = np.flatnonzero(duplicate[local])
+                if len(later):
+                    target = indices[later[0]]
+                    superseded[indices[local]] = superseded.get(target, target)
+            kept.extend(i for i in indices if i not in superseded)
+
+        top_hits = await asyncio.gather(*(
+            self.vector_store.search(user_id=rows[i]["user_id"], vector=rows[i]["vector"], limit=1,
+                                     output_fields=["user_id", "importance"])
+            for i in kept
+        ))
 
-    async def add_memory(self, user_id: str, content: str):
+        inserted: List[dict] = []
+        updated: Dict[int, int] = {}
+        for i, hits in zip(kept, top_hits):
+            row = rows[i]
+            if hits and hits[0]["distance"] >= self.dedup_threshold:
+                row["primary_key"] = hits[0]["primary_key"]
+                row["importance"] = max(row["importance"], hits[0]["entity"].get("importance") or 0.0)
+                earlier = updated.get(row["primary_key"])
+                if earlier is not None:
+                    # 命中同一条已有记忆：后出现的一条取代先前的，先前那条指向它
+                    row["importance"] = max(row["importance"], rows[earlier]["importance"])
+                    for index, target in superseded.items():
+                        if target == earlier:
+                            superseded[index] = i
+                    superseded[earlier] = i
+                updated[row["primary_key"]] = i
+            else:
+                inserted.append(row)
+        return inserted, [rows[i] for i in updated.values()], superseded
+
+    @staticmethod
+    def _clamp_importance(importance: Optional[float]) -> float:
+        return DEFAULT_IMPORTANCE if importance is None else min(max(float(importance), 0.0), 1.0)
+
+    async def add_memory(self, user_id: str, content: str, importance: Optional[float] = None):
         """
-        添加向量文本
+        添加向量文本，开启 write_behind 时只入队，由 flush 批量写入
+        与已有记忆近似重复时替换已有记忆
         :param user_id:
         :param content:
+        :param importance: 重要度 0~1，默认 DEFAULT_IMPORTANCE
         :return:
         """
-        # 1. 文本转向量
-        vector = await self.get_embedding(content)
-        # 2. 构建存储结构
-        memory_id = int(time.time() * 1000000) % 9223372036854775807
-        data = {
-            "primary_key": memory_id,
-            "user_id": user_id,
-            "content": content,
-            "vector": vector
-        }
-        # 3. 存储向量
-        result = self.milvus_vector_db_client.insert(
-            collection_name=self.collection_name,
-            data=[data]
-        )
+        if self.write_behind:
+            # 入队后等待批量写入完成，返回与直接写入相同的结构；不需要等待时使用 enqueue_memory
+            future = asyncio.get_running_loop().create_future()
+            await self._enqueue((user_id, content, self._clamp_importance(importance), future))
+            try:
+                data = await future
+            except Exception as e:
+                return Result(code=500, message=f"记忆写入失败: {str(e)}", data=None)
+            if data["action"] == "update":
+                return Result(code=200, message="已替换近似重复的记忆", data=data)
+            return Result(code=200, data=data)
+
+        inserted, updated = await self._write_in_order([(user_id, content, self._clamp_importance(importance), None)])
+        if updated:
+            return Result(code=200, message="已替换近似重复的记忆", data={"id": updated[0]["primary_key"], "action": "update"})
+        return Result(code=200, data={"id": inserted[0]["primary_key"], "action": "insert"})
+
+    async def add_memories(self, user_id: str, contents: List[str], importances: Optional[List[float]] = None):
+        """
+        批量添加向量文本：一次向量化请求 + 一次 insert（近似重复的记忆一次 upsert 替换）
+        队列中还有更早的记忆时先写入队列，保证按写入顺序落库
+        :param user_id: 用户ID
+        :param contents: 记忆文本列表
+        :param importances: 与 contents 一一对应的重要度 0~1，为空时使用默认值
+        :return: 新增与替换的主键列表
+        """
+        importances = importances or [None] * len(contents)
+        items = [
+            (user_id, content, self._clamp_importance(importance), None)
+            for content, importance in zip(contents, importances) if content and content.strip()
+        ]
+        if not items:
+            return Result(code=400, message="contents 不能为空", data=None)
+        try:
+            inserted, updated = await self._write_in_order(items)
+            return Result(
+                code=200,
+                message=f"批量写入成功，新增{len(inserted)}条，替换{len(updated)}条",
+                data={
+                    "inserted": [row["primary_key"] for row in inserted],
+                    "updated": [row["primary_key"] for row in updated]
+                }
+            )
+        except Exception as e:
+            print(f"批量写入失败: {str(e)}")
+            return Result(code=500, message=f"批量写入失败: {str(e)}", data=None)
+
+    async def dedup_memories(self, user_id: str, threshold: Optional[float] = None):
+        """
+        对用户已有记忆做一次批量去重：一次矩阵乘法得到两两相似度，
+        按最近一次写入时间从新到旧保留，与已保留记忆近似重复的旧记忆批量删除
+        :param user_id: 用户ID
+        :param threshold: 相似度阈值，默认使用 dedup_threshold
+        :return: 删除的主键列表
+        """
+        if threshold is None:
+            threshold = 0.92 if self.dedup_threshold is None else self.dedup_threshold
+        rows = await self.vector_store.query(user_id=user_id,
+                                             output_fields=["primary_key", "content", "vector", "updated_at"])
+        if len(rows) < 2:
+            return Result(code=200, message="无需去重", data=[])
+
+        rows.sort(key=updated_at_ms, reverse=True)
+        matrix = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        similarity = matrix @ matrix.T
+
+        removed = np.zeros(len(rows), dtype=bool)
+        for i in range(len(rows)):
+            if removed[i]:
+                continue
+            # 比 i 更旧且与 i 近似重复的记忆标记删除
+            duplicates = similarity[i, i + 1:] >= threshold
+            removed[i + 1:] |= duplicates
 
-        # 4. 输出result
-        print(f"✅ 向量存储成功: {result}")
-        return Result(code=200, data=result)
+        removed_ids = [row["primary_key"] for row, drop in zip(rows, removed) if drop]
+        if removed_ids:
+            await self.vector_store.delete(removed_ids)
+            self._invalidate(user_id)
+            if self.sparse_index is not None:
+                self.sparse_index.remove(removed_ids)
+        print(f"🧹 用户 {user_id} 去重完成: 共 {len(rows)} 条, 删除 {len(removed_ids)} 条")
+        return Result(code=200, message=f"去重完成，删除{len(removed_ids)}条", data=removed_ids)
+
+    async def enqueue_memory(self, user_id: str, content: str, importance: Optional[float] = None):
+        """
+        记忆入队后立即返回（不等待写入结果），达到 flush_batch_size 立即 flush，否则最多等待 flush_interval 秒
+        :param user_id:
+        :param content:
+        :param importance: 重要度 0~1
+        :return: data 为队列中待写入的条数
+        """
+        await self._enqueue((user_id, content, self._clamp_importance(importance), None))
+        return Result(code=200, message="记忆已加入写入队列", data={"queued": len(self._pending)})
+
+    async def _enqueue(self, item: MemoryItem):
+        self._pending.append(item)
+        if len(self._pending) >= self.flush_batch_size:
+            await self.flush()
+        else:
+            self._schedule_flush(self.flush_interval)
+
+    def _schedule_flush(self, delay: float):
+        """delay 秒后自动 flush（已有定时任务时不重复创建）"""
+        if self._flush_task is None or self._flush_task.done() or self._flush_task is asyncio.current_task():
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: Optional[float] = None):
+        """延迟 delay 秒（默认 flush_interval）后 flush"""
+        await asyncio.sleep(self.flush_interval if delay is None else delay)
+        await self.flush()
+
+    async def flush(self):
+        """
+        将队列中的记忆一次性向量化并批量写入，服务关闭时需显式调用
+        :return: 写入条数
+        """
+        async with self._flush_lock:
+            return await self._flush_pending()
+
+    async def _flush_pending(self) -> Result:
+        """flush 的实际实现，调用方需持有 _flush_lock"""
+        if not self._pending:
+            return Result(code=200, message="队列为空", data=0)
+        batch, self._pending = self._pending, []
+        try:
+            inserted, updated = await self._bulk_insert(batch)
+        except Exception as e:
+            self._flush_failures += 1
+            if self._flush_failures > self.flush_max_retries:
+                # 重试耗尽：逐条写入隔离出失败的记忆，其余照常落库
+                self._flush_failures = 0
+                written = await self._write_one_by_one(batch)
+                return Result(code=500, message=f"批量写入失败，逐条写入成功{written}条，其余已写入死信: {str(e)}",
+                              data=written)
+            # 写入失败放回队列，按指数退避（带随机抖动）重新定时 flush
+            self._pending = batch + self._pending
+            delay = min(self.flush_interval * 2 ** self._flush_failures, 60.0) * random.uniform(0.5, 1.0)
+            self._schedule_flush(delay)
+            print(f"批量写入失败（第 {self._flush_failures} 次），{delay:.1f}s 后重试: {str(e)}")
+            return Result(code=500, message=f"批量写入失败: {str(e)}", data=0)
+        self._flush_failures = 0
+        return Result(code=200, message=f"批量写入成功，新增{len(inserted)}条，替换{len(updated)}条",
+                      data=len(inserted) + len(updated))
+
+    async def _write_one_by_one(self, batch: List[MemoryItem]) -> int:
+        """按顺序逐条写入，失败的记忆写入死信，返回成功条数"""
+        written = 0
+        for item in batch:
+            try:
+                await self._bulk_insert([item])
+                written += 1
+            except Exception as e:
+                self._dead_letter(item, e)
+        return written
+
+    def _dead_letter(self, item: MemoryItem, error: Exception):
+        """记录无法写入的记忆，并通知等待结果的调用方"""
+        user_id, content, importance, future = item
+        if future is not None and not future.done():
+            future.set_exception(error)
+        print(f"记忆写入死信: user_id={user_id}, content={content[:100]}, error={str(error)}")
+        if not self.dead_letter_path:
+            return
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"user_id": user_id, "content": content, "importance": importance,
+                                    "error": str(error), "time": time.time()}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"死信写入失败: {str(e)}")
+
+    async def _write_in_order(self, items: List[MemoryItem]) -> Tuple[List[dict], List[dict]]:
+        """
+        直接写入（不经队列）前先写入队列中更早的记忆，避免旧记忆晚落库后经去重覆盖新记忆
+        队列写入失败时本次写入也失败，由调用方重试
+        """
+        async with self._flush_lock:
+            if self._pending:
+                await self._flush_pending()
+                if self._pending:
+                    raise RuntimeError("队列中更早的记忆尚未写入，请稍后重试")
+            return await self._bulk_insert(items)
 
     async def search_memories(self, user_id: str, query: str, limit: int = 5):
         """
@@ -100,74 +498,176 @@ class OpenAIMemorySystem:
                记忆列表
         """
 
-        # 1，向量化
-        query_vector = await self.get_embedding(query)
+        # 0. 该用户还有未落库的记忆时先 flush，保证读到自己的写入
+        if any(pending_user_id == user_id for pending_user_id, _, _, _ in self._pending):
+            await self.flush()
 
+        # 1-2. 向量化与检索：多取 limit × overfetch 条候选，稠密检索与稀疏检索并发执行，混合检索时做 RRF 融合
+        candidate_limit = max(limit * self.overfetch, 10)
+        if self.sparse_index is not None:
+            dense_hits, sparse_hits = await asyncio.gather(
+                self._dense_search(user_id, query, candidate_limit),
+                self._sparse_search(user_id, query, candidate_limit)
+            )
+            hits = self._rrf_fuse(dense_hits, sparse_hits, candidate_limit)
+        else:
+            hits = await self._dense_search(user_id, query, candidate_limit)
+        # 2.5 相关度 / 时效 / 重要度加权重排，取前 limit 条
+        hits = self._rank(hits, limit)
 
-        # 2. 搜索
-        results = self.milvus_vector_db_client.search(
-            collection_name=self.collection_name,
-            data=[query_vector],
-            filter=f'user_id == "{user_id}"',  # 只搜索该用户的记忆
-            limit=limit,
-            output_fields=["user_id", "content"]  # 返回这些字段
-        )
-        print(f"未经过过滤的搜索结果: {results}")
+        print(f"未经过过滤的搜索结果: {hits}")
         # 3. 过滤相似度 >= 0.8 的结果
         # 3. 按置信度分级
         high_confidence = []  # 高置信度 >= 0.9
         medium_confidence = []  # 中置信度 0.7 - 0.9
         low_confidence = []  # 低置信度 0.5 - 0.7
         low_related = []  # 低相关度 <= 0.5
-        for hits in results:
-            for hit in hits:
-                similarity = hit['distance']
-
-                memory = {
-                    "id": hit['primary_key'],
-                    "content": hit['entity']['content'],
-                    "similarity": round(similarity, 4),
-                    "user_id": hit['entity']['user_id']
-                }
+        keyword_matched = []  # 关键词命中但语义相似度低于 0.5（或稠密检索未召回）
+        for hit in hits:
+            similarity = hit['distance']
+
+            memory = {
+                "id": hit['primary_key'],
+                "content": hit['entity']['content'],
+                "similarity": round(similarity, 4) if similarity is not None else None,
+                "importance": hit['entity'].get('importance'),
+                "updated_at": hit['entity'].get('updated_at'),
+                "score": hit['score'],
+                "user_id": hit['entity']['user_id']
+            }
 
-                # 分级
-                if similarity >= 0.9:
-                    memory["confidence"] = "high"
-                    high_confidence.append(memory)
-                elif similarity >= 0.7:
-                    memory["confidence"] = "medium"
-                    medium_confidence.append(memory)
-                elif similarity >= 0.5:
-                    memory["confidence"] = "low"
-                    low_confidence.append(memory)
-                else:
-                    memory["confidence"] = "low_related"
-                    low_related.append(memory)
+            # 分级
+            if similarity is None or (hit.get("keyword_matched") and similarity < 0.5):
+                memory["confidence"] = "keyword"
+                keyword_matched.append(memory)
+            elif similarity >= 0.9:
+                memory["confidence"] = "high"
+                high_confidence.append(memory)
+            elif similarity >= 0.7:
+                memory["confidence"] = "medium"
+                medium_confidence.append(memory)
+            elif similarity >= 0.5:
+                memory["confidence"] = "low"
+                low_confidence.append(memory)
+            else:
+                memory["confidence"] = "low_related"
+                low_related.append(memory)
 
         result = {
             "high": high_confidence,
             "medium": medium_confidence,
             "low": low_confidence,
             "low_related": low_related,
-            "total": len(high_confidence) + len(medium_confidence) + len(low_confidence)
+            "keyword": keyword_matched,
+            "total": len(high_confidence) + len(medium_confidence) + len(low_confidence) + len(keyword_matched)
         }
-        print(f"🔍 找到记忆: 高={len(high_confidence)}, 中={len(medium_confidence)}, 低={len(low_confidence)}")
+        print(f"🔍 找到记忆: 高={len(high_confidence)}, 中={len(medium_confidence)}, 低={len(low_confidence)}, "
+              f"关键词={len(keyword_matched)}")
         return Result(data=result)
 
-    async def delete_memory(self, memory_id: int):
+    async def _dense_search(self, user_id: str, query: str, limit: int) -> List[dict]:
+        """稠密向量检索（用户无写入时直接命中缓存）"""
+        query_vector = await self.get_embedding(query)
+        generation = self.search_cache.generation(user_id) if self.search_cache is not None else 0
+        hits = self.search_cache.get(user_id, generation, query_vector, limit) if self.search_cache is not None else None
+        if hits is None:
+            hits = await self.vector_store.search(
+                user_id=user_id,  # 只搜索该用户的记忆
+                vector=query_vector,
+                limit=limit,
+                output_fields=["user_id", "content", "importance", "updated_at"]  # 返回这些字段
+            )
+            if self.search_cache is not None:
+                self.search_cache.put(user_id, generation, query_vector, limit, hits)
+        return hits
+
+    async def _sparse_search(self, user_id: str, query: str, limit: int) -> List[dict]:
+        """BM25 稀疏检索，进程内首次检索该用户时从向量库加载其全部记忆"""
+        if not self.sparse_index.is_loaded(user_id):
+            rows = await self.vector_store.query(user_id=user_id,
+                                                 output_fields=["primary_key", "content", "importance", "updated_at"])
+            self.sparse_index.load(user_id, rows)
+        return await asyncio.to_thread(self.sparse_index.search, user_id, query, limit)
+
+    def _rrf_fuse(self, dense_hits: List[dict], sparse_hits: List[dict], limit: int) -> List[dict]:
+        """
+        RRF 融合：score = Σ 1 / (rrf_k + rank)
+        融合后 distance 保留稠密检索的余弦相似度，仅稀疏命中的记忆 distance 为 None，keyword_matched 标记是否被稀疏检索命中
+        """
+        scores: Dict[int, float] = {}
+        fused: Dict[int, dict] = {}
+        for hits, source in ((dense_hits, "dense"), (sparse_hits, "sparse")):
+            for rank, hit in enumerate(hits, start=1):
+                key = hit["primary_key"]
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank)
+                if key not in fused:
+                    fused[key] = {**hit, "distance": hit["distance"] if source == "dense" else None}
+                if source == "sparse":
+                    fused[key]["keyword_matched"] = True
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [{**fused[key], "rrf_score": round(scores[key], 6)} for key in ranked]
+
+    def _rank(self, hits: List[dict], limit: int) -> List[dict]:
+        """
+        对候选集向量化打分：score = w1 × 相关度 + w2 × 时效 + w3 × 重要度，按 score 取前 limit 条
+        - 相关度：混合检索时为 RRF 分数 / 最高可能的 RRF 分数（同时反映稠密与关键词命中），否则为余弦相似度
+        - 时效：0.5 ^ (记忆年龄 / 半衰期)，记忆年龄按最近一次写入时间（updated_at，见 updated_at_ms）计算
+        - 重要度：写入时给出的 0~1 标量，缺失时按 DEFAULT_IMPORTANCE
+        """
+        if not hits:
+            return hits
+        if all("rrf_score" in hit for hit in hits):
+            # 除以可能的最高 RRF 分数（稠密与稀疏两路均排第一），而不是本批最大值：
+            # 否则无论候选多不相关，排第一的都得到满分相关度
+            relevance = np.asarray([hit["rrf_score"] for hit in hits], dtype=np.float64)
+            relevance /= 2.0 / (self.rrf_k + 1)
+        else:
+            relevance = np.asarray([hit["distance"] or 0.0 for hit in hits], dtype=np.float64)
+        updated_ms = np.asarray([updated_at_ms({**hit["entity"], "primary_key": hit["primary_key"]}) for hit in hits],
+                                dtype=np.int64)
+        age_days = np.maximum(time.time() * 1000 - updated_ms, 0) / 86_400_000
+        recency = np.exp2(-age_days / self.recency_half_life_days)
+        importance = np.asarray([
+            DEFAULT_IMPORTANCE if hit["entity"].get("importance") is None else hit["entity"]["importance"]
+            for hit in hits
+        ], dtype=np.float64)
+
+        scores = self.ranking_weights @ np.vstack([relevance, recency, importance])
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [{**hits[i], "score": round(float(scores[i]), 4)} for i in order]
+
+    def touch_users(self, *user_ids: str):
+        """标记用户有新写入，等待下一次离线合并"""
+        self._touched_users.update(user_ids)
+
+    def pop_touched_users(self) -> List[str]:
+        """取出并清空待合并的用户"""
+        user_ids, self._touched_users = list(self._touched_users), set()
+        return user_ids
+
+    def _invalidate(self, *user_ids: Optional[str]):
+        """用户记忆发生写入后使其检索缓存失效，user_id 为 None 时清空全部检索缓存"""
+        if self.search_cache is None:
+            return
+        for user_id in user_ids:
+            self.search_cache.invalidate(user_id)
+
+    async def delete_memory(self, memory_id: int, user_id: Optional[str] = None):
         """
         根据 primary_key 删除记忆
         Args:
             memory_id: 记忆的 primary_key
+            user_id: 记忆所属用户，传入时只失效该用户的检索缓存，否则清空全部检索缓存
         Returns:
             删除结果
         """
         try:
             # 删除
-            self.milvus_vector_db_client.delete(
-                collection_name=self.collection_name,
-                filter=f"primary_key == {memory_id}"
-            )
+            await self.vector_store.delete([memory_id])
+            self._invalidate(user_id)
+            if self.sparse_index is not None:
+                self.sparse_index.remove([memory_id])
 
             print(f"🗑记忆已删除: {memory_id}")
             return Result(code=200, message=f"删除{memory_id}记忆成功", data=True)
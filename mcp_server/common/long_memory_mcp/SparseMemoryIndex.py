@@ -0,0 +1,220 @@
+"""
+# 记忆稀疏检索索引（BM25）
+# 原理: 每个用户一份进程内倒排表（词 → 文档词频），写入记忆时增量更新，首次检索某用户时从向量库加载其全部记忆；
+#      检索只为包含查询词的文档打分；用户索引按最近最少使用淘汰（MEMORY_SPARSE_MAX_USERS / MEMORY_SPARSE_MAX_DOCS），
+#      被淘汰的用户下次检索时重新加载
+# 分词: 邮箱、电话/数字串、英文单词（保留 c++ / c# / node.js 这类写法）整体成词，
+#      中日韩文字切为单字 + 相邻双字，无需额外分词依赖
+# 用途: 与稠密向量检索并行执行后做 RRF 融合，补足稠密检索对邮箱、电话、产品名等精确词的召回
+"""
+
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"  # 日文假名、中日韩统一表意文字、韩文
+TOKEN_PATTERN = re.compile(
+    r"(?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)"  # 邮箱
+    r"|(?P<phone>\+?\d[\d\s-]{5,}\d)"  # 电话/长数字串
+    r"|(?P<word>[a-z0-9]+(?:[._-][a-z0-9]+)*[+#]*)"  # 英文单词、版本号、c++ / c#
+    rf"|(?P<cjk>[{CJK_CHARS}]+)"  # 中日韩文字串
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """CJK 感知分词"""
+    tokens: List[str] = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if match.lastgroup == "cjk":
+            tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        elif match.lastgroup == "phone":
+            # 去掉分隔符，"138-0000 0000" 与 "13800000000" 视为同一个词
+            tokens.append(re.sub(r"[\s-]", "", token))
+        else:
+            tokens.append(token)
+    return tokens
+
+
+# 随记忆保存、检索时原样返回的标量字段
+ENTITY_FIELDS = ("importance", "updated_at")
+
+
+def _entity_fields(row: dict) -> dict:
+    return {field: row.get(field) for field in ENTITY_FIELDS}
+
+
+class _UserBM25:
+    """单个用户的 BM25 统计（倒排表：词 → {文档: 词频}）"""
+
+    def __init__(self):
+        self.docs: Dict[int, Tuple[str, ...]] = {}
+        self.contents: Dict[int, str] = {}
+        # 检索结果返回的标量字段（importance / updated_at）
+        self.fields: Dict[int, dict] = {}
+        self.lengths: Dict[int, int] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.total_length = 0
+
+    def add(self, doc_id: int, content: str, fields: dict):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        terms = Counter(tokenize(content))
+        self.docs[doc_id] = tuple(terms)
+        self.contents[doc_id] = content
+        self.fields[doc_id] = fields
+        self.lengths[doc_id] = sum(terms.values())
+        self.total_length += self.lengths[doc_id]
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: int):
+        terms = self.docs.pop(doc_id, None)
+        if terms is None:
+            return
+        self.contents.pop(doc_id)
+        self.fields.pop(doc_id)
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in terms:
+            posting = self.postings[term]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query_terms: List[str], limit: int, k1: float, b: float) -> List[Tuple[int, float]]:
+        if not self.docs or not query_terms:
+            return []
+        doc_count = len(self.docs)
+        avg_length = self.total_length / doc_count or 1.0
+        # 只遍历包含查询词的文档
+        scores: Dict[int, float] = {}
+        for term, count in Counter(query_terms).items():
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            weight = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5)) * count
+            for doc_id, tf in posting.items():
+                norm = k1 * (1 - b + b * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+class SparseMemoryIndex:
+    """按用户划分的 BM25 稀疏索引，线程安全（检索在工作线程中执行，写入在事件循环中执行）"""
+
+    def __init__(
+            self,
+            k1: float = 1.5,
+            b: float = 0.75,
+            max_users: int = int(os.getenv("MEMORY_SPARSE_MAX_USERS", "1024")),
+            max_docs: int = int(os.getenv("MEMORY_SPARSE_MAX_DOCS", "500000")),
+    ):
+        """
+        初始化稀疏索引
+        Args:
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+            max_users: 最多保留的用户索引数，超出时按最近最少使用淘汰
+            max_docs: 全部用户索引的记忆总条数上限，超出时按最近最少使用淘汰
+        """
+        self.k1 = k1
+        self.b = b
+        self.max_users = max(1, max_users)
+        self.max_docs = max(1, max_docs)
+        # 用户 → 索引，按最近使用排序（末尾为最近使用）
+        self._users: "OrderedDict[str, _UserBM25]" = OrderedDict()
+        self._owner: Dict[int, str] = {}
+        self._loaded: Set[str] = set()
+        self._doc_count = 0
+        self._lock = threading.Lock()
+
+    def is_loaded(self, user_id: str) -> bool:
+        return user_id in self._loaded
+
+    def _index(self, user_id: str) -> _UserBM25:
+        """取用户索引（不存在时创建）并标记为最近使用，调用方持有锁"""
+        index = self._users.get(user_id)
+        if index is None:
+            index = self._users[user_id] = _UserBM25()
+        self._users.move_to_end(user_id)
+        return index
+
+    def _add_doc(self, index: _UserBM25, user_id: str, row: dict):
+        self._doc_count -= len(index.docs)
+        index.add(row["primary_key"], row["content"], _entity_fields(row))
+        self._doc_count += len(index.docs)
+        self._owner[row["primary_key"]] = user_id
+
+    def _evict(self):
+        """淘汰最近最少使用的用户索引，最近使用的用户始终保留；被淘汰的用户下次检索时重新加载"""
+        while len(self._users) > 1 and (len(self._users) > self.max_users or self._doc_count > self.max_docs):
+            user_id, index = self._users.popitem(last=False)
+            for doc_id in index.docs:
+                self._owner.pop(doc_id, None)
+            self._doc_count -= len(index.docs)
+            self._loaded.discard(user_id)
+
+    def load(self, user_id: str, rows: List[dict]):
+        """
+        加载用户的全部记忆，只补充索引中不存在的记忆，不覆盖加载期间增量写入的数据
+        :param rows: [{"primary_key": int, "content": str, "importance": float, "updated_at": int}, ...]
+        """
+        with self._lock:
+            index = self._index(user_id)
+            for row in rows:
+                if row["primary_key"] not in index.docs:
+                    self._add_doc(index, user_id, row)
+            self._loaded.add(user_id)
+            self._evict()
+
+    def add(self, rows: List[dict]):
+        """
+        增量写入（主键已存在时替换）
+        :param rows: [{"primary_key": int, "user_id": str, "content": str, "importance": float, "updated_at": int}, ...]
+        """
+        with self._lock:
+            for row in rows:
+                self._add_doc(self._index(row["user_id"]), row["user_id"], row)
+            self._evict()
+
+    def remove(self, ids: List[int]):
+        with self._lock:
+            for doc_id in ids:
+                user_id = self._owner.pop(doc_id, None)
+                if user_id is not None:
+                    index = self._users[user_id]
+                    self._doc_count -= len(index.docs)
+                    index.remove(doc_id)
+                    self._doc_count += len(index.docs)
+
+    def search(self, user_id: str, query: str, limit: int = 10) -> List[dict]:
+        """
+        BM25 检索，命中结构与向量库一致（distance 字段为 BM25 分数）
+        :param user_id: 用户ID
+        :param query: 查询文本
+        :param limit: 返回数量
+        """
+        query_terms = tokenize(query)
+        with self._lock:
+            index: Optional[_UserBM25] = self._users.get(user_id)
+            if index is None:
+                return []
+            self._users.move_to_end(user_id)
+            scored = index.search(query_terms, limit, self.k1, self.b)
+            return [
+                {
+                    "primary_key": doc_id,
+                    "distance": score,
+                    "entity": {"user_id": user_id, "content": index.contents[doc_id], **index.fields[doc_id]}
+                }
+                for doc_id, score in scored
+            ]
@@ -0,0 +1,102 @@
+"""
+# 记忆检索分区基准测试
+# 场景: 每个用户的记忆条数固定，用户总数逐步增加（总行数随之增长），观察按用户检索的延迟变化
+# 对比: Milvus 分区键集合 / Milvus 平铺集合（仅标量过滤）/ 本地 NumPy 存储（基线）
+# 预期: 分区键集合与本地存储的延迟基本不随总行数增长，平铺集合随总行数增长
+# 运行: python -m mcp_server.common.long_memory_mcp.benchmark.PartitionBenchmark
+#      Milvus 地址读取环境变量 VECTOR_DB_URL / VECTOR_DB_TOKEN
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import MilvusClient
+
+from mcp_server.common.long_memory_mcp.vector_store.LocalNumpyVectorStore import LocalNumpyVectorStore
+from mcp_server.common.long_memory_mcp.vector_store.MilvusVectorStore import MilvusVectorStore
+from mcp_server.common.long_memory_mcp.vector_store.VectorStoreAbstract import VectorStoreAbstract
+
+load_dotenv()
+
+# 用户总数的递增档位
+USER_COUNTS = [10, 100, 1000]
+# 每个用户固定的记忆条数
+ROWS_PER_USER = 50
+# 向量维度（取较小值加快写入，不影响趋势）
+DIMENSION = 128
+# 每档检索次数
+QUERIES = 200
+TOP_K = 5
+
+
+def build_stores() -> Dict[str, VectorStoreAbstract]:
+    """创建参与对比的存储，Milvus 集合先删除重建"""
+    uri, token = os.getenv("VECTOR_DB_URL"), os.getenv("VECTOR_DB_TOKEN")
+    client = MilvusClient(uri=uri, token=token)
+    for name in ("bench_memory_partition_key", "bench_memory_flat"):
+        client.drop_collection(name)
+
+    return {
+        "milvus_partition_key": MilvusVectorStore(collection_name="bench_memory_partition_key", uri=uri, token=token,
+                                                  dimension=DIMENSION, partition_key=True),
+        "milvus_flat": MilvusVectorStore(collection_name="bench_memory_flat", uri=uri, token=token,
+                                         dimension=DIMENSION, partition_key=False),
+        "local_numpy": LocalNumpyVectorStore(root_dir=tempfile.mkdtemp(prefix="bench_memory_")),
+    }
+
+
+def build_rows(user_ids: List[str], rng: np.random.Generator, start_key: int) -> List[dict]:
+    vectors = rng.standard_normal((len(user_ids) * ROWS_PER_USER, DIMENSION)).astype(np.float32)
+    rows = []
+    for i, user_id in enumerate(user_id for user_id in user_ids for _ in range(ROWS_PER_USER)):
+        rows.append({
+            "primary_key": start_key + i,
+            "user_id": user_id,
+            "content": f"{user_id} 的第 {i % ROWS_PER_USER} 条记忆",
+            "vector": vectors[i].tolist()
+        })
+    return rows
+
+
+async def measure(store: VectorStoreAbstract, user_ids: List[str], rng: np.random.Generator) -> Dict[str, float]:
+    """随机用户 + 随机查询向量，统计 p50 / p95 延迟（毫秒）"""
+    latencies = []
+    for _ in range(QUERIES):
+        vector = rng.standard_normal(DIMENSION).astype(np.float32).tolist()
+        start = time.perf_counter()
+        await store.search(user_id=random.choice(user_ids), vector=vector, limit=TOP_K)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"p50": float(np.percentile(latencies, 50)), "p95": float(np.percentile(latencies, 95))}
+
+
+async def main():
+    rng = np.random.default_rng(0)
+    stores = build_stores()
+    user_ids: List[str] = []
+
+    print(f"{'users':>8} {'rows':>10} " + " ".join(f"{name:>32}" for name in stores))
+    for user_count in USER_COUNTS:
+        new_user_ids = [f"bench_user_{i}" for i in range(len(user_ids), user_count)]
+        rows = build_rows(new_user_ids, rng, start_key=len(user_ids) * ROWS_PER_USER)
+        user_ids.extend(new_user_ids)
+
+        for store in stores.values():
+            for start in range(0, len(rows), 1000):
+                await store.insert(rows[start:start + 1000])
+            if isinstance(store, MilvusVectorStore):
+                store.client.flush(store.collection_name)
+
+        stats = {name: await measure(store, user_ids, rng) for name, store in stores.items()}
+        print(f"{user_count:>8} {user_count * ROWS_PER_USER:>10} " + " ".join(
+            f"{'p50=%.2fms p95=%.2fms' % (s['p50'], s['p95']):>32}" for s in stats.values()
+        ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+# 记忆检索降维 / 量化基准测试
+# 场景: 合成记忆语料（聚类分布，前若干维方差更大，模拟 text-embedding-3 的 Matryoshka 特性），
+#      以 1536 维 float32 精确检索结果为真值
+# 对比: 维度（截断后重新归一化，与 embeddings 接口的 dimensions 参数等价）× 量化方式（float32 / int8 / binary）× 是否全精度精排
+# 输出: recall@k、平均检索耗时、每条向量检索矩阵占用字节数、全精度旁路段占用字节数
+# 运行: python -m mcp_server.common.long_memory_mcp.benchmark.QuantizationBenchmark
+"""
+
+import asyncio
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from mcp_server.common.long_memory_mcp.vector_store.LocalNumpyVectorStore import LocalNumpyVectorStore
+
+# 语料条数（单个用户）
+CORPUS_SIZE = 20000
+# 原始维度与降维档位
+FULL_DIMENSION = 1536
+DIMENSIONS = [1536, 768, 512, 256]
+# 量化方式与精排候选数
+QUANTIZE_TYPES: List[Optional[str]] = [None, "int8", "binary"]
+RERANK_CANDIDATES = [0, 50, 200]
+# 查询条数与 top-k
+QUERIES = 200
+TOP_K = 10
+USER_ID = "bench_user"
+
+
+def build_corpus(rng: np.random.Generator):
+    """聚类语料 + 在语料点附近扰动得到的查询"""
+    centers = rng.standard_normal((256, FULL_DIMENSION)).astype(np.float32)
+    decay = (1.0 / np.sqrt(1.0 + np.arange(FULL_DIMENSION) / 64.0)).astype(np.float32)
+    corpus = centers[rng.integers(0, len(centers), CORPUS_SIZE)] * 0.6 \
+        + rng.standard_normal((CORPUS_SIZE, FULL_DIMENSION)).astype(np.float32)
+    corpus *= decay
+    queries = corpus[rng.integers(0, CORPUS_SIZE, QUERIES)] \
+        + 0.5 * rng.standard_normal((QUERIES, FULL_DIMENSION)).astype(np.float32) * decay
+    return corpus, queries
+
+
+def truncate(vectors: np.ndarray, dimension: int) -> np.ndarray:
+    truncated = vectors[:, :dimension]
+    return truncated / np.linalg.norm(truncated, axis=1, keepdims=True)
+
+
+async def main():
+    rng = np.random.default_rng(0)
+    corpus, queries = build_corpus(rng)
+
+    # 真值：全维度 float32 精确检索
+    normalized = truncate(corpus, FULL_DIMENSION)
+    truth = [set(np.argsort(-(normalized @ q))[:TOP_K]) for q in truncate(queries, FULL_DIMENSION)]
+
+    print(f"语料 {CORPUS_SIZE} 条，查询 {QUERIES} 次，recall@{TOP_K}（真值为 {FULL_DIMENSION} 维 float32 精确检索）")
+    print(f"{'dim':>6} {'quantize':>9} {'rerank':>7} {'recall':>8} {'latency':>10} {'bytes/vec':>10} {'side bytes/vec':>15}")
+    for dimension in DIMENSIONS:
+        reduced_corpus = truncate(corpus, dimension)
+        reduced_queries = truncate(queries, dimension)
+        for quantize in QUANTIZE_TYPES:
+            store = LocalNumpyVectorStore(root_dir=tempfile.mkdtemp(prefix="bench_quantize_"), quantize=quantize)
+            await store.insert([
+                {"primary_key": i, "user_id": USER_ID, "content": "", "vector": reduced_corpus[i]}
+                for i in range(CORPUS_SIZE)
+            ])
+            search_bytes = store.memory_bytes(USER_ID) / CORPUS_SIZE
+            side_bytes = dimension * 4 if quantize else 0
+
+            for rerank in RERANK_CANDIDATES if quantize else [0]:
+                store.rerank_candidates = rerank
+                store._search(USER_ID, reduced_queries[0], TOP_K, [])  # 预热 mmap
+                hits_found = 0
+                start = time.perf_counter()
+                for query, expected in zip(reduced_queries, truth):
+                    hits = store._search(USER_ID, query, TOP_K, [])
+                    hits_found += len(expected & {hit["primary_key"] for hit in hits})
+                latency = (time.perf_counter() - start) * 1000 / QUERIES
+                print(f"{dimension:>6} {str(quantize):>9} {rerank:>7} {hits_found / (QUERIES * TOP_K):>8.3f} "
+                      f"{latency:>8.2f}ms {search_bytes:>10.0f} {side_bytes:>15}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+from mcp_server.common.long_memory_mcp.vector_store.VectorStoreAbstract import DEFAULT_IMPORTANCE, VectorStoreAbstract
+
+# 各 ANN 索引类型的默认建索引参数与检索参数
+DEFAULT_INDEX_PARAMS = {
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_SQ8": {"nlist": 1024},
+    "HNSW_SQ": {"M": 16, "efConstruction": 200, "sq_type": "SQ8"},
+    "FLAT": {},
+    "AUTOINDEX": {},
+}
+DEFAULT_SEARCH_PARAMS = {
+    "HNSW": {"ef": 64},
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_SQ8": {"nprobe": 16},
+    "HNSW_SQ": {"ef": 64},
+    "FLAT": {},
+    "AUTOINDEX": {},
+}
+
+# 后加入的可空标量字段，旧集合缺少时在线补充：字段名 -> (类型, 默认值)
+OPTIONAL_SCALAR_FIELDS = {
+    "importance": (DataType.FLOAT, DEFAULT_IMPORTANCE),
+    "updated_at": (DataType.INT64, None),
+}
+
+# 用户过滤表达式，user_id 通过 filter_params 传入，避免拼接字符串带来的注入问题
+USER_FILTER = "user_id == {user_id}"
+# 按用户读取全部记忆时每批的行数
+QUERY_BATCH_SIZE = 1000
+
+
+class MilvusVectorStore(VectorStoreAbstract):
+    """基于 Milvus 的记忆向量存储，同步客户端调用放到线程池中执行，避免阻塞事件循环"""
+
+    def __init__(
+            self,
+            collection_name: Optional[str] = "long_memory",
+            uri: Optional[str] = os.getenv("VECTOR_DB_URL"),
+            token: Optional[str] = os.getenv("VECTOR_DB_TOKEN"),
+            dimension: int = int(os.getenv("MEMORY_VECTOR_DIM", "1536")),
+            index_type: str = os.getenv("MEMORY_INDEX_TYPE", "HNSW"),
+            index_params: Optional[dict] = None,
+            search_params: Optional[dict] = None,
+            partition_key: bool = True,
+            num_partitions: int = 64,
+            rerank_candidates: int = int(os.getenv("MEMORY_RERANK_CANDIDATES", "0")),
+    ):
+        """
+        初始化 Milvus 向量存储，集合不存在时按配置创建
+        Args:
+            collection_name: 集合名称
+            uri: Milvus 地址
+            token: Milvus 访问令牌
+            dimension: 向量维度
+            index_type: ANN 索引类型（HNSW / IVF_FLAT / IVF_SQ8 / HNSW_SQ / FLAT / AUTOINDEX），
+                IVF_SQ8 / HNSW_SQ 在量化向量上做首轮检索，配合 rerank_candidates 用原始向量精排
+            index_params: 建索引参数，为空时使用 DEFAULT_INDEX_PARAMS，也可通过环境变量 MEMORY_INDEX_PARAMS(JSON) 配置
+            search_params: 检索参数（HNSW 的 ef / IVF 的 nprobe），为空时使用 DEFAULT_SEARCH_PARAMS，也可通过环境变量 MEMORY_SEARCH_PARAMS(JSON) 配置
+            partition_key: 是否以 user_id 作为分区键，开启后按用户检索只扫描该用户所在分区
+            num_partitions: 分区键模式下的分区数量
+            rerank_candidates: 大于 limit 时首轮多取该数量的候选并返回原始向量，按精确余弦相似度精排后取 limit 条；0 表示不精排
+        """
+        if index_type not in DEFAULT_INDEX_PARAMS:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+
+        self.collection_name = collection_name
+        self.dimension = dimension
+        self.index_type = index_type
+        self.index_params = index_params or json.loads(os.getenv("MEMORY_INDEX_PARAMS", "null")) or DEFAULT_INDEX_PARAMS[index_type]
+        self.search_params = search_params or json.loads(os.getenv("MEMORY_SEARCH_PARAMS", "null")) or DEFAULT_SEARCH_PARAMS[index_type]
+        self.partition_key = partition_key
+        self.num_partitions = num_partitions
+        self.rerank_candidates = rerank_candidates
+        self.client = MilvusClient(uri=uri, token=token)
+        # 在线补充失败的标量字段，读写时跳过
+        self.missing_fields: set = set()
+        self.ensure_collection()
+
+    def ensure_collection(self):
+        """集合不存在时创建：user_id 分区键 + user_id 倒排标量索引 + 向量 ANN 索引"""
+        if self.client.has_collection(self.collection_name):
+            self._ensure_optional_fields()
+            return
+
+        schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False)
+        schema.add_field(field_name="primary_key", datatype=DataType.INT64, is_primary=True)
+        schema.add_field(field_name="user_id", datatype=DataType.VARCHAR, max_length=128,
+                         is_partition_key=self.partition_key)
+        schema.add_field(field_name="content", datatype=DataType.VARCHAR, max_length=8192)
+        schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=self.dimension)
+        for field_name, (data_type, default_value) in OPTIONAL_SCALAR_FIELDS.items():
+            schema.add_field(field_name=field_name, datatype=data_type, nullable=True, default_value=default_value)
+
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(field_name="vector", index_type=self.index_type, metric_type="COSINE",
+                               params=self.index_params)
+        index_params.add_index(field_name="user_id", index_type="INVERTED")
+
+        options = {"num_partitions": self.num_partitions} if self.partition_key else {}
+        self.client.create_collection(
+            collection_name=self.collection_name,
+            schema=schema,
+            index_params=index_params,
+            **options
+        )
+        print(f"✅ 集合 {self.collection_name} 创建成功: 索引={self.index_type}, 分区键={self.partition_key}")
+
+    def _ensure_optional_fields(self):
+        """旧集合缺少 importance / updated_at 字段时在线补充（需 Milvus 2.6+），补充失败时读写都跳过该字段"""
+        fields = {field["name"] for field in self.client.describe_collection(self.collection_name)["fields"]}
+        for field_name, (data_type, default_value) in OPTIONAL_SCALAR_FIELDS.items():
+            if field_name in fields:
+                continue
+            try:
+                self.client.add_collection_field(
+                    collection_name=self.collection_name,
+                    field_name=field_name,
+                    data_type=data_type,
+                    nullable=True,
+                    default_value=default_value
+                )
+                print(f"✅ 集合 {self.collection_name} 已补充 {field_name} 字段")
+            except Exception as e:
+                self.missing_fields.add(field_name)
+                print(f"⚠️ 集合 {self.collection_name} 补充 {field_name} 字段失败，读写时跳过该字段: {str(e)}")
+
+    def _fields(self, output_fields: List[str]) -> List[str]:
+        return [field for field in output_fields if field not in self.missing_fields]
+
+    def _rows(self, rows: List[dict]) -> List[dict]:
+        if not self.missing_fields:
+            return rows
+        return [{k: v for k, v in row.items() if k not in self.missing_fields} for row in rows]
+
+    async def insert(self, rows: List[dict]) -> int:
+        result = await asyncio.to_thread(
+            self.client.insert,
+            collection_name=self.collection_name,
+            data=self._rows(rows)
+        )
+        return result["insert_count"]
+
+    async def upsert(self, rows: List[dict]) -> int:
+        result = await asyncio.to_thread(
+            self.client.upsert,
+            collection_name=self.collection_name,
+            data=self._rows(rows)
+        )
+        return result["upsert_count"]
+
+    async def search(self, user_id: str, vector: List[float], limit: int = 5,
+                     output_fields: Optional[List[str]] = None) -> List[dict]:
+        output_fields = self._fields(output_fields or ["user_id", "content"])
+        rerank = self.rerank_candidates > limit
+        results = await asyncio.to_thread(
+            self.client.search,
+            collection_name=self.collection_name,
+            data=[vector],
+            filter=USER_FILTER,  # 只搜索该用户的记忆
+            filter_params={"user_id": user_id},
+            limit=self.rerank_candidates if rerank else limit,
+            output_fields=output_fields + ["vector"] if rerank else output_fields,
+            search_params={"metric_type": "COSINE", "params": self.search_params}
+        )
+        hits = list(results[0]) if results else []
+        return self._rerank(hits, vector, limit) if rerank else hits
+
+    @staticmethod
+    def _rerank(hits: List[dict], vector: List[float], limit: int) -> List[dict]:
+        """用原始向量按精确余弦相似度精排"""
+        if not hits:
+            return hits
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        candidates = np.asarray([hit["entity"]["vector"] for hit in hits], dtype=np.float32)
+        scores = candidates @ query / np.maximum(np.linalg.norm(candidates, axis=1), 1e-12)
+        reranked = []
+        for index in np.argsort(-scores)[:limit]:
+            hit = hits[index]
+            entity = {k: v for k, v in hit["entity"].items() if k != "vector"}
+            reranked.append({"primary_key": hit["primary_key"], "distance": float(scores[index]), "entity": entity})
+        return reranked
+
+    async def delete(self, ids: List[int]) -> int:
+        result = await asyncio.to_thread(
+            self.client.delete,
+            collection_name=self.collection_name,
+            ids=ids
+        )
+        return result["delete_count"]
+
+    async def query(self, user_id: str, output_fields: Optional[List[str]] = None) -> List[dict]:
+        return await asyncio.to_thread(self._query_all, user_id,
+                                       self._fields(output_fields or ["primary_key", "user_id", "content"]))
+
+    def _query_all(self, user_id: str, output_fields: List[str]) -> List[dict]:
+        """用 query_iterator 按主键分批读取，不受单次查询最多返回 16384 行的限制"""
+        iterator = self.client.query_iterator(
+            collection_name=self.collection_name,
+            batch_size=QUERY_BATCH_SIZE,
+            filter=USER_FILTER,
+            output_fields=output_fields,
+            # query_iterator 不识别 filter_params，模板参数直接以 expr_params 传给底层查询
+            expr_params={"user_id": user_id}
+        )
+        rows = []
+        try:
+            while batch := iterator.next():
+                rows.extend(batch)
+        finally:
+            iterator.close()
+        return rows
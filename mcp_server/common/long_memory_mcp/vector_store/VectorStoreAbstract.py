@@ -0,0 +1,68 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+# 未指定重要度时的默认值（重要度取值 0~1）
+DEFAULT_IMPORTANCE = 0.5
+
+
+class VectorStoreAbstract(ABC):
+    """
+    长期记忆向量存储抽象类
+
+    行结构统一为：{"primary_key": int, "user_id": str, "content": str, "vector": List[float], "importance": float,
+                 "updated_at": int, ...其他标量字段}
+    importance 为写入时给出的重要度标量（0~1），历史数据缺失时按 DEFAULT_IMPORTANCE 处理
+    updated_at 为最近一次写入（插入或替换）的毫秒时间戳，用于检索时的时效分量，历史数据缺失时为 None
+    检索命中结构与 Milvus 保持一致：{"primary_key": int, "distance": float, "entity": {...output_fields}}
+    其中 distance 为余弦相似度，越大越相似
+    """
+
+    @abstractmethod
+    async def insert(self, rows: List[dict]) -> int:
+        """
+        批量插入记忆行
+        :param rows: 记忆行列表
+        :return: 插入条数
+        """
+        pass
+
+    @abstractmethod
+    async def upsert(self, rows: List[dict]) -> int:
+        """
+        按主键插入或替换记忆行
+        :param rows: 记忆行列表
+        :return: 写入条数
+        """
+        pass
+
+    @abstractmethod
+    async def search(self, user_id: str, vector: List[float], limit: int = 5,
+                     output_fields: Optional[List[str]] = None) -> List[dict]:
+        """
+        在指定用户的记忆中做余弦 top-k 检索
+        :param user_id: 用户ID
+        :param vector: 查询向量
+        :param limit: 返回数量
+        :param output_fields: 需要返回的字段
+        :return: 按相似度降序排列的命中列表
+        """
+        pass
+
+    @abstractmethod
+    async def delete(self, ids: List[int]) -> int:
+        """
+        按主键删除记忆
+        :param ids: 主键列表
+        :return: 删除条数
+        """
+        pass
+
+    @abstractmethod
+    async def query(self, user_id: str, output_fields: Optional[List[str]] = None) -> List[dict]:
+        """
+        查询指定用户的全部记忆行
+        :param user_id: 用户ID
+        :param output_fields: 需要返回的字段，包含 "vector" 时返回向量
+        :return: 记忆行列表
+        """
+        pass
@@ -0,0 +1,257 @@
+"""
+# 图片描述缓存（感知哈希）
+# 原理: 对图片计算 64 位 pHash（32×32 灰度图 DCT 低频 8×8 与中位数比较）与 dHash（9×8 灰度图相邻像素比较），
+#      重新压缩、轻微缩放后的同一张图片哈希只差几位；按 (模型, 提示词) 分区，
+#      pHash 汉明距离不超过 max_distance 且 dHash 也不超过 max_distance 时视为同一张图片，直接返回缓存的描述
+# 存储: Redis 中每条描述一个带 TTL 的键；每个分区一个有序集合记录 pHash（分数为过期时间），
+#      进程内按分区维护 BK 树，按汉明距离半径查询候选；记录已加载的最大分数（水位），
+#      定时用 ZRANGEBYSCORE 只加载水位之后其他实例写入的哈希，树中有哈希过期时才整体重建
+# 降级: Redis 不可用或图片无法解码时按未命中处理，不影响图片理解本身
+# 配置: IMAGE_DESCRIPTION_CACHE_ENABLED、IMAGE_DESCRIPTION_CACHE_TTL、IMAGE_DESCRIPTION_CACHE_DISTANCE
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from config.db.redis.RedisClient import AsyncRedisClient
+
+load_dotenv()
+
+KEY_PREFIX = "image_desc"
+# 增量加载时水位向前回退的秒数，容忍实例间的时钟偏差（重复加载的哈希会被 BK 树去重）
+WATERMARK_SKEW = 5.0
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """DCT-II 正交变换矩阵"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT_32 = _dct_matrix(32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def perceptual_hashes(data: bytes) -> Tuple[int, int]:
+    """
+    计算图片的 pHash 与 dHash
+    :param data: 图片内容
+    :return: (phash, dhash)，均为 64 位整数
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        gray = image.convert("L")
+        small = np.asarray(gray.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+        diff = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    low = (DCT_32 @ small @ DCT_32.T)[:8, :8]
+    # 中位数不含直流分量
+    phash = _bits_to_int(low > np.median(low.ravel()[1:]))
+    dhash = _bits_to_int(diff[:, 1:] > diff[:, :-1])
+    return phash, dhash
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """汉明距离 BK 树"""
+
+    def __init__(self):
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """
+        查询半径内的全部值
+        :return: [(距离, 值)]，按距离升序
+        """
+        if self.root is None:
+            return []
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.append((distance, node[0]))
+            # 三角不等式：只有距离在 [d - r, d + r] 内的子树可能包含结果
+            for edge, child in node[1].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return sorted(found)
+
+
+class ImageDescriptionCache:
+    """按感知哈希缓存图片描述"""
+
+    def __init__(
+            self,
+            enabled: bool = os.getenv("IMAGE_DESCRIPTION_CACHE_ENABLED", "true").lower() == "true",
+            ttl_seconds: int = int(os.getenv("IMAGE_DESCRIPTION_CACHE_TTL", str(7 * 24 * 3600))),
+            max_distance: int = int(os.getenv("IMAGE_DESCRIPTION_CACHE_DISTANCE", "6")),
+            refresh_seconds: float = 60.0,
+            timeout: float = 2.0,
+            redis_client: Optional[AsyncRedisClient] = None,
+    ):
+        """
+        初始化图片描述缓存
+        Args:
+            enabled: 是否开启
+            ttl_seconds: 描述缓存时间（秒）
+            max_distance: 视为同一张图片的最大汉明距离（pHash 与 dHash 均需满足）
+            refresh_seconds: BK 树从 Redis 增量加载的间隔（秒）
+            timeout: 单次 Redis 读写超时（秒），超时按未命中处理
+            redis_client: Redis 客户端，为空时使用默认连接
+        """
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.refresh_seconds = refresh_seconds
+        self.timeout = timeout
+        self.redis = redis_client or AsyncRedisClient()
+        # 分区 → {"tree": BK 树, "loaded_at": 上次加载时间, "watermark": 已加载的最大过期时间, "expires_at": 最早过期时间}
+        self._trees: Dict[str, dict] = {}
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    @staticmethod
+    def namespace(prompt: str, model: str) -> str:
+        """(模型, 提示词) 分区"""
+        return hashlib.sha1(f"{model}\n{prompt}".encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    async def hash_image(image_url: str) -> Optional[Tuple[int, int]]:
+        """计算图片哈希，只处理 data URL（预处理后的图片），其他 URL 返回 None"""
+        if not image_url.startswith("data:"):
+            return None
+        try:
+            return await asyncio.to_thread(perceptual_hashes, base64.b64decode(image_url.partition(",")[2]))
+        except Exception as e:
+            print(f"图片哈希计算失败: {str(e)}")
+            return None
+
+    async def _tree(self, namespace: str) -> BKTree:
+        """
+        分区 BK 树，超过 refresh_seconds 时从 Redis 加载：
+        只加载水位之后新写入的哈希；树中有哈希过期时整体重建（BK 树不支持删除）
+        """
+        state = self._trees.get(namespace)
+        now = time.time()
+        if state is not None and now - state["loaded_at"] < self.refresh_seconds:
+            return state["tree"]
+        client = await self.redis.async_client()
+        index_key = f"{KEY_PREFIX}:{namespace}:index"
+        if state is None or state["expires_at"] <= now:
+            await client.zremrangebyscore(index_key, "-inf", now)
+            members = await client.zrangebyscore(index_key, now, "+inf", withscores=True)
+            state = {"tree": BKTree(), "watermark": 0.0, "expires_at": float("inf")}
+        else:
+            members = await client.zrangebyscore(index_key, state["watermark"] - WATERMARK_SKEW, "+inf",
+                                                 withscores=True)
+        for member, score in members:
+            state["tree"].add(int(member, 16))
+            state["watermark"] = max(state["watermark"], score)
+            state["expires_at"] = min(state["expires_at"], score)
+        state["loaded_at"] = now
+        self._trees[namespace] = state
+        return state["tree"]
+
+    async def get_many(self, image_urls: List[str], prompt: str, model: str) \
+            -> Tuple[List[Optional[Tuple[int, int]]], List[Optional[dict]]]:
+        """
+        批量查询
+        :return: (每张图片的哈希, 每张图片命中的缓存 {"detail", "summary"}，未命中为 None)
+        """
+        hashes = list(await asyncio.gather(*(self.hash_image(url) for url in image_urls)))
+        hits: List[Optional[dict]] = [None] * len(image_urls)
+        if not self.enabled or not any(hashes):
+            return hashes, hits
+        namespace = self.namespace(prompt, model)
+        try:
+            tree = await asyncio.wait_for(self._tree(namespace), self.timeout)
+            # 每张图片取 pHash 半径内最近的若干候选，再用 dHash 复核
+            candidates = [
+                [phash for _, phash in tree.search(image_hash[0], self.max_distance)[:4]] if image_hash else []
+                for image_hash in hashes
+            ]
+            keys = [f"{KEY_PREFIX}:{namespace}:{phash:016x}" for group in candidates for phash in group]
+            client = await self.redis.async_client()
+            values = await asyncio.wait_for(client.mget(keys), self.timeout) if keys else []
+            offset = 0
+            for i, (image_hash, group) in enumerate(zip(hashes, candidates)):
+                for value in values[offset:offset + len(group)]:
+                    entry = json.loads(value) if value else None
+                    if entry is not None and hamming(entry["dhash"], image_hash[1]) <= self.max_distance:
+                        hits[i] = entry
+                        break
+                offset += len(group)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"图片描述缓存查询失败: {str(e)}")
+        self.stats["hits"] += sum(hit is not None for hit in hits)
+        self.stats["misses"] += sum(hit is None for hit in hits)
+        return hashes, hits
+
+    async def put_many(self, entries: List[Tuple[Tuple[int, int], str, Optional[str]]], prompt: str, model: str):
+        """
+        批量写入
+        :param entries: [((phash, dhash), 图片描述, 单图摘要)]
+        """
+        if not self.enabled or not entries:
+            return
+        namespace = self.namespace(prompt, model)
+        expire_at = time.time() + self.ttl_seconds
+        try:
+            client = await self.redis.async_client()
+            async with client.pipeline(transaction=False) as pipe:
+                for (phash, dhash), detail, summary in entries:
+                    pipe.set(f"{KEY_PREFIX}:{namespace}:{phash:016x}",
+                             json.dumps({"dhash": dhash, "detail": detail, "summary": summary}, ensure_ascii=False),
+                             ex=self.ttl_seconds)
+                    pipe.zadd(f"{KEY_PREFIX}:{namespace}:index", {f"{phash:016x}": expire_at})
+                await asyncio.wait_for(pipe.execute(), self.timeout)
+            # 本实例写入的哈希直接加入 BK 树，不推进水位（期间其他实例写入的哈希仍需加载）
+            state = self._trees.get(namespace)
+            if state is not None:
+                for (phash, _), _, _ in entries:
+                    state["tree"].add(phash)
+                state["expires_at"] = min(state["expires_at"], expire_at)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"图片描述缓存写入失败: {str(e)}")
+
+
+# 全局实例
+image_description_cache = ImageDescriptionCache()
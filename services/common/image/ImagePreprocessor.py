@@ -0,0 +1,289 @@
+"""
+# 视觉请求前的图片预处理
+# 原理: 并发下载用户图片 → 进程池中用 Pillow 按 EXIF 方向校正、等比缩放到最长边不超过 max_edge、重新编码
+#      （不透明图片 JPEG，带透明通道的图片 WEBP）→ 以 base64 data URL 内联到视觉请求中，
+#      减少模型侧下载耗时与图片 token
+# 缓存: 以原图内容 sha256 + 处理参数为键写入磁盘缓存，同一张图片只处理一次；
+#      同时记录 URL → 缓存文件的映射，重复出现的 URL 不再下载；并发请求同一张图片时共享同一个处理任务
+# 降级: 下载或处理失败时保留原始 URL，不影响视觉请求本身
+# 安全: 只下载 http/https 图片，DNS 解析结果与 IP 字面量均须为公网地址（防止 SSRF 访问内网），
+#      手动跟随重定向并逐跳校验；下载与 data URL 解码前均按 max_download_bytes 限制大小
+# 配置: IMAGE_PREPROCESS_ENABLED、IMAGE_MAX_EDGE、IMAGE_QUALITY、IMAGE_CACHE_DIR、IMAGE_PREPROCESS_WORKERS、
+#      IMAGE_MAX_DOWNLOAD_BYTES
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp.abc import AbstractResolver, ResolveResult
+from dotenv import load_dotenv
+from yarl import URL
+
+load_dotenv()
+
+# 编码格式对应的 MIME 与缓存文件后缀
+FORMAT_MIME = {"JPEG": ("image/jpeg", ".jpg"), "WEBP": ("image/webp", ".webp")}
+# 允许下载的协议与最多跟随的重定向次数
+ALLOWED_SCHEMES = ("http", "https")
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+def is_public_address(host: str) -> bool:
+    """IP 是否为公网地址（私有、回环、链路本地、保留、组播、未指定地址均不是）"""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+                                 or ip.is_multicast or ip.is_unspecified)
+
+
+def check_image_url(url: URL):
+    """校验图片 URL 的协议与 IP 字面量主机，不合法时抛出 ValueError（域名在解析时校验）"""
+    if url.scheme not in ALLOWED_SCHEMES:
+        raise ValueError(f"不支持的图片协议: {url.scheme}")
+    if not url.host:
+        raise ValueError("图片 URL 缺少主机名")
+    try:
+        ipaddress.ip_address(url.host)
+    except ValueError:
+        return
+    if not is_public_address(url.host):
+        raise ValueError(f"拒绝访问非公网地址: {url.host}")
+
+
+class PublicAddressResolver(AbstractResolver):
+    """只接受公网地址的 DNS 解析器：每次建连都经过校验，重定向与 DNS 重绑定同样无法访问内网"""
+
+    def __init__(self):
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET) -> List[ResolveResult]:
+        hosts = await self._resolver.resolve(host, port, family)
+        blocked = [item["host"] for item in hosts if not is_public_address(item["host"])]
+        if blocked:
+            raise OSError(f"拒绝访问非公网地址: {host} -> {', '.join(blocked)}")
+        return hosts
+
+    async def close(self):
+        await self._resolver.close()
+
+
+def preprocess_image(data: bytes, max_edge: int, quality: int) -> Tuple[bytes, str]:
+    """
+    缩放并重新编码图片（在进程池中执行）
+    :param data: 原图内容
+    :param max_edge: 最长边像素上限
+    :param quality: 编码质量 1~95
+    :return: (编码后的内容, 编码格式 JPEG / WEBP)
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image_format = "WEBP" if has_alpha else "JPEG"
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue(), image_format
+
+
+class ImagePreprocessor:
+    """图片预处理器"""
+
+    def __init__(
+            self,
+            enabled: bool = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true",
+            max_edge: int = int(os.getenv("IMAGE_MAX_EDGE", "1536")),
+            quality: int = int(os.getenv("IMAGE_QUALITY", "85")),
+            cache_dir: str = os.getenv("IMAGE_CACHE_DIR", "local_temp_documents/image_cache"),
+            workers: int = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "2")),
+            download_concurrency: int = 8,
+            max_download_bytes: int = int(os.getenv("IMAGE_MAX_DOWNLOAD_BYTES", str(20 * 1024 * 1024))),
+            timeout: float = 60.0,
+            url_cache_size: int = 4096,
+    ):
+        """
+        初始化图片预处理器
+        Args:
+            enabled: 是否开启预处理，关闭时原样返回图片 URL
+            max_edge: 最长边像素上限
+            quality: 编码质量 1~95
+            cache_dir: 磁盘缓存目录
+            workers: Pillow 处理进程数
+            download_concurrency: 同时下载的图片数
+            max_download_bytes: 单张图片下载（或 data URL 解码）大小上限，超过时保留原始 URL
+            timeout: 单张图片下载超时（秒）
+            url_cache_size: URL → 缓存文件映射的最大条数
+        """
+        self.enabled = enabled
+        self.max_edge = max_edge
+        self.quality = min(max(quality, 1), 95)
+        self.cache_dir = cache_dir
+        self.workers = max(1, workers)
+        self.max_download_bytes = max_download_bytes
+        self.timeout = timeout
+        self.url_cache_size = url_cache_size
+        self._download_semaphore = asyncio.Semaphore(max(1, download_concurrency))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._url_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"cache_hits": 0, "processed": 0, "failed": 0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # 会话绑定创建时的事件循环，循环变化后重新创建
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(resolver=PublicAddressResolver())
+            )
+            self._session_loop = loop
+        return self._session
+
+    def _cache_path(self, digest: str) -> Optional[str]:
+        """已缓存时返回缓存文件路径"""
+        for _, suffix in FORMAT_MIME.values():
+            path = os.path.join(self.cache_dir, digest[:2], f"{digest}{suffix}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _to_data_url(path: str) -> str:
+        mime = next(mime for mime, suffix in FORMAT_MIME.values() if path.endswith(suffix))
+        with open(path, "rb") as f:
+            return f"data:{mime};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+    async def _download(self, url: str) -> bytes:
+        """下载图片（已是 data URL 时直接解码），逐跳校验重定向目标"""
+        if url.startswith("data:"):
+            payload = url.partition(",")[2]
+            if len(payload) * 3 // 4 > self.max_download_bytes:
+                raise ValueError(f"图片超过 {self.max_download_bytes} 字节")
+            return base64.b64decode(payload)
+        target = URL(url)
+        async with self._download_semaphore:
+            for _ in range(MAX_REDIRECTS + 1):
+                check_image_url(target)
+                async with self._get_session().get(target, allow_redirects=False) as response:
+                    if response.status in REDIRECT_STATUSES:
+                        location = response.headers.get("Location")
+                        if not location:
+                            raise ValueError(f"重定向缺少 Location，状态码: {response.status}")
+                        target = response.url.join(URL(location))
+                        continue
+                    if response.status != 200:
+                        raise ValueError(f"下载失败，状态码: {response.status}")
+                    if (response.content_length or 0) > self.max_download_bytes:
+                        raise ValueError(f"图片超过 {self.max_download_bytes} 字节")
+                    chunks, size = [], 0
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_download_bytes:
+                            raise ValueError(f"图片超过 {self.max_download_bytes} 字节")
+                        chunks.append(chunk)
+                    return b"".join(chunks)
+        raise ValueError(f"重定向次数超过 {MAX_REDIRECTS}")
+
+    def _write_cache(self, digest: str, data: bytes, image_format: str) -> str:
+        path = os.path.join(self.cache_dir, digest[:2], f"{digest}{FORMAT_MIME[image_format][1]}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return path
+
+    async def _process(self, data: bytes) -> str:
+        """按内容哈希查缓存，未命中时在进程池中处理并写入缓存，返回缓存文件路径"""
+        digest = hashlib.sha256(data + f"|{self.max_edge}|{self.quality}".encode("ascii")).hexdigest()
+        path = await asyncio.to_thread(self._cache_path, digest)
+        if path is not None:
+            self.stats["cache_hits"] += 1
+            return path
+        # 同一张图片并发处理时共享任务
+        if digest in self._inflight:
+            return await asyncio.shield(self._inflight[digest])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[digest] = future
+        try:
+            encoded, image_format = await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), preprocess_image, data, self.max_edge, self.quality)
+            path = await asyncio.to_thread(self._write_cache, digest, encoded, image_format)
+            self.stats["processed"] += 1
+            future.set_result(path)
+            return path
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(digest, None)
+
+    async def to_data_url(self, url: str) -> str:
+        """
+        把单张图片转换为预处理后的 data URL，失败时返回原始 URL
+        :param url: 图片 URL 或 data URL
+        """
+        if not self.enabled:
+            return url
+        try:
+            path = self._url_cache.get(url)
+            if path is not None and os.path.exists(path):
+                self._url_cache.move_to_end(url)
+                self.stats["cache_hits"] += 1
+            else:
+                path = await self._process(await self._download(url))
+                if not url.startswith("data:"):
+                    self._url_cache[url] = path
+                    while len(self._url_cache) > self.url_cache_size:
+                        self._url_cache.popitem(last=False)
+            return await asyncio.to_thread(self._to_data_url, path)
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"图片预处理失败，使用原始URL: {url[:100]} -> {str(e)}")
+            return url
+
+    async def to_data_urls(self, urls: List[str]) -> List[str]:
+        """并发预处理多张图片，保持原顺序"""
+        if not self.enabled or not urls:
+            return list(urls or [])
+        return list(await asyncio.gather(*(self.to_data_url(url) for url in urls)))
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# 全局实例
+image_preprocessor = ImagePreprocessor()
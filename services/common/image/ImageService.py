@@ -1,6 +1,9 @@
 import asyncio
+import os
 from typing import Optional, List
 from pydantic import BaseModel, Field
+from services.common.image.ImageDescriptionCache import image_description_cache
+from services.common.image.ImagePreprocessor import image_preprocessor
 from utils.OpenAIClientGenerator import OpenAIClientGenerator
 
 system_prompt = [
@@ -38,49 +41,120 @@ class MultiImageDescription(BaseModel):
     summary: Optional[str] = Field(..., description="全部图片的摘要描述")
 
 
+# 多组图片摘要合并提示词
+SUMMARY_MERGE_PROMPT = "下面是同一批图片按分组得到的若干段摘要，请合并为一段完整、连贯的整体摘要，只输出摘要内容"
+
 
 class ImageService:
     """图片服务"""
 
-    def __init__(self):
+    def __init__(
+            self,
+            chunk_size: int = int(os.getenv("IMAGE_UNDERSTANDING_CHUNK_SIZE", "4")),
+            concurrency: int = int(os.getenv("IMAGE_UNDERSTANDING_CONCURRENCY", "4")),
+    ):
+        """
+        初始化图片服务
+        Args:
+            chunk_size: 单次请求最多包含的图片数，图片较多时分组并发请求，避免单个请求体过大
+            concurrency: 同时进行的分组请求数
+        """
         self.ai_client = None
+        self.chunk_size = max(1, chunk_size)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
         self.init_ai_client()
 
     def init_ai_client(self):
         """初始化AI客户端"""
         print("初始化OpenAI客户端...")
-        self.ai_client = OpenAIClientGenerator().get_sync_client()
+        self.ai_client = OpenAIClientGenerator().get_async_client()
 
     async def visual_understanding(
             self,
             image_urls: list[str],
             prompt: str = "请详细描述这张图片的内容",
-            model: str = "gpt-4.1"
+            model: str = "gpt-4.1",
+            preprocess: bool = True
     ):
         """
         图片理解与识别
 
-        :param image_urls: 图片URL列表（支持多张图片）
+        :param image_urls: 图片URL列表（支持多张图片，超过 chunk_size 张时分组并发识别后合并）
         :param prompt: 提示词，指导AI如何分析图片
         :param model: 使用的模型，默认 gpt-4o（支持视觉）
+        :param preprocess: 是否先缩放、重新编码图片并以 data URL 内联（见 ImagePreprocessor），
+                           预处理后的图片才会查询/写入描述缓存（见 ImageDescriptionCache）
         :return: AI对图片的描述
         """
 
-        try:
-            # 构建消息内容
-            content = [
-                {"type": "text", "text": prompt}
-            ]
-
-            # 添加所有图片
-            for image_url in image_urls:
-                content.append({
-                    "type": "image_url",
-                    "image_url": {"url": image_url}
-                })
-
-            # 调用OpenAI API
-            response = self.ai_client.chat.completions.parse(
+        if not image_urls:
+            return None
+        if preprocess:
+            image_urls = await image_preprocessor.to_data_urls(image_urls)
+        # 1. 按感知哈希查描述缓存，近似重复的图片直接复用描述，只把未命中的图片交给模型
+        hashes, hits = await image_description_cache.get_many(image_urls, prompt, model)
+        missed = [i for i, hit in enumerate(hits) if hit is None]
+        descriptions: List[Optional[ImageDescription]] = [
+            None if hit is None else ImageDescription(image_index=i + 1, image_description_detail=hit["detail"])
+            for i, hit in enumerate(hits)
+        ]
+        # 单张命中的图片沿用缓存的摘要，没有摘要时以描述代替
+        summaries: List[str] = [hit.get("summary") or hit["detail"] for hit in hits if hit is not None]
+
+        # 2. 未命中的图片按 chunk_size 分组，每组一个请求，信号量限制并发
+        chunks = [missed[i:i + self.chunk_size] for i in range(0, len(missed), self.chunk_size)]
+        results = await asyncio.gather(
+            *(self._understand_chunk([image_urls[i] for i in chunk], prompt, model) for chunk in chunks),
+            return_exceptions=True)
+        if results and not summaries \
+                and all(isinstance(result, BaseException) or result is None for result in results):
+            print(f"图片理解与识别失败：{results[0]}")
+            return None
+
+        # 3. 合并各组结果，image_index 改为在全部图片中的位置，新结果写入描述缓存
+        new_entries = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, BaseException) or result is None:
+                print(f"第 {[i + 1 for i in chunk]} 张图片理解与识别失败：{result}")
+                for i in chunk:
+                    descriptions[i] = ImageDescription(image_index=i + 1,
+                                                       image_description_detail=f"图片理解与识别失败：{result}")
+                continue
+            for position, image in enumerate(sorted(result.images, key=lambda item: item.image_index)):
+                local_index = image.image_index if 1 <= image.image_index <= len(chunk) else position + 1
+                i = chunk[local_index - 1]
+                descriptions[i] = ImageDescription(image_index=i + 1,
+                                                   image_description_detail=image.image_description_detail)
+                if hashes[i] is not None:
+                    # 单图分组的摘要只描述这一张图片，可随描述一起缓存
+                    new_entries.append((hashes[i], image.image_description_detail,
+                                        result.summary if len(chunk) == 1 else None))
+            if result.summary:
+                summaries.append(result.summary)
+        await image_description_cache.put_many(new_entries, prompt, model)
+
+        # 4. 多组时把各组摘要合并为整体摘要
+        images = [description for description in descriptions if description is not None]
+        summary = summaries[0] if len(summaries) == 1 else await self._merge_summaries(summaries, model)
+        return MultiImageDescription(images=images, summary=summary)
+
+    async def _understand_chunk(self, image_urls: List[str], prompt: str, model: str) -> MultiImageDescription:
+        """单组图片理解"""
+        # 构建消息内容
+        content = [
+            {"type": "text", "text": prompt}
+        ]
+
+        # 添加本组图片
+        for image_url in image_urls:
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": image_url}
+            })
+
+        # 调用OpenAI API
+        async with self._semaphore:
+            response = await self.ai_client.chat.completions.parse(
                 model=model,
                 messages=[
                     {
@@ -97,13 +171,26 @@ class ImageService:
 
             )
 
-            # 提取响应文本
-            result: MultiImageDescription = response.choices[0].message.parsed
-
-            return result
+        # 提取响应文本
+        return response.choices[0].message.parsed
 
+    async def _merge_summaries(self, summaries: List[str], model: str) -> Optional[str]:
+        """合并各组摘要，失败时按顺序拼接"""
+        if not summaries:
+            return None
+        try:
+            response = await self.ai_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_MERGE_PROMPT},
+                    {"role": "user", "content": "\n".join(f"第{i + 1}组：{summary}" for i, summary in enumerate(summaries))}
+                ],
+                temperature=0
+            )
+            return (response.choices[0].message.content or "").strip() or "\n".join(summaries)
         except Exception as e:
-            print(f"图片理解与识别失败：{e}")
+            print(f"图片摘要合并失败：{e}")
+            return "\n".join(summaries)
 
 
 async def example_basic():
@@ -1,12 +1,14 @@
 import os
 import asyncio
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import aiohttp
 import oss2
 from dotenv import load_dotenv
-from oss2.exceptions import OssError
+from oss2.exceptions import NotFound, OssError
 from schemas.common.Result import Result
 from services.common.oss.OssServiceAbstract import OssServiceAbstract
 load_dotenv()
@@ -15,15 +17,33 @@ load_dotenv()
 class AliyunOssService(OssServiceAbstract):
     """
     阿里云OSS处理器实现类
+    传输: 超过 multipart_threshold 的文件上传走分片上传、下载走分段并行下载（每个文件 part_threads 个分片线程），
+         断点信息写入 checkpoint_dir，中断后重新调用同一对象会从已完成的分片继续
+    连接: 每个存储桶只创建一个 Bucket 对象，所有 Bucket 共享同一个 HTTP 会话（连接池）
+    线程: 同步的 oss2 调用在专用的有界线程池中执行，大文件传输不会占满事件循环的默认线程池；
+         流式上传/读取（upload_stream / iter_object）在整个传输期间占用一个线程，使用单独的流式线程池，
+         慢速的流式客户端不会挤占其他 OSS 调用
     """
 
     def __init__(self, access_key_id: Optional[str] = None, access_key_secret: Optional[str] = None,
-                 endpoint: Optional[str] = None):
+                 endpoint: Optional[str] = None,
+                 transfer_workers: int = int(os.getenv("OSS_TRANSFER_WORKERS", "4")),
+                 part_threads: int = int(os.getenv("OSS_PART_THREADS", "4")),
+                 stream_workers: int = int(os.getenv("OSS_STREAM_WORKERS", "8")),
+                 multipart_threshold: int = int(os.getenv("OSS_MULTIPART_THRESHOLD", str(10 * 1024 * 1024))),
+                 part_size: int = int(os.getenv("OSS_PART_SIZE", str(8 * 1024 * 1024))),
+                 checkpoint_dir: str = os.getenv("OSS_CHECKPOINT_DIR", "local_temp_documents/oss_checkpoints")):
         """
         初始化阿里云OSS客户端
         :param access_key_id: 阿里云AccessKey ID，为空时从环境变量ALIYUN_OSS_ACCESS_KEY_ID获取
         :param access_key_secret: 阿里云AccessKey Secret，为空时从环境变量ALIYUN_OSS_ACCESS_KEY_SECRET获取
         :param endpoint: OSS访问域名，为空时从环境变量ALIYUN_OSS_ENDPOINT获取
+        :param transfer_workers: 专用线程池大小，即同时进行的 OSS 调用数
+        :param part_threads: 单个大文件分片上传/分段下载的并发分片数
+        :param stream_workers: 流式线程池大小，即同时进行的流式上传/读取数
+        :param multipart_threshold: 超过该字节数的文件使用分片上传/分段并行下载
+        :param part_size: 分片大小（字节）
+        :param checkpoint_dir: 断点续传信息目录
         """
         # 从.env文件或环境变量中获取配置
         self.access_key_id = access_key_id or os.getenv('ALIYUN_AK_ID')
@@ -36,13 +56,40 @@ class AliyunOssService(OssServiceAbstract):
 
         self.auth = oss2.Auth(self.access_key_id, self.access_key_secret)
 
+        self.part_threads = max(1, part_threads)
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.checkpoint_dir = checkpoint_dir
+        self._executor = ThreadPoolExecutor(max_workers=max(1, transfer_workers), thread_name_prefix="oss")
+        self._stream_executor = ThreadPoolExecutor(max_workers=max(1, stream_workers), thread_name_prefix="oss-stream")
+        # 连接池需覆盖全部传输线程、分片线程与流式线程
+        self._session = oss2.Session(pool_size=max(1, transfer_workers) * self.part_threads + max(1, stream_workers))
+        self._buckets: Dict[str, oss2.Bucket] = {}
+        self._buckets_lock = threading.Lock()
+
     def _get_bucket(self, bucket_name: Optional[str] = "hdd-agent-image") -> oss2.Bucket:
         """
-        获取Bucket对象
+        获取Bucket对象（按名称缓存，共享HTTP会话）
         :param bucket_name: 存储桶名称
         :return: Bucket对象
         """
-        return oss2.Bucket(self.auth, self.endpoint, bucket_name)
+        bucket = self._buckets.get(bucket_name)
+        if bucket is None:
+            with self._buckets_lock:
+                bucket = self._buckets.get(bucket_name)
+                if bucket is None:
+                    bucket = oss2.Bucket(self.auth, self.endpoint, bucket_name, session=self._session)
+                    self._buckets[bucket_name] = bucket
+        return bucket
+
+    async def _run(self, func, *args):
+        """在专用线程池中执行同步的 oss2 调用"""
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        """关闭专用线程池与流式线程池"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._stream_executor.shutdown(wait=False, cancel_futures=True)
 
     async def upload_file(self, file_path: str, object_name: Optional[str] = 'local_temp_documents/', bucket_name: Optional[str] = "hdd-agent-image") -> Result:
         """
@@ -63,13 +110,18 @@ class AliyunOssService(OssServiceAbstract):
 
             def _upload():
                 bucket = self._get_bucket(bucket_name)
-                # 上传文件
-                result = bucket.put_object_from_file(object_name, file_path)
+                # 小文件单次上传，大文件分片并发上传并记录断点
+                result = oss2.resumable_upload(
+                    bucket, object_name, file_path,
+                    store=oss2.ResumableStore(root=self.checkpoint_dir),
+                    multipart_threshold=self.multipart_threshold,
+                    part_size=self.part_size,
+                    num_threads=self.part_threads
+                )
                 print(result)
                 return result.status == 200
-            # 使用asyncio在线程池中执行
-            loop = asyncio.get_event_loop()
-            success = await loop.run_in_executor(None, _upload)
+            # 在专用线程池中执行
+            success = await self._run(_upload)
 
             if success:
                 print(f"文件上传成功: {file_path} -> https://{bucket_name}.{self.endpoint}/{object_name}")
@@ -84,10 +136,81 @@ class AliyunOssService(OssServiceAbstract):
             print(f"上传文件时发生错误: {e}")
             return Result(code=500, message="上传失败", data=None)
 
-    async def download_file_from_oss(self, object_name: Optional[str], file_path: Optional[str], bucket_name: Optional[str] = "tx-factory") -> bool:
+    async def upload_stream(self, chunks: AsyncIterator[bytes], object_name: str,
+                            bucket_name: Optional[str] = "hdd-agent-image", content_type: Optional[str] = None,
+                            queue_size: int = 8) -> Result:
         """
-        从阿里云OSS下载文件
+        边接收边上传到阿里云OSS，不在内存中拼接整个对象
+        原理: 异步数据块经有界 asyncio.Queue 交给工作线程（run_coroutine_threadsafe 阻塞取块），oss2 以 chunked 编码流式上传；
+             队列满时生产方等待，上传线程提前结束时生产方停止读取，生产方出错或被取消时放入中断标记结束上传线程
+        :param chunks: 异步数据块迭代器，例如 aiohttp 响应的 iter_chunked
+        :param object_name: OSS中的对象名称（完整路径）
         :param bucket_name: OSS存储桶名称
+        :param content_type: 对象的 Content-Type
+        :param queue_size: 队列中最多缓冲的数据块数
+        :return: Result对象，成功时data为对象URL
+        """
+        loop = asyncio.get_event_loop()
+        pending: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        finished = object()
+        aborted = object()
+
+        def _iter_chunks():
+            while True:
+                item = asyncio.run_coroutine_threadsafe(pending.get(), loop).result()
+                if item is finished:
+                    return
+                if item is aborted:
+                    raise IOError("数据源中断，上传已取消")
+                yield item
+
+        def _upload():
+            headers = {"Content-Type": content_type} if content_type else None
+            result = self._get_bucket(bucket_name).put_object(object_name, _iter_chunks(), headers=headers)
+            return result.status == 200
+
+        upload = loop.run_in_executor(self._stream_executor, _upload)
+
+        async def _put(item) -> bool:
+            # 入队与上传线程结束谁先完成，上传线程已结束时放弃入队
+            if upload.done():
+                return False
+            put = asyncio.ensure_future(pending.put(item))
+            await asyncio.wait({put, upload}, return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                put.cancel()
+                return False
+            return True
+
+        try:
+            async for chunk in chunks:
+                if chunk and not await _put(chunk):
+                    break
+            await _put(finished)
+            if not await upload:
+                return Result(code=500, message="文件上传失败", data=None)
+            url = f"https://{bucket_name}.{self.endpoint}/{object_name}"
+            print(f"文件流式上传成功: {url}")
+            return Result(code=200, message="文件上传成功", data=url)
+        except OssError as e:
+            print(f"OSS错误: {e}")
+            return Result(code=500, message="上传失败", data=None)
+        except Exception as e:
+            print(f"流式上传时发生错误: {e}")
+            return Result(code=500, message="上传失败", data=None)
+        finally:
+            if not upload.done():
+                # 清空队列后放入中断标记，唤醒阻塞在取块上的上传线程
+                while not pending.empty():
+                    pending.get_nowait()
+                pending.put_nowait(aborted)
+                # 上传线程随后以异常结束，取走异常避免未读取告警
+                upload.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    async def download_file_from_oss(self, object_name: Optional[str], file_path: Optional[str], bucket_name: Optional[str] = "hdd-agent-image") -> bool:
+        """
+        从阿里云OSS下载文件
+        :param bucket_name: OSS存储桶名称，默认与改造前实际下载的存储桶一致（hdd-agent-image）
         :param object_name: OSS中的对象名称（文件路径）
         :param file_path: 本地保存文件路径
         :return: 下载成功返回True，失败返回False
@@ -97,20 +220,23 @@ class AliyunOssService(OssServiceAbstract):
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
             def _download():
-                bucket = self._get_bucket()
-                # 检查对象是否存在
-                if not bucket.object_exists(object_name):
+                bucket = self._get_bucket(bucket_name)
+                try:
+                    # 小文件单次下载，大文件分段并行下载并记录断点（先写临时文件，完成后改名）
+                    oss2.resumable_download(
+                        bucket, object_name, file_path,
+                        multiget_threshold=self.multipart_threshold,
+                        part_size=self.part_size,
+                        num_threads=self.part_threads,
+                        store=oss2.ResumableDownloadStore(root=self.checkpoint_dir)
+                    )
+                except NotFound:
                     print(f"OSS中文件不存在: {bucket_name}/{object_name}")
                     return False
-
-                # 下载文件
-                result = bucket.get_object_to_file(object_name, file_path)
-                print(result)
                 return True
 
-            # 使用asyncio在线程池中执行
-            loop = asyncio.get_event_loop()
-            success = await loop.run_in_executor(None, _download)
+            # 在专用线程池中执行
+            success = await self._run(_download)
 
             if success:
                 print(f"文件下载成功: {bucket_name}/{object_name} -> {file_path}")
@@ -138,13 +264,7 @@ class AliyunOssService(OssServiceAbstract):
         try:
             print(f"正在读取文件: {object_name}")
             # 如果传入的是完整URL，提取object_name
-
-            if object_name.startswith('http://') or object_name.startswith('https://'):
-                # 解析URL，提取对象名称
-                # 格式: https://bucket-name.endpoint/object-name
-                url_parts = object_name.split('/')
-                # 找到endpoint后的所有部分作为object_name
-                object_name = '/'.join(url_parts[3:])
+            object_name = self._parse_object_name(object_name)
 
             def _read():
                 bucket = self._get_bucket(bucket_name)
@@ -160,9 +280,8 @@ class AliyunOssService(OssServiceAbstract):
                 content = result.read()
                 return content
 
-            # 使用asyncio在线程池中执行
-            loop = asyncio.get_event_loop()
-            content = await loop.run_in_executor(None, _read)
+            # 在专用线程池中执行
+            content = await self._run(_read)
 
             if content is not None:
                 print(f"文件读取成功: {bucket_name}/{object_name}, 大小: {len(content)} bytes")
@@ -189,6 +308,95 @@ class AliyunOssService(OssServiceAbstract):
             print(f"读取文件时发生错误: {e}")
             return Result(code=500, message=f"读取失败: {str(e)}", data=None)
 
+    async def iter_object(self, object_name: str, chunk_size: int = 64 * 1024,
+                          byte_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                          bucket_name: Optional[str] = "tx-factory", queue_size: int = 4) -> AsyncIterator[bytes]:
+        """
+        按块流式读取OSS对象，整个对象不需要放入内存
+        原理: 流式线程池中的工作线程按 chunk_size 读取响应体，经有界队列交给事件循环（预读不超过 queue_size 块）；
+             消费方提前结束（例如客户端断开）时通知工作线程停止并关闭连接
+        用法: 可直接作为 FastAPI StreamingResponse 的 body，或逐块写入文件/交给文档入库
+        :param object_name: OSS中的对象名称（文件路径），可以是完整URL或对象路径
+        :param chunk_size: 每块字节数
+        :param byte_range: 字节范围 (start, end)，两端都包含，与 oss2 的 byte_range 一致，None 表示整个对象
+        :param bucket_name: OSS存储桶名称
+        :param queue_size: 队列中最多缓冲的块数
+        :raises NotFound: 对象不存在
+        :raises OssError: 其他OSS错误
+        """
+        object_name = self._parse_object_name(object_name)
+        loop = asyncio.get_event_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        stopped = threading.Event()
+        finished = object()
+
+        def _put(item):
+            # 队列满时阻塞工作线程，实现背压；消费方停止后放弃入队
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except FutureTimeoutError:
+                    if stopped.is_set():
+                        future.cancel()
+                        return
+
+        def _read():
+            try:
+                result = self._get_bucket(bucket_name).get_object(object_name, byte_range=byte_range)
+                try:
+                    while not stopped.is_set():
+                        chunk = result.read(chunk_size)
+                        if not chunk:
+                            break
+                        _put(chunk)
+                finally:
+                    result.resp.response.close()
+                if not stopped.is_set():
+                    _put(finished)
+            except Exception as e:
+                if not stopped.is_set():
+                    _put(e)
+
+        loop.run_in_executor(self._stream_executor, _read)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            # 清空队列，让阻塞在入队上的工作线程继续执行并退出
+            while not chunks.empty():
+                chunks.get_nowait()
+
+    async def list_objects(self, prefix: str = "", bucket_name: Optional[str] = "tx-factory") -> List[dict]:
+        """
+        列出前缀下的全部对象（自动翻页，跳过目录占位对象）
+        :param prefix: 对象名前缀
+        :param bucket_name: OSS存储桶名称
+        :return: [{"key", "size", "last_modified"（秒级时间戳）, "etag"}, ...]
+        """
+        def _list():
+            return [
+                {"key": info.key, "size": info.size, "last_modified": info.last_modified, "etag": info.etag}
+                for info in oss2.ObjectIteratorV2(self._get_bucket(bucket_name), prefix=prefix, max_keys=1000)
+                if not info.key.endswith("/")
+            ]
+
+        return await self._run(_list)
+
+    @staticmethod
+    def _parse_object_name(object_name: str) -> str:
+        """完整URL（https://bucket-name.endpoint/object-name）转换为对象名称，其他原样返回"""
+        if object_name.startswith('http://') or object_name.startswith('https://'):
+            # 找到endpoint后的所有部分作为object_name
+            return '/'.join(object_name.split('/')[3:])
+        return object_name
+
     # noinspection PyMethodMayBeStatic
     async def download_image_to_local_temp(self, url: str, local_temp_dir: str = "local_temp_documents") -> Optional[str]:
         """下载图片到指定的本地临时目录"""
@@ -209,7 +417,7 @@ class AliyunOssService(OssServiceAbstract):
                     if response.status == 200:
                         # 根据Content-Type确定文件后缀
                         content_type = response.headers.get('content-type', '').lower()
-                        suffix = self._get_suffix_from_content_type(content_type)
+                        suffix = self.get_suffix_from_content_type(content_type)
 
                         # 2. 生成一个唯一的文件名
                         file_name = f"{uuid.uuid4()}{suffix}"
@@ -228,8 +436,8 @@ class AliyunOssService(OssServiceAbstract):
             print(f"下载图片异常: {str(e)}")
             return None
 
-    # noinspection PyMethodMayBeStatic
-    def _get_suffix_from_content_type(self, content_type: str) -> str:
+    @staticmethod
+    def get_suffix_from_content_type(content_type: str) -> str:
         """根据Content-Type获取文件后缀"""
         content_type_map = {
             'image/jpeg': '.jpg',
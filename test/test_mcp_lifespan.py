@@ -0,0 +1,93 @@
+"""
+# MCP 服务启动测试
+# 原理: 直接进入各服务的 lifespan，检查定时任务在调度器启动后注册并带有下次执行时间，退出时调度器关闭
+"""
+
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("MEMORY_VECTOR_STORE", "local")
+os.environ.setdefault("LOCAL_VECTOR_STORE_DIR", tempfile.mkdtemp())
+
+from utils.common.scheduler.DynamicScheduler import DynamicScheduler
+
+
+def _enter_lifespan(module, server):
+    """进入并退出一次 lifespan，返回进入期间的任务列表与调度器状态"""
+
+    async def run():
+        async with module.lifespan(server):
+            jobs = {job["id"]: job for job in module.scheduler.get_jobs()}
+            running = module.scheduler._is_running
+        return jobs, running, module.scheduler._is_running
+
+    return asyncio.run(run())
+
+
+def test_long_memory_lifespan_registers_jobs_after_start(monkeypatch):
+    from mcp_server.common.long_memory_mcp import LongMemoryMCP
+
+    # 每个用例使用新的调度器，AsyncIOScheduler 会绑定首次启动时的事件循环
+    monkeypatch.setattr(LongMemoryMCP, "scheduler", DynamicScheduler())
+    jobs, running, running_after = _enter_lifespan(LongMemoryMCP, LongMemoryMCP.mcp)
+
+    assert running and not running_after
+    assert jobs["memory_consolidation"]["next_run_time"] is not None
+
+
+def test_long_memory_lifespan_registers_document_ingest(monkeypatch, tmp_path):
+    from mcp_server.common.long_memory_mcp import LongMemoryMCP
+    from mcp_server.common.long_memory_mcp.DocumentIngestor import document_ingestor
+
+    monkeypatch.setattr(LongMemoryMCP, "scheduler", DynamicScheduler())
+    monkeypatch.setattr(document_ingestor, "roots", [str(tmp_path)])
+    monkeypatch.setattr(document_ingestor, "db_path", str(tmp_path / "ingest.sqlite3"))
+    jobs, running, running_after = _enter_lifespan(LongMemoryMCP, LongMemoryMCP.mcp)
+
+    assert running and not running_after
+    assert jobs["document_ingest"]["next_run_time"] is not None
+
+
+def test_document_lifespan_awaits_index_build(monkeypatch, tmp_path):
+    from mcp_server.common.doucment_mcp import DocumentMCP
+    from mcp_server.common.doucment_mcp.FileIndex import FileIndex
+
+    for i in range(50):
+        (tmp_path / f"{i}.txt").write_text("x", encoding="utf-8")
+    index = FileIndex(roots=[str(tmp_path)], db_path=str(tmp_path / "index.sqlite3"))
+    monkeypatch.setattr(DocumentMCP, "file_index", index)
+    monkeypatch.setattr(DocumentMCP, "scheduler", DynamicScheduler())
+
+    async def run():
+        async with DocumentMCP.lifespan(DocumentMCP.mcp):
+            jobs = {job["id"]: job for job in DocumentMCP.scheduler.get_jobs()}
+            # 不等后台构建完成直接关闭：退出时不应遗留任务或在已关闭的连接上写入
+        return jobs, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    jobs, leftover = asyncio.run(run())
+    assert jobs["document_file_index_refresh"]["next_run_time"] is not None
+    assert not leftover
+    assert not DocumentMCP.scheduler._is_running
+    assert index.refresh() is None
+
+
+def test_image_lifespan_shuts_down_oss_service(monkeypatch):
+    from mcp_server.common.image_mcp import ImageMCP
+
+    class FakeOssService:
+        closed = False
+
+        def shutdown(self):
+            self.closed = True
+
+    service = FakeOssService()
+    monkeypatch.setattr(ImageMCP, "_oss_service", service)
+
+    async def run():
+        async with ImageMCP.lifespan(ImageMCP.mcp):
+            pass
+
+    asyncio.run(run())
+    assert service.closed and ImageMCP._oss_service is None
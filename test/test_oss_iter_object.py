@@ -0,0 +1,143 @@
+"""
+# OSS 流式读取测试
+# 原理: 用内存中的假 Bucket 替换 oss2.Bucket，检查 iter_object 的背压（工作线程预读不超过 queue_size 块）、
+#      消费方提前关闭时工作线程停止读取并关闭连接，以及 DocumentIngestor.ingest_oss 经 iter_object 入库
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("MEMORY_VECTOR_STORE", "local")
+os.environ.setdefault("LOCAL_VECTOR_STORE_DIR", tempfile.mkdtemp())
+
+from services.common.oss.AliyunOssService import AliyunOssService
+
+
+class FakeObject:
+    """oss2.GetObjectResult 的替身：记录读取次数与连接是否关闭"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+        self.reads = 0
+        self.closed = threading.Event()
+        self.resp = SimpleNamespace(response=SimpleNamespace(close=self.closed.set))
+
+    def read(self, size: int) -> bytes:
+        self.reads += 1
+        chunk = self.data[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+class FakeBucket:
+    def __init__(self, objects: dict):
+        self.objects = objects
+        self.opened = []
+
+    def get_object(self, key: str, byte_range=None) -> FakeObject:
+        result = FakeObject(self.objects[key])
+        self.opened.append(result)
+        return result
+
+
+def _service(monkeypatch, objects: dict):
+    service = AliyunOssService("test", "test", "oss-cn-hangzhou.aliyuncs.com", stream_workers=2)
+    bucket = FakeBucket(objects)
+    monkeypatch.setattr(service, "_get_bucket", lambda bucket_name=None: bucket)
+    return service, bucket
+
+
+async def _wait_until(predicate, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+def test_iter_object_backpressure(monkeypatch):
+    data = bytes(range(256)) * 40
+    service, bucket = _service(monkeypatch, {"big.bin": data})
+
+    async def run():
+        stream = service.iter_object("big.bin", chunk_size=16, queue_size=2)
+        first = await stream.__anext__()
+        await asyncio.sleep(0.3)
+        paused_reads = bucket.opened[0].reads
+        await asyncio.sleep(0.3)
+        # 消费方暂停时工作线程阻塞在入队上：已取走 1 块 + 队列 2 块 + 阻塞中的 1 块
+        assert bucket.opened[0].reads == paused_reads <= 4
+        rest = [chunk async for chunk in stream]
+        assert first + b"".join(rest) == data
+        assert await _wait_until(bucket.opened[0].closed.is_set)
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.shutdown()
+
+
+def test_iter_object_early_close_stops_worker(monkeypatch):
+    service, bucket = _service(monkeypatch, {"big.bin": b"x" * 100_000})
+
+    async def run():
+        stream = service.iter_object("big.bin", chunk_size=16, queue_size=2)
+        await stream.__anext__()
+        await stream.aclose()
+        # 工作线程停止读取并关闭连接，不会把剩余内容读完
+        assert await _wait_until(bucket.opened[0].closed.is_set)
+        reads = bucket.opened[0].reads
+        await asyncio.sleep(0.2)
+        assert bucket.opened[0].reads == reads < 100_000 // 16
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.shutdown()
+
+
+def test_ingest_oss_streams_objects(monkeypatch, tmp_path):
+    from mcp_server.common.long_memory_mcp.DocumentIngestor import DocumentIngestor
+    from mcp_server.common.long_memory_mcp.OpenAIMemorySystem import OpenAIMemorySystem
+
+    objects = {"docs/a.md": "第一段内容。\n\n第二段内容。".encode("utf-8"), "docs/b.txt": b"hello oss",
+               "docs/image.png": b"\x89PNG", "docs/large.md": b"y" * 1_000_000}
+    service, bucket = _service(monkeypatch, objects)
+
+    async def list_objects(prefix: str = "", bucket_name=None):
+        return [{"key": key, "size": len(data) if key != "docs/large.md" else 100, "last_modified": 1, "etag": key}
+                for key, data in objects.items() if key.startswith(prefix)]
+
+    async def get_embeddings(texts, dimensions=None):
+        return [[float(len(text) % 7 + 1)] + [1.0] * 7 for text in texts]
+
+    monkeypatch.setattr(service, "list_objects", list_objects)
+    memory = OpenAIMemorySystem(collection_name="test_oss_documents", write_behind=False, dedup_threshold=None)
+    monkeypatch.setattr(memory, "get_embeddings", get_embeddings)
+    ingestor = DocumentIngestor(memory, roots=[], db_path=str(tmp_path / "ingest.sqlite3"), max_file_bytes=1000)
+    ingestor._oss_service = service
+
+    async def run():
+        first = await ingestor.ingest_oss("docs/")
+        again = await ingestor.ingest_oss("docs/")
+        objects.pop("docs/b.txt")
+        removed = await ingestor.ingest_oss("docs/")
+        return first, again, removed
+
+    try:
+        first, again, removed = asyncio.run(run())
+    finally:
+        ingestor.close()
+
+    assert first.code == 200 and first.data["ingested"] == 2 and first.data["scanned"] == 3
+    # 实际内容超过大小上限的对象提前关闭读取并记为失败
+    assert [item["path"] for item in first.data["failed"]] == ["oss://tx-factory/docs/large.md"]
+    large = [result for result in bucket.opened if result.data == objects["docs/large.md"]][0]
+    assert large.closed.is_set() and large.position < len(large.data)
+    assert again.data["ingested"] == 0 and again.data["unchanged"] == 2
+    assert removed.data["removed"] == 1
@@ -81,7 +81,8 @@ class DynamicScheduler:
             replace_existing=replace_existing
         )
 
-        self.logger.info(f"添加间隔任务: {job_id}, 下次执行: {job.next_run_time}")
+        # 调度器启动前添加的任务处于待定状态，尚未计算 next_run_time
+        self.logger.info(f"添加间隔任务: {job_id}, 下次执行: {getattr(job, 'next_run_time', None)}")
         return job_id
 
     def add_cron_job(self,
@@ -136,7 +137,7 @@ class DynamicScheduler:
             replace_existing=replace_existing
         )
 
-        self.logger.info(f"添加Cron任务: {job_id}, 下次执行: {job.next_run_time}")
+        self.logger.info(f"添加Cron任务: {job_id}, 下次执行: {getattr(job, 'next_run_time', None)}")
         return job_id
 
     def add_date_job(self,
@@ -168,7 +169,7 @@ class DynamicScheduler:
             replace_existing=replace_existing
         )
 
-        self.logger.info(f"添加一次性任务: {job_id}, 执行时间: {job.next_run_time}")
+        self.logger.info(f"添加一次性任务: {job_id}, 执行时间: {getattr(job, 'next_run_time', None)}")
         return job_id
 
     def remove_job(self, job_id: str) -> bool: